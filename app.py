@@ -1,27 +1,47 @@
 import streamlit as st
+import pandas as pd
 import re
 import os
-from datetime import datetime
+import threading
+import importlib.util
+from datetime import datetime, timedelta
 from vietnamese_sentiment import VietnameseSentimentAnalyzer
+from result_cache import SentimentResultCache
+from bulk_jobs import BulkJobRegistry, UPLOAD_FORMATS, read_upload, to_file_bytes
 from database import (
-    get_timestamp, insert_sentiment_analysis, 
-    init_database, get_sentiment_analysis
+    get_timestamp, enqueue_sentiment_analysis,
+    init_database, get_sentiment_analysis, get_history,
+    get_summary, get_summary_timeseries, search_history
 )
 
 # Khởi tạo database
 init_database()
 
 
-# Import các thư viện ML 
-try:
-    import torch
-    from transformers import AutoTokenizer, AutoModelForSequenceClassification
-    import numpy as np
-    ML_LIBRARIES_AVAILABLE = True
-except ImportError:
-    ML_LIBRARIES_AVAILABLE = False
+# Kiểm tra các thư viện ML (chỉ tìm package, chưa import để khởi động nhanh;
+# vietnamese_sentiment sẽ import khi cần load model)
+ML_LIBRARIES_AVAILABLE = all(
+    importlib.util.find_spec(name) is not None
+    for name in ("torch", "transformers", "underthesea", "numpy")
+)
+if not ML_LIBRARIES_AVAILABLE:
     st.warning("⚠️ Các thư viện ML chưa được cài đặt. Chạy: pip install -r requirements.txt")
 
+# Bộ lọc của tab Lịch sử: tên hiển thị -> label trong database
+HISTORY_FILTERS = {
+    "Tất cả": None,
+    "😊 Tích cực": "POS",
+    "😢 Tiêu cực": "NEG",
+    "😐 Trung tính": "NEU",
+}
+
+# Tab Hàng loạt: số dòng mỗi batch (mỗi batch một lần ghi database) và chu kỳ cập nhật tiến độ
+BULK_BATCH_SIZE = 32
+BULK_REFRESH_SECONDS = 1.0
+
+# Đặt SENTIMENT_EAGER_LOAD=1 để load model ngay khi khởi động thay vì ở lần phân loại đầu tiên
+EAGER_LOAD = os.environ.get("SENTIMENT_EAGER_LOAD", "0") == "1"
+
 # Cấu hình trang
 st.set_page_config(
     page_title="Phân Loại Cảm Xúc Văn Bản",
@@ -79,8 +99,8 @@ st.markdown("""
 st.markdown('<p class="main-header">Trợ lý phân loại cảm xúc văn bản tiếng Việt</p>', unsafe_allow_html=True)
 st.markdown('<p class="sub-header">Nhập văn bản của bạn để phân loại cảm xúc</p>', unsafe_allow_html=True)
 
-# Tabs cho Phân loại và Lịch sử
-tab1, tab2 = st.tabs(["🔍 Phân loại", "📜 Lịch sử"])
+# Tabs cho Phân loại, Hàng loạt và Lịch sử
+tab_single, tab_bulk, tab_history = st.tabs(["🔍 Phân loại", "📂 Hàng loạt", "📜 Lịch sử"])
 
 # Khởi tạo session state cho lịch sử và analyzer
 if 'analyzer_loaded' not in st.session_state:
@@ -109,12 +129,30 @@ def load_sentiment_analyzer():
     if not ML_LIBRARIES_AVAILABLE:
         return None
     try:
-        analyzer = VietnameseSentimentAnalyzer()
+        # Cache kết quả dùng chung cho mọi session (bộ nhớ + SQLite)
+        analyzer = VietnameseSentimentAnalyzer(cache=SentimentResultCache())
+        if EAGER_LOAD:
+            analyzer.warmup()
         return analyzer
     except Exception as e:
         st.error(f"Lỗi khi load analyzer: {str(e)}")
         return None
 
+# Lock dùng chung cho mọi lần gọi analyzer (session và job hàng loạt): cache và
+# thống kê của analyzer không thread-safe
+@st.cache_resource
+def get_analyzer_lock():
+    return threading.Lock()
+
+# Registry job hàng loạt dùng chung cho mọi session, không mất khi script chạy lại
+@st.cache_resource
+def get_bulk_jobs():
+    return BulkJobRegistry()
+
+# Eager mode: load model ngay ở lần chạy script đầu tiên của process
+if EAGER_LOAD and st.session_state.analyzer is None:
+    st.session_state.analyzer = load_sentiment_analyzer()
+
 def validate_text(text):
     """
     Validate văn bản đầu vào
@@ -168,7 +206,8 @@ def classify_emotion(text):
     if st.session_state.analyzer is None:
         return None
     
-    return st.session_state.analyzer.analyze_sentiment(text)
+    with get_analyzer_lock():
+        return st.session_state.analyzer.analyze_sentiment(text)
 
 # Map sentiment label -> tiếng việt
 def map_sentiment_label(sentiment_label):
@@ -234,11 +273,11 @@ def create_scores_dict(sentiment_label, confidence, all_scores=None):
     
     return scores
 
-def save_result_to_database(text, sentiment, confidence, timestamp):
+def save_result_to_database(text, sentiment, confidence, timestamp, normalized_text=None, tier=None):
     """
-    Lưu kết quả vào database
+    Lưu kết quả vào database (ghi trễ ở thread nền, không chờ ghi đĩa)
     """
-    insert_sentiment_analysis(text, sentiment, confidence, timestamp)
+    enqueue_sentiment_analysis(text, sentiment, confidence, timestamp, normalized_text, tier)
 
 def get_result_from_database():
     """
@@ -246,7 +285,7 @@ def get_result_from_database():
     """
     return get_sentiment_analysis()
 
-with tab1:
+with tab_single:
     st.header("📝 Nhập văn bản")
     text_input = st.text_area(
         "Nhập văn bản cần phân loại cảm xúc:",
@@ -335,7 +374,8 @@ with tab1:
                         st.success(cleaned_text)
                     
                     # Lưu kết quả vào database sqlite
-                    save_result_to_database(original_text, sentiment_label, confidence, get_timestamp())
+                    save_result_to_database(original_text, sentiment_label, confidence, get_timestamp(), cleaned_text,
+                                            result.get('tier'))
 
                     st.success("✅ Kết quả đã được lưu vào lịch sử!")
                 else:
@@ -344,45 +384,193 @@ with tab1:
     elif classify_button and not text_input:
         st.warning("⚠️ Vui lòng nhập văn bản trước khi phân loại!")
 
-with tab2:
+def show_bulk_job(job_id, polling=False):
+    """
+    Hiển thị tiến độ và kết quả tạm của job hàng loạt
+
+    Được chạy như st.fragment: khi job đang chạy chỉ fragment này tự chạy lại
+    theo chu kỳ (polling=True), phần còn lại của trang vẫn tương tác bình thường.
+    """
+    job = get_bulk_jobs().get(job_id)
+    if job is None:
+        st.info("📭 Job không còn tồn tại (app đã khởi động lại).")
+        return
+
+    progress = job.progress()
+    st.progress(progress['fraction'],
+                text=f"{progress['rows_done']}/{progress['total_rows']} dòng "
+                     f"- {progress['rows_per_sec']:.1f} dòng/s")
+
+    if job.is_active():
+        if st.button("⏹️ Hủy job", key=f"cancel_{job_id}"):
+            job.cancel()
+            st.toast("Đang dừng job sau batch hiện tại...")
+    elif progress['status'] == "done":
+        st.success(f"✅ Đã chấm điểm {progress['rows_done']} dòng trong {progress['elapsed_seconds']:.1f}s")
+    elif progress['status'] == "cancelled":
+        st.warning(f"⏹️ Job đã bị hủy sau {progress['rows_done']} dòng")
+    else:
+        st.error(f"❌ Lỗi khi chấm điểm: {progress['error']}")
+
+    results = job.results_frame()
+    st.dataframe(results.tail(200) if job.is_active() else results, use_container_width=True)
+
+    if not job.is_active() and len(results):
+        base_name = os.path.splitext(job.file_name)[0] or "ket_qua"
+        download_cols = st.columns(2)
+        with download_cols[0]:
+            st.download_button("⬇️ Tải CSV", to_file_bytes(results, "csv"), file_name=f"{base_name}_scored.csv",
+                               mime="text/csv", key=f"download_csv_{job_id}", use_container_width=True)
+        with download_cols[1]:
+            st.download_button("⬇️ Tải XLSX", to_file_bytes(results, "xlsx"), file_name=f"{base_name}_scored.xlsx",
+                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                               key=f"download_xlsx_{job_id}", use_container_width=True)
+
+    # Job vừa kết thúc: chạy lại cả trang để dừng tự cập nhật
+    if polling and not job.is_active():
+        st.rerun(scope="app")
+
+with tab_bulk:
+    st.header("📂 Phân loại hàng loạt")
+    uploaded_file = st.file_uploader("Chọn file CSV, XLSX hoặc TXT (mỗi dòng một văn bản):",
+                                     type=list(UPLOAD_FORMATS), key="bulk_file")
+
+    if uploaded_file is not None:
+        try:
+            bulk_frame = read_upload(uploaded_file.name, uploaded_file.getvalue())
+        except Exception as e:
+            bulk_frame = None
+            st.error(f"❌ Không đọc được file: {str(e)}")
+
+        if bulk_frame is not None and bulk_frame.empty:
+            st.warning("⚠️ File không có dòng nào!")
+        elif bulk_frame is not None:
+            columns = list(bulk_frame.columns)
+            text_column = st.selectbox("Cột văn bản", columns,
+                                       index=columns.index("text") if "text" in columns else 0,
+                                       key="bulk_text_column")
+            st.caption(f"{len(bulk_frame)} dòng")
+            st.dataframe(bulk_frame.head(10), use_container_width=True)
+
+            active_job = get_bulk_jobs().get(st.session_state.get('bulk_job_id'))
+            if st.button("🚀 Chấm điểm", type="primary",
+                         disabled=active_job is not None and active_job.is_active()):
+                if st.session_state.analyzer is None:
+                    st.session_state.analyzer = load_sentiment_analyzer()
+                if st.session_state.analyzer is None:
+                    st.error("❌ Không thể load sentiment analyzer. Vui lòng kiểm tra lại cài đặt!")
+                else:
+                    job = get_bulk_jobs().start(st.session_state.analyzer, bulk_frame, text_column,
+                                                file_name=uploaded_file.name, batch_size=BULK_BATCH_SIZE,
+                                                lock=get_analyzer_lock())
+                    st.session_state.bulk_job_id = job.job_id
+
+    # Job của session được giữ qua các lần chạy lại (job_id trong session_state)
+    bulk_job = get_bulk_jobs().get(st.session_state.get('bulk_job_id'))
+    if bulk_job is not None:
+        st.markdown("---")
+        st.subheader(f"⚙️ Job {bulk_job.job_id} - {bulk_job.file_name}")
+        polling = bulk_job.is_active()
+        st.fragment(show_bulk_job, run_every=BULK_REFRESH_SECONDS if polling else None)(bulk_job.job_id, polling)
+
+with tab_history:
     st.header("📜 Lịch sử phân loại")
     
-    # Lấy dữ liệu từ database
-    history_data = get_result_from_database()
+    # Thống kê đọc từ bảng tổng hợp (vài dòng), không load toàn bộ lịch sử
+    summary = get_summary()
     
-    if len(history_data) == 0:
+    if summary['total'] == 0:
         st.info("📭 Chưa có lịch sử phân loại nào. Hãy phân loại một văn bản để bắt đầu!")
     else:
         # Thống kê tổng quan
         st.subheader("📊 Thống kê tổng quan")
-        total_count = len(history_data)
+        total_count = summary['total']
         
-        # Đếm theo sentiment label (row format: id, text, sentiment, confidence, timestamp)
-        positive_count = sum(1 for row in history_data if "POS" in str(row[2]).upper())
-        negative_count = sum(1 for row in history_data if "NEG" in str(row[2]).upper())
-        neutral_count = total_count - positive_count - negative_count
+        # Gộp số lần theo label tiếng Việt
+        emotion_counts = {"Tích cực": 0, "Tiêu cực": 0, "Trung tính": 0}
+        for label, count in summary['counts'].items():
+            emotion_counts[map_sentiment_label(str(label))[0]] += count
         
-        stat_cols = st.columns(4)
+        stat_cols = st.columns(5)
         with stat_cols[0]:
             st.metric("Tổng số", total_count)
         with stat_cols[1]:
-            st.metric("😊 Tích cực", positive_count)
+            st.metric("😊 Tích cực", emotion_counts["Tích cực"])
         with stat_cols[2]:
-            st.metric("😢 Tiêu cực", negative_count)
+            st.metric("😢 Tiêu cực", emotion_counts["Tiêu cực"])
         with stat_cols[3]:
-            st.metric("😐 Trung tính", neutral_count)
+            st.metric("😐 Trung tính", emotion_counts["Trung tính"])
+        with stat_cols[4]:
+            st.metric("📈 Độ tin cậy TB", f"{summary['overall_mean_confidence']:.1%}")
+
+        # Biểu đồ theo thời gian (từ bảng tổng hợp theo giờ)
+        st.subheader("📈 Cảm xúc theo thời gian")
+        granularity_label = st.radio("Đơn vị thời gian", ["Ngày", "Giờ"], horizontal=True, key="history_granularity")
+        if granularity_label == "Ngày":
+            timeseries = get_summary_timeseries("day")
+        else:
+            # Theo giờ chỉ hiển thị 7 ngày gần nhất
+            timeseries = get_summary_timeseries(
+                "hour", since=(datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d %H"))
+        if timeseries:
+            chart_data = pd.DataFrame(timeseries, columns=["bucket", "sentiment", "count", "mean_confidence"])
+            chart_data["emotion"] = chart_data["sentiment"].map(lambda label: map_sentiment_label(str(label))[0])
+            counts_chart = chart_data.pivot_table(index="bucket", columns="emotion", values="count",
+                                                  aggfunc="sum", fill_value=0)
+            st.bar_chart(counts_chart)
+            confidence_chart = chart_data.pivot_table(index="bucket", columns="emotion",
+                                                      values="mean_confidence", aggfunc="mean")
+            st.caption("Độ tin cậy trung bình")
+            st.line_chart(confidence_chart)
          
-        # Hiển thị lịch sử
-        st.subheader(f"📋 Danh sách ({total_count} mục)")
-        
-        for idx, row in enumerate(history_data):
+        # Hiển thị lịch sử theo trang (keyset: trang sau bắt đầu từ id cuối của trang trước)
+        # Danh sách/tìm kiếm chỉ gồm các dòng còn trong SQLite, không gồm dòng đã lưu trữ
+        st.subheader(f"📋 Danh sách ({total_count - summary['archived']} mục)")
+        if summary['archived']:
+            st.caption(f"🗄️ {summary['archived']} mục cũ đã được lưu trữ ra Parquet (history_archive.py), "
+                       "không hiển thị trong danh sách và tìm kiếm; thống kê ở trên vẫn tính cả các mục này.")
+
+        search_text = st.text_input("🔎 Tìm kiếm", placeholder="Từ khóa (có dấu hoặc không dấu)",
+                                    key="history_search").strip()
+        filter_cols = st.columns(2)
+        with filter_cols[0]:
+            sentiment_filter = st.selectbox("Lọc theo cảm xúc", list(HISTORY_FILTERS), key="history_sentiment")
+        with filter_cols[1]:
+            page_size = st.selectbox("Số mục mỗi trang", [10, 20, 50], index=1, key="history_page_size")
+
+        # Đổi bộ lọc/từ khóa thì quay về trang đầu
+        history_query = (search_text, sentiment_filter, page_size)
+        if st.session_state.get('history_query') != history_query:
+            st.session_state.history_query = history_query
+            st.session_state.history_cursors = [None]
+        cursors = st.session_state.history_cursors
+
+        # Lấy thêm một dòng để biết còn trang sau hay không
+        if search_text:
+            # Tìm bằng index full-text, xếp theo độ liên quan; con trỏ trang là offset
+            offset = cursors[-1] or 0
+            page_rows = [row[:5] for row in search_history(
+                search_text, limit=page_size + 1, offset=offset,
+                sentiment=HISTORY_FILTERS[sentiment_filter])]
+            next_cursor = offset + page_size
+        else:
+            page_rows = get_history(before_id=cursors[-1], limit=page_size + 1,
+                                    sentiment=HISTORY_FILTERS[sentiment_filter])
+            next_cursor = page_rows[page_size - 1][0] if len(page_rows) > page_size else None
+        has_next_page = len(page_rows) > page_size
+        page_rows = page_rows[:page_size]
+
+        if not page_rows:
+            st.info("📭 Không có mục nào phù hợp với bộ lọc.")
+
+        for idx, row in enumerate(page_rows):
             # Format: (id, text, sentiment, confidence, timestamp)
             analysis_id, text, sentiment_label, confidence, timestamp = row
             
             # Map sentiment label sang tiếng Việt
             emotion, emoji = map_sentiment_label(sentiment_label)
             
-            with st.expander(f"{emoji} {emotion} - {timestamp}", expanded=(idx == 0)):
+            with st.expander(f"{emoji} {emotion} - {timestamp}", expanded=(idx == 0 and len(cursors) == 1)):
                 # Thông tin cảm xúc
                 emotion_class = "positive" if emotion == "Tích cực" else "negative" if emotion == "Tiêu cực" else "neutral"
                 st.markdown(
@@ -406,6 +594,19 @@ with tab2:
                     st.caption(f"**Sentiment Label:** {sentiment_label}")
                 with col_info2:
                     st.caption(f"**⏰ Thời gian:** {timestamp}")
+
+        # Điều hướng trang
+        nav_cols = st.columns([1, 1, 2])
+        with nav_cols[0]:
+            if st.button("⬅️ Trang trước", disabled=len(cursors) == 1, use_container_width=True):
+                cursors.pop()
+                st.rerun()
+        with nav_cols[1]:
+            if st.button("Trang sau ➡️", disabled=not has_next_page, use_container_width=True):
+                cursors.append(next_cursor)
+                st.rerun()
+        with nav_cols[2]:
+            st.caption(f"Trang {len(cursors)}")
         
 
 # Footer
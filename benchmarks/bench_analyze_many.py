@@ -0,0 +1,71 @@
+"""
+So sánh throughput giữa vòng lặp analyze_sentiment từng text và analyze_many
+
+Chạy:
+    python benchmarks/bench_analyze_many.py --num-texts 256 --batch-size 32
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vietnamese_sentiment import VietnameseSentimentAnalyzer
+
+SAMPLE_TEXTS = [
+    "san pham tot",
+    "te qua",
+    "hom nay toi rat vui va hanh phuc",
+    "toi cam thay rat buon va that vong",
+    "Sản phẩm này không tốt, tôi thất vọng.",
+    "Hôm nay trời mưa. Tôi đi làm như bình thường.",
+    "giao hang nhanh, dong goi can than, shop tu van nhiet tinh :)",
+    "chat luong qua te, dung duoc hai ngay la hong, khong bao gio mua lai nua 😡",
+    "Mình đã dùng sản phẩm được một tháng, pin khá trâu, màn hình đẹp nhưng loa hơi nhỏ.",
+    "dich vu cham soc khach hang rat kem, goi dien nhieu lan ma khong ai nghe may, "
+    "den khi nhan duoc hang thi hop bi mop, san pham ben trong bi tray xuoc",
+]
+
+
+def build_corpus(num_texts, seed=0):
+    """Tạo corpus gồm các câu mẫu với độ dài trộn lẫn"""
+    rng = random.Random(seed)
+    return [rng.choice(SAMPLE_TEXTS) for _ in range(num_texts)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--num-texts", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    analyzer = VietnameseSentimentAnalyzer()
+    texts = build_corpus(args.num_texts)
+
+    # Warmup để không tính thời gian khởi tạo lần đầu
+    analyzer.analyze_sentiment(texts[0])
+    analyzer.analyze_many(texts[:args.batch_size], batch_size=args.batch_size)
+
+    start = time.perf_counter()
+    loop_results = [analyzer.analyze_sentiment(text) for text in texts]
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_results = analyzer.analyze_many(texts, batch_size=args.batch_size)
+    batch_seconds = time.perf_counter() - start
+
+    agreement = sum(
+        a['sentiment'] == b['sentiment'] for a, b in zip(loop_results, batch_results)
+    ) / len(texts)
+
+    print(f"Số text: {len(texts)}, batch_size: {args.batch_size}")
+    print(f"analyze_sentiment (loop): {loop_seconds:.2f}s - {len(texts) / loop_seconds:.1f} text/s")
+    print(f"analyze_many:             {batch_seconds:.2f}s - {len(texts) / batch_seconds:.1f} text/s")
+    print(f"Tăng tốc: {loop_seconds / batch_seconds:.2f}x, trùng label: {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
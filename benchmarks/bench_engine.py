@@ -0,0 +1,139 @@
+"""
+So sánh latency phân loại một request trên CPU: transformers.pipeline và InferenceEngine
+
+Các cách chạy cùng model sentiment, mỗi lần một text đã chuẩn hóa:
+    - pipeline: transformers.pipeline("sentiment-analysis", return_all_scores=True)
+      (cách phân loại cũ)
+    - eager: InferenceEngine không dùng graph
+    - trace: InferenceEngine(graph="trace")
+    - compile: InferenceEngine(graph="compile")
+
+Mặc định dùng model nhỏ (tiny_models.py) nên chạy offline được; --real-models
+để đo với model thật. Với trace/compile, benchmark báo lỗi (exit code 1) nếu có
+lần phân loại nào không chạy qua graph, để không báo số eager thành số graph.
+
+Chạy:
+    python benchmarks/bench_engine.py --num-texts 200 --threads 1
+    python benchmarks/bench_engine.py --real-models --modes pipeline eager trace
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import build_corpus
+from run_benchmarks import percentile
+from vietnamese_sentiment import SENTIMENT_MODEL_NAME, VietnameseSentimentAnalyzer, transformers
+
+MODES = ("pipeline", "eager", "trace", "compile")
+
+
+def pipeline_classifier(model_name):
+    """Hàm phân loại một text bằng transformers.pipeline"""
+    from inference_backends import load_model
+
+    tokenizer = transformers.AutoTokenizer.from_pretrained(model_name)
+    model = load_model(model_name, "sequence-classification")
+    pipeline = transformers.pipeline("sentiment-analysis", model=model, tokenizer=tokenizer)
+    return lambda text: pipeline([text], return_all_scores=True, truncation=True)[0]
+
+
+def engine_classifier(model_name, graph):
+    """
+    Hàm phân loại một text bằng InferenceEngine (qua analyzer._forward_scores)
+
+    Returns:
+        tuple: (hàm phân loại, thời gian load (giây), InferenceEngine)
+    """
+    analyzer = VietnameseSentimentAnalyzer(model_name=model_name, graph=graph)
+    start = time.perf_counter()
+    analyzer._load_classifier()
+    load_seconds = time.perf_counter() - start
+    return (lambda text: analyzer._forward_scores([text], 1)[0]), load_seconds, analyzer.engine
+
+
+def run(mode, model_name, texts, repeat):
+    """Đo latency mỗi request (ms) của một cách chạy"""
+    load_seconds = None
+    engine = None
+    if mode == "pipeline":
+        start = time.perf_counter()
+        classify = pipeline_classifier(model_name)
+        load_seconds = time.perf_counter() - start
+    else:
+        classify, load_seconds, engine = engine_classifier(model_name, None if mode == "eager" else mode)
+
+    # Chạy thử vài lần để không tính chi phí lần đầu (cấp phát, lazy init)
+    for text in texts[:5]:
+        classify(text)
+
+    latencies = []
+    outputs = []
+    for _ in range(repeat):
+        outputs = []
+        for text in texts:
+            start = time.perf_counter()
+            outputs.append(classify(text))
+            latencies.append(time.perf_counter() - start)
+
+    labels = [max(scores, key=lambda item: item['score'])['label'] for scores in outputs]
+    stats = {
+        "load_seconds": load_seconds,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+    }
+    if engine is not None:
+        stats["graph_calls"] = engine.graph_calls
+        stats["eager_calls"] = engine.eager_calls
+    return stats, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--num-texts", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, help="Số thread intra-op của PyTorch")
+    parser.add_argument("--real-models", action="store_true", help="Dùng model thật (cần tải từ HuggingFace)")
+    args = parser.parse_args()
+
+    from inference_backends import configure_threads
+    configure_threads(args.threads)
+
+    if args.real_models:
+        model_name = SENTIMENT_MODEL_NAME
+    else:
+        from tiny_models import build_tiny_models
+        model_name = build_tiny_models()[0]
+
+    # Text đã chuẩn hóa (đầu vào của bước classify), đủ loại độ dài
+    texts = [text.lower() for kind in ("accented", "long") for text in build_corpus(kind, args.num_texts // 2)]
+
+    report = {}
+    reference = None
+    failed = []
+    for mode in args.modes:
+        stats, labels = run(mode, model_name, texts, args.repeat)
+        if reference is None:
+            reference = labels
+        stats["label_agreement"] = sum(a == b for a, b in zip(reference, labels)) / len(labels)
+        report[mode] = stats
+        print(f"{mode:>8}: p50 {stats['p50_ms']:7.2f} ms  p95 {stats['p95_ms']:7.2f} ms  "
+              f"load {stats['load_seconds']:6.2f}s  trùng label {stats['label_agreement']:.1%}")
+        if mode in ("trace", "compile") and (stats["eager_calls"] or not stats["graph_calls"]):
+            failed.append(mode)
+            print(f"{mode:>8}: LỖI - {stats['eager_calls']} lần chạy eager, "
+                  f"{stats['graph_calls']} lần chạy graph", file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
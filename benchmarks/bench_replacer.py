@@ -0,0 +1,78 @@
+"""
+Đo thời gian thay thế từ điển theo kích thước từ điển:
+vòng lặp str.replace (cách cũ) so với MultiPatternReplacer (một lượt quét)
+
+Chạy:
+    python benchmarks/bench_replacer.py --sizes 10 100 1000 10000
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vietnamese_sentiment import MultiPatternReplacer
+
+SAMPLE_TEXT = (
+    "toithich san pham nay lam :) giao hang nhanh 👍 nhung dong goi hoi au :( "
+    "toiratthich shop nay, se ung ho tiep 😍 "
+)
+
+
+def build_dictionary(size, seed=0):
+    """Tạo từ điển ngẫu nhiên gồm size pattern giống từ viết liền"""
+    rng = random.Random(seed)
+    mapping = {}
+    while len(mapping) < size:
+        length = rng.randint(4, 12)
+        pattern = "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+        mapping[pattern] = " " + pattern[:length // 2] + " " + pattern[length // 2:] + " "
+    mapping.update({"toithich": "tôi thích", "toiratthich": "tôi rất thích", ":)": " tích_cực "})
+    return mapping
+
+
+def replace_loop(mapping, text):
+    """Cách cũ: str.replace lần lượt từng pattern"""
+    for pattern, replacement in mapping.items():
+        text = text.replace(pattern, replacement)
+    return text
+
+
+def time_per_call(func, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--text-repeat", type=int, default=20, help="Số lần lặp câu mẫu để tạo text dài")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    text = SAMPLE_TEXT * args.text_repeat
+    print(f"Độ dài text: {len(text)} ký tự")
+    print(f"{'patterns':>10} {'compile (ms)':>14} {'str.replace (ms)':>18} {'replacer (ms)':>15} {'speedup':>9}")
+
+    for size in args.sizes:
+        mapping = build_dictionary(size)
+
+        start = time.perf_counter()
+        replacer = MultiPatternReplacer(mapping)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        loop_ms = time_per_call(lambda t: replace_loop(mapping, t), text, args.repeat) * 1000
+        replacer_ms = time_per_call(replacer.replace, text, args.repeat) * 1000
+
+        print(f"{len(mapping):>10} {compile_ms:>14.1f} {loop_ms:>18.3f} {replacer_ms:>15.3f} "
+              f"{loop_ms / replacer_ms:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Đo thời gian khởi động của thư viện ở chế độ lazy và eager
+
+Mỗi phép đo chạy trong một process Python mới để không bị ảnh hưởng bởi
+module đã import trước đó:
+    - import: import vietnamese_sentiment
+    - lazy: import + VietnameseSentimentAnalyzer() (chưa load model)
+    - lazy_first_result: lazy + analyze_sentiment lần đầu
+    - eager: import + VietnameseSentimentAnalyzer() + warmup()
+
+Chạy:
+    python benchmarks/bench_startup.py --repeat 3
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPTS = {
+    "import": """
+import vietnamese_sentiment
+""",
+    "lazy": """
+from vietnamese_sentiment import VietnameseSentimentAnalyzer
+analyzer = VietnameseSentimentAnalyzer()
+""",
+    "lazy_first_result": """
+from vietnamese_sentiment import VietnameseSentimentAnalyzer
+analyzer = VietnameseSentimentAnalyzer()
+analyzer.analyze_sentiment("san pham tot")
+""",
+    "eager": """
+from vietnamese_sentiment import VietnameseSentimentAnalyzer
+analyzer = VietnameseSentimentAnalyzer()
+analyzer.warmup()
+""",
+}
+
+TIMER = """
+import json, sys, time
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("torch", "transformers", "underthesea") if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy_modules": heavy}}))
+"""
+
+
+def measure(body):
+    """Chạy đoạn code trong process mới, trả về (giây, các module nặng đã import)"""
+    output = subprocess.run(
+        [sys.executable, "-c", TIMER.format(body=body)],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["seconds"], result["heavy_modules"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", default=list(SCRIPTS), choices=list(SCRIPTS))
+    args = parser.parse_args()
+
+    print(f"{'mode':<20} {'best (s)':>10} {'median (s)':>12}  modules nặng đã import")
+    for mode in args.modes:
+        runs = [measure(SCRIPTS[mode]) for _ in range(args.repeat)]
+        seconds = sorted(run[0] for run in runs)
+        print(f"{mode:<20} {seconds[0]:>10.3f} {seconds[len(seconds) // 2]:>12.3f}  "
+              f"{', '.join(runs[0][1]) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
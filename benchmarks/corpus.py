@@ -0,0 +1,77 @@
+"""
+Corpus tiếng Việt tổng hợp cho benchmark (tạo ngẫu nhiên, có seed cố định)
+
+Các loại:
+    - accented: review ngắn có dấu
+    - unaccented: review ngắn không dấu (cần model restore dấu)
+    - emoji: review có nhiều emoji/emoticon và từ viết liền
+    - long: review dài vài trăm từ (cần chia cửa sổ)
+"""
+
+import random
+import unicodedata
+
+SUBJECTS = [
+    "sản phẩm", "shop", "dịch vụ", "nhân viên", "giao hàng", "chất lượng", "đóng gói",
+    "món ăn", "phòng", "điện thoại", "màn hình", "pin", "giá", "khách sạn", "quán",
+]
+POSITIVE = [
+    "rất tốt", "tuyệt vời", "đẹp", "nhanh", "chu đáo", "hài lòng", "ngon", "đáng tiền",
+    "xịn", "ổn áp", "nhiệt tình", "sạch sẽ",
+]
+NEGATIVE = [
+    "tệ", "chậm", "kém", "thất vọng", "bẩn", "hỏng", "đắt", "không giống hình",
+    "quá tệ", "không đáng tiền", "thái độ kém",
+]
+NEUTRAL = [
+    "bình thường", "tạm được", "như mô tả", "cũng được", "không có gì đặc biệt",
+]
+FILLERS = [
+    "mình đã mua lần thứ hai", "hôm qua", "theo mình thấy", "nói chung là", "lần sau",
+    "mọi người nên cân nhắc", "so với giá tiền", "sau một tuần sử dụng", "thật sự",
+]
+EMOJIS = ["😍", "👍", "😡", "😢", "😂", "❤️", "💔", "🙄", ":)", ":(", ":D", ":-)", "=)"]
+JOINED = ["toithich", "spnay", "ratthich", "toikhong", "dichvunay", "thichqua"]
+
+
+def strip_accents(text):
+    """Bỏ dấu tiếng Việt (giữ nguyên chữ cái gốc, đ -> d)"""
+    text = text.replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFD", text)
+    return unicodedata.normalize("NFC", "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn"))
+
+
+def make_sentence(rng):
+    """Một câu review ngắn"""
+    opinion = rng.choice([POSITIVE, NEGATIVE, NEUTRAL])
+    parts = [rng.choice(SUBJECTS), rng.choice(opinion)]
+    if rng.random() < 0.5:
+        parts.insert(0, rng.choice(FILLERS))
+    sentence = " ".join(parts)
+    return sentence[0].upper() + sentence[1:] + rng.choice([".", "!", ""])
+
+
+def make_text(kind, rng):
+    """Một văn bản theo loại"""
+    if kind == "accented":
+        return " ".join(make_sentence(rng) for _ in range(rng.randint(1, 3)))
+    if kind == "unaccented":
+        return strip_accents(" ".join(make_sentence(rng) for _ in range(rng.randint(1, 3)))).lower()
+    if kind == "emoji":
+        words = make_sentence(rng).split()
+        for _ in range(rng.randint(2, 5)):
+            words.insert(rng.randint(0, len(words)), rng.choice(EMOJIS + JOINED))
+        return " ".join(words)
+    if kind == "long":
+        text = " ".join(make_sentence(rng) for _ in range(rng.randint(60, 90)))
+        return strip_accents(text) if rng.random() < 0.5 else text
+    raise ValueError(f"Loại corpus không hợp lệ: {kind}")
+
+
+CORPUS_KINDS = ("accented", "unaccented", "emoji", "long")
+
+
+def build_corpus(kind, size, seed=0):
+    """Danh sách size văn bản loại kind"""
+    rng = random.Random(f"{kind}-{seed}")
+    return [make_text(kind, rng) for _ in range(size)]
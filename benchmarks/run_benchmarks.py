@@ -0,0 +1,305 @@
+"""
+Benchmark từng bước của pipeline và end-to-end, so sánh với baseline
+
+Các bước: restore, standardize, classify, end_to_end, db_insert,
+db_insert_many, db_write_behind, history_fetch, history_page. Corpus tổng hợp (xem corpus.py) với nhiều
+kích thước đầu vào và batch size. Mặc định dùng model thay thế cỡ nhỏ
+(tiny_models.py) nên chạy offline được trong CI; --real-models để đo với
+model thật.
+
+Chạy:
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --stages db_insert history_fetch   # không cần torch
+    python benchmarks/run_benchmarks.py --update-baseline                  # ghi baseline mới
+
+Mỗi phép đo chạy --repeat lần, lấy lần nhanh nhất. Throughput được so với
+baseline dưới dạng tỉ lệ với một workload tham chiếu cố định (chỉ dùng thư viện
+chuẩn, xem reference_rate) đo trong cùng lần chạy, nên baseline không chứa số
+tuyệt đối và máy nhanh/chậm hơn không bị báo nhầm. Các phép đo có tỉ lệ thấp
+hơn baseline quá --tolerance được báo là regression (--fail-on-regression để
+trả về exit code 1). Máy và môi trường đo được ghi trong meta của báo cáo.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from corpus import CORPUS_KINDS, build_corpus
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+MODEL_STAGES = ("restore", "standardize", "classify", "end_to_end")
+DB_STAGES = ("db_insert", "db_insert_many", "db_write_behind", "history_fetch", "history_page")
+STAGES = MODEL_STAGES + DB_STAGES
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def measure(func, batches, repeat=1):
+    """
+    Chạy func trên từng batch, trả về thống kê throughput và latency mỗi batch
+
+    Với repeat > 1, cả danh sách batch được chạy repeat lần và lấy lần có tổng
+    thời gian nhỏ nhất (ít bị nhiễu bởi các process khác nhất).
+    """
+    best = None
+    for _ in range(repeat):
+        latencies = []
+        for batch in batches:
+            start = time.perf_counter()
+            func(batch)
+            latencies.append(time.perf_counter() - start)
+        if best is None or sum(latencies) < sum(best):
+            best = latencies
+    latencies = best
+    items = sum(len(batch) for batch in batches)
+    total = sum(latencies)
+    return {
+        "items": items,
+        "seconds": total,
+        "items_per_sec": items / total if total else None,
+        "batch_p50_ms": percentile(latencies, 50) * 1000,
+        "batch_p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def reference_rate(repeat=5):
+    """
+    Throughput (item/s) của workload tham chiếu: tách từ bằng regex, sort và
+    json.dumps trên corpus cố định, chỉ dùng thư viện chuẩn nên không đổi theo
+    code của repo. Dùng để quy đổi throughput các bước về tỉ lệ so với tốc độ
+    của máy trong cùng lần chạy.
+    """
+    texts = build_corpus("accented", 256)
+
+    def work(batch):
+        for text in batch:
+            json.dumps(sorted(set(re.findall(r"\w+", text.lower()))), ensure_ascii=False)
+
+    return measure(work, chunked(texts, 16), repeat)["items_per_sec"]
+
+
+def environment():
+    """Thông tin máy và phiên bản thư viện của lần đo"""
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu": cpu,
+        "cpu_count": os.cpu_count(),
+    }
+    for name in ("torch", "transformers", "underthesea"):
+        module = sys.modules.get(name)
+        if module is not None:
+            info[name] = getattr(module, "__version__", None)
+    return info
+
+
+def run_model_stages(stages, kinds, sizes, batch_sizes, real_models, repeat=1):
+    """Đo các bước có model; cache theo câu/kết quả đều tắt để đo chi phí thật"""
+    from vietnamese_sentiment import (
+        RESTORER_MODEL_PATH, SENTIMENT_MODEL_NAME, VietnameseSentimentAnalyzer
+    )
+
+    if real_models:
+        model_name, restorer_path = SENTIMENT_MODEL_NAME, RESTORER_MODEL_PATH
+    else:
+        from tiny_models import build_tiny_models
+        model_name, restorer_path = build_tiny_models()
+
+    analyzer = VietnameseSentimentAnalyzer(
+        model_name=model_name, restorer_path=restorer_path, sentence_cache_size=0)
+    analyzer.warmup()
+
+    results = {}
+    for kind in kinds:
+        for size in sizes:
+            texts = build_corpus(kind, size)
+            cleaned = [analyzer.standardizer.standardize(t) for t in texts]
+
+            if "standardize" in stages:
+                results[f"standardize/{kind}/n{size}"] = measure(
+                    lambda batch: analyzer.standardizer.standardize(batch[0]), chunked(texts, 1), repeat)
+
+            for batch_size in batch_sizes:
+                suffix = f"{kind}/n{size}/bs{batch_size}"
+                if "restore" in stages:
+                    results[f"restore/{suffix}"] = measure(
+                        analyzer.restored.restore_batch, chunked(texts, batch_size), repeat)
+                if "classify" in stages:
+                    results[f"classify/{suffix}"] = measure(
+                        lambda batch: analyzer._classify(batch, batch_size=batch_size),
+                        chunked(cleaned, batch_size), repeat)
+                if "end_to_end" in stages:
+                    results[f"end_to_end/{suffix}"] = measure(
+                        lambda batch: analyzer.analyze_many(batch, batch_size=batch_size), [texts], repeat)
+    return results
+
+
+def run_db_stages(stages, sizes, batch_sizes, repeat=1):
+    """Đo database trên file SQLite tạm (không đụng tới database thật)"""
+    results = {}
+    original_path = database.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            for size in sizes:
+                database.DB_PATH = os.path.join(tmp_dir, f"bench_{size}.db")
+                database.init_database()
+                texts = build_corpus("accented", size)
+                rows = [(text, "POS", 0.9, None) for text in texts]
+
+                if "db_insert" in stages:
+                    results[f"db_insert/n{size}"] = measure(
+                        lambda batch: database.insert_sentiment_analysis(*batch[0]), chunked(rows, 1), repeat)
+                if "db_insert_many" in stages:
+                    for batch_size in batch_sizes:
+                        results[f"db_insert_many/n{size}/bs{batch_size}"] = measure(
+                            database.insert_sentiment_analysis_many, chunked(rows, batch_size), repeat)
+                if "db_write_behind" in stages:
+                    # Thời gian enqueue cộng thời gian chờ flush hết xuống đĩa
+                    writer = database.WriteBehindWriter()
+                    results[f"db_write_behind/n{size}"] = measure(
+                        lambda batch: ([writer.enqueue(*row) for row in batch], writer.flush()), [rows], repeat)
+                    writer.close()
+                if "history_fetch" in stages:
+                    results[f"history_fetch/n{size}"] = measure(
+                        lambda batch: database.get_sentiment_analysis(), [[None]] * 5, repeat)
+                if "history_page" in stages:
+                    # Đi qua 5 trang đầu tiên, mỗi trang 20 dòng
+                    cursor = [None]
+
+                    def fetch_page(batch):
+                        rows = database.get_history(before_id=cursor[0], limit=20)
+                        cursor[0] = rows[-1][0] if rows else None
+
+                    results[f"history_page/n{size}"] = measure(fetch_page, [[None]] * 5, repeat)
+        finally:
+            database.close_connections()
+            database.DB_PATH = original_path
+    return results
+
+
+def relative_results(results, reference):
+    """Throughput của từng phép đo chia cho throughput của workload tham chiếu"""
+    return {key: stats["items_per_sec"] / reference
+            for key, stats in results.items() if stats.get("items_per_sec")}
+
+
+def compare(relative, baseline, tolerance):
+    """
+    Danh sách (key, tỉ lệ hiện tại / baseline) bị chậm hơn quá tolerance
+
+    Args:
+        relative: Throughput tương đối của lần chạy này (relative_results)
+        baseline: Throughput tương đối trong baseline
+    """
+    regressions = []
+    for key, current in relative.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        ratio = current / previous
+        if ratio < 1 - tolerance:
+            regressions.append((key, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--kinds", nargs="+", choices=CORPUS_KINDS, default=list(CORPUS_KINDS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--real-models", action="store_true", help="Dùng model thật thay vì model nhỏ")
+    parser.add_argument("--output", help="File JSON ghi kết quả")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần chạy mỗi phép đo (lấy lần nhanh nhất)")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    # Đo tham chiếu trước và sau các bước, lấy giá trị lớn hơn
+    reference = reference_rate()
+    results = {}
+    if any(stage in MODEL_STAGES for stage in args.stages):
+        results.update(run_model_stages(args.stages, args.kinds, args.sizes, args.batch_sizes,
+                                        args.real_models, args.repeat))
+    if any(stage in DB_STAGES for stage in args.stages):
+        results.update(run_db_stages(args.stages, args.sizes, args.batch_sizes, args.repeat))
+    reference = max(reference, reference_rate())
+    relative = relative_results(results, reference)
+
+    meta = {
+        **environment(),
+        "models": "real" if args.real_models else "tiny",
+        "repeat": args.repeat,
+        "reference_items_per_sec": reference,
+        "timestamp": database.get_timestamp(),
+    }
+
+    print(f"{'reference':<42} {reference:>12.1f} item/s")
+    for key, stats in results.items():
+        print(f"{key:<42} {stats['items_per_sec']:>12.1f} item/s  p50 {stats['batch_p50_ms']:>9.2f} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"meta": meta, "results": results, "relative": relative}, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        # Baseline chỉ lưu throughput tương đối (không phụ thuộc tốc độ máy)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({"meta": meta, "relative": relative}, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"Đã ghi baseline vào {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("Chưa có baseline, chạy với --update-baseline để tạo")
+        return
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if "relative" not in baseline:
+        print("Baseline cũ lưu throughput tuyệt đối, chạy với --update-baseline để tạo lại")
+        return
+    if baseline.get("meta", {}).get("models") != meta["models"]:
+        print("Baseline đo với loại model khác, bỏ qua so sánh")
+        return
+    changed = [key for key in ("cpu", "cpu_count", "python", "torch", "transformers", "underthesea")
+               if key in meta and baseline["meta"].get(key) != meta[key]]
+    if changed:
+        print(f"Lưu ý: baseline đo trên môi trường khác ({', '.join(changed)}), "
+              f"so sánh theo tỉ lệ với workload tham chiếu")
+
+    regressions = compare(relative, baseline["relative"], args.tolerance)
+    for key, ratio in regressions:
+        print(f"REGRESSION {key}: {ratio:.0%} throughput so với baseline")
+    if not regressions:
+        print("Không có regression so với baseline")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
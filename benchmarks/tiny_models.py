@@ -0,0 +1,103 @@
+"""
+Model thay thế cỡ nhỏ (khởi tạo ngẫu nhiên) cho benchmark chạy offline trong CI
+
+Cùng kiến trúc với model thật nhưng rất ít tham số:
+    - restorer: XLMRobertaForTokenClassification, 527 nhãn như selected_tags_names.txt
+    - sentiment: RobertaForSequenceClassification (kiến trúc PhoBERT), nhãn NEG/POS/NEU
+Tokenizer là Unigram/Metaspace ("▁" như XLM-R) train trên corpus tổng hợp.
+Kết quả dự đoán vô nghĩa, chỉ dùng để đo chi phí của code xung quanh model.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import CORPUS_KINDS, build_corpus
+from vietnamese_sentiment import TAGS_FILE, torch, transformers
+
+TINY_MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tiny_models")
+SPECIAL_TOKENS = ["<s>", "<pad>", "</s>", "<unk>", "<mask>"]
+
+
+def build_tokenizer(model_max_length, vocab_size=2000):
+    """Train tokenizer Unigram nhỏ trên corpus tổng hợp (có dấu, không dấu, đã tách từ)"""
+    from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers, processors, trainers
+
+    texts = []
+    for kind in CORPUS_KINDS:
+        corpus = build_corpus(kind, 200, seed=1)
+        texts.extend(corpus)
+        texts.extend(text.lower().replace(" ", "_") for text in corpus)
+
+    tokenizer = Tokenizer(models.Unigram())
+    tokenizer.normalizer = normalizers.NFKC()
+    tokenizer.pre_tokenizer = pre_tokenizers.Metaspace(replacement="▁", prepend_scheme="always")
+    tokenizer.decoder = decoders.Metaspace(replacement="▁", prepend_scheme="always")
+    tokenizer.train_from_iterator(texts, trainers.UnigramTrainer(
+        vocab_size=vocab_size, special_tokens=SPECIAL_TOKENS, unk_token="<unk>"))
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>",
+        pair="<s> $A </s> </s> $B </s>",
+        special_tokens=[("<s>", 0), ("</s>", 2)],
+    )
+
+    return transformers.PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        bos_token="<s>", eos_token="</s>", unk_token="<unk>", pad_token="<pad>",
+        mask_token="<mask>", cls_token="<s>", sep_token="</s>",
+        model_max_length=model_max_length,
+    )
+
+
+def tiny_config(config_class, vocab_size, model_max_length, **kwargs):
+    """Config nhỏ: 2 layer, hidden 64"""
+    return config_class(
+        vocab_size=vocab_size,
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=128,
+        # RoBERTa đánh số vị trí từ padding_idx + 1
+        max_position_embeddings=model_max_length + 2,
+        pad_token_id=1, bos_token_id=0, eos_token_id=2,
+        **kwargs
+    )
+
+
+def build_tiny_models(output_dir=TINY_MODELS_DIR, seed=0):
+    """
+    Tạo (hoặc dùng lại nếu đã có) hai model thay thế
+
+    Returns:
+        tuple: (thư mục model sentiment, thư mục model restorer)
+    """
+    sentiment_dir = os.path.join(output_dir, "sentiment")
+    restorer_dir = os.path.join(output_dir, "restorer")
+    if all(os.path.exists(os.path.join(d, "config.json")) for d in (sentiment_dir, restorer_dir)):
+        return sentiment_dir, restorer_dir
+
+    torch.manual_seed(seed)
+
+    with open(TAGS_FILE, 'r', encoding='utf-8') as f:
+        num_tags = sum(1 for line in f if line.strip())
+    tokenizer = build_tokenizer(model_max_length=512)
+    restorer = transformers.XLMRobertaForTokenClassification(tiny_config(
+        transformers.XLMRobertaConfig, len(tokenizer), 512, num_labels=num_tags))
+    restorer.save_pretrained(restorer_dir)
+    tokenizer.save_pretrained(restorer_dir)
+
+    labels = {0: "NEG", 1: "POS", 2: "NEU"}
+    tokenizer = build_tokenizer(model_max_length=256)
+    sentiment = transformers.RobertaForSequenceClassification(tiny_config(
+        transformers.RobertaConfig, len(tokenizer), 256,
+        num_labels=3, id2label=labels, label2id={v: k for k, v in labels.items()}))
+    sentiment.save_pretrained(sentiment_dir)
+    tokenizer.save_pretrained(sentiment_dir)
+
+    return sentiment_dir, restorer_dir
+
+
+if __name__ == "__main__":
+    for path in build_tiny_models():
+        print(path)
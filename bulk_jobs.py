@@ -0,0 +1,207 @@
+"""
+Job chấm điểm hàng loạt chạy nền cho tab "Hàng loạt" của app Streamlit
+
+File upload (CSV/XLSX/TXT) được đọc thành DataFrame, một thread nền chấm điểm
+từng batch bằng analyze_many và ghi mỗi batch vào database bằng
+insert_sentiment_analysis_many (một transaction mỗi batch). Script Streamlit chỉ
+đọc tiến độ/kết quả tạm của job nên không bị chặn, và job nằm trong registry
+dùng chung của process (st.cache_resource) nên không mất khi script chạy lại.
+
+Analyzer được dùng chung với các request phân tích đơn lẻ của app, mà cache và
+thống kê của nó không thread-safe, nên job giữ lock dùng chung (tham số lock)
+trong lúc chấm điểm. Mỗi lần giữ lock chỉ chấm lock_batch_size dòng rồi nhả
+ra, để phân tích đơn lẻ không phải chờ cả batch ghi database.
+
+Ví dụ:
+    jobs = BulkJobRegistry()
+    job = jobs.start(analyzer, read_upload("reviews.csv", data), text_column="content", lock=analyzer_lock)
+    job.progress()      # {'status': 'running', 'rows_done': 64, 'total_rows': 1000, ...}
+    job.cancel()
+"""
+
+import contextlib
+import io
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from database import insert_sentiment_analysis_many
+
+UPLOAD_FORMATS = ("csv", "xlsx", "txt")
+
+# Cột kết quả được thêm vào file đã chấm điểm
+RESULT_COLUMNS = ("sentiment", "confidence", "normalized_text")
+
+
+def read_upload(file_name, data):
+    """
+    Đọc file upload thành DataFrame
+
+    Args:
+        file_name: Tên file (định dạng đoán theo phần mở rộng)
+        data: Nội dung file (bytes)
+
+    Returns:
+        pd.DataFrame: CSV/XLSX giữ nguyên các cột; TXT thành một cột "text",
+                      mỗi dòng không trống là một văn bản
+    """
+    ext = os.path.splitext(file_name)[1].lower().lstrip(".")
+    if ext == "csv":
+        return pd.read_csv(io.BytesIO(data), encoding="utf-8-sig", dtype=str, keep_default_na=False)
+    if ext == "xlsx":
+        return pd.read_excel(io.BytesIO(data), dtype=str).fillna("")
+    if ext == "txt":
+        lines = data.decode("utf-8-sig").splitlines()
+        return pd.DataFrame({"text": [line.strip() for line in lines if line.strip()]})
+    raise ValueError(f"Không hỗ trợ định dạng file: {file_name} (chỉ {', '.join(UPLOAD_FORMATS)})")
+
+
+def to_file_bytes(frame, fmt):
+    """Xuất DataFrame kết quả ra bytes CSV (UTF-8 có BOM, mở được bằng Excel) hoặc XLSX"""
+    if fmt == "xlsx":
+        buffer = io.BytesIO()
+        frame.to_excel(buffer, index=False)
+        return buffer.getvalue()
+    return frame.to_csv(index=False).encode("utf-8-sig")
+
+
+class BulkJob:
+    """Một job chấm điểm file chạy trên thread nền, có thể hủy giữa các batch"""
+
+    def __init__(self, analyzer, frame, text_column, file_name="", batch_size=32, to_db=True, lock=None,
+                 lock_batch_size=4):
+        """
+        Args:
+            analyzer: VietnameseSentimentAnalyzer (đã load hoặc load lazy trong thread nền)
+            frame: DataFrame đầu vào
+            text_column: Cột chứa văn bản cần chấm điểm
+            file_name: Tên file gốc (hiển thị, tên file tải về)
+            batch_size: Số dòng mỗi batch (mỗi batch là một lần ghi database)
+            to_db: Ghi kết quả vào database lịch sử
+            lock: Lock dùng chung với những chỗ khác gọi analyzer (None: không khóa)
+            lock_batch_size: Số dòng chấm điểm mỗi lần giữ lock (chỉ khi có lock)
+        """
+        self.job_id = uuid.uuid4().hex[:12]
+        self.analyzer = analyzer
+        self.frame = frame.reset_index(drop=True)
+        self.text_column = text_column
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.to_db = to_db
+        self.lock = lock if lock is not None else contextlib.nullcontext()
+        self.lock_batch_size = lock_batch_size if lock is not None else batch_size
+        self.total_rows = len(self.frame)
+
+        self.status = "pending"  # pending -> running -> done | cancelled | error
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._results = []
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"bulk-job-{self.job_id}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Yêu cầu dừng; job dừng sau batch đang chạy, kết quả đã chấm vẫn được giữ"""
+        self._cancel_event.set()
+
+    def is_active(self):
+        return self.status in ("pending", "running")
+
+    def progress(self):
+        """
+        Returns:
+            dict: status, rows_done, total_rows, fraction, rows_per_sec, elapsed_seconds, error
+        """
+        with self._lock:
+            rows_done = len(self._results)
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "status": self.status,
+            "rows_done": rows_done,
+            "total_rows": self.total_rows,
+            "fraction": rows_done / self.total_rows if self.total_rows else 1.0,
+            "rows_per_sec": rows_done / elapsed if elapsed else 0.0,
+            "elapsed_seconds": elapsed,
+            "error": self.error,
+        }
+
+    def results_frame(self):
+        """Các dòng đã chấm điểm (có thể chưa đủ khi job đang chạy/bị hủy) kèm cột kết quả"""
+        with self._lock:
+            results = list(self._results)
+        frame = self.frame.iloc[:len(results)].copy()
+        frame["sentiment"] = [result['sentiment'] for result in results]
+        frame["confidence"] = [result['confidence'] for result in results]
+        frame["normalized_text"] = [result['text'] for result in results]
+        return frame
+
+    def _run(self):
+        self.started_at = time.time()
+        self.status = "running"
+        texts = self.frame[self.text_column].astype(str).tolist()
+        try:
+            for start in range(0, self.total_rows, self.batch_size):
+                if self._cancel_event.is_set():
+                    break
+                batch = texts[start:start + self.batch_size]
+                results = []
+                for sub_start in range(0, len(batch), self.lock_batch_size):
+                    with self.lock:
+                        results.extend(self.analyzer.analyze_many(
+                            batch[sub_start:sub_start + self.lock_batch_size], batch_size=self.lock_batch_size))
+                    # Nhường lock cho phân tích đơn lẻ đang chờ trước khi lấy lại
+                    time.sleep(0)
+                if self.to_db:
+                    rows = [(result['original_text'], result['sentiment'], result['confidence'], None,
+                             result['text'], result['tier']) for result in results]
+                    insert_sentiment_analysis_many(rows, job_id=self.job_id, rows_done=start + len(batch))
+                with self._lock:
+                    self._results.extend(results)
+            # Hủy trong lúc chạy batch cuối vẫn tính là bị hủy
+            self.status = "cancelled" if self._cancel_event.is_set() else "done"
+        except Exception as e:
+            self.error = str(e)
+            self.status = "error"
+        finally:
+            self.finished_at = time.time()
+
+
+class BulkJobRegistry:
+    """Các job hàng loạt của process, tra theo job_id (dùng chung giữa các lần chạy lại script)"""
+
+    def __init__(self, max_finished_jobs=20):
+        """
+        Args:
+            max_finished_jobs: Số job đã kết thúc được giữ lại để xem/tải kết quả
+        """
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, analyzer, frame, text_column, **kwargs):
+        """Tạo và chạy job mới (xem BulkJob)"""
+        job = BulkJob(analyzer, frame, text_column, **kwargs)
+        with self._lock:
+            self._prune()
+            self._jobs[job.job_id] = job
+        return job.start()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        """Bỏ các job đã kết thúc cũ nhất khi vượt max_finished_jobs (đã giữ self._lock)"""
+        finished = [job for job in self._jobs.values() if not job.is_active()]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job.job_id]
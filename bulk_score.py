@@ -0,0 +1,305 @@
+"""
+Chấm điểm sentiment hàng loạt cho file CSV/JSONL/Parquet
+
+Đọc file theo từng chunk (không load toàn bộ vào bộ nhớ), phân tích bằng
+analyze_many, ghi kết quả dần ra JSONL/Parquet và/hoặc database lịch sử.
+Sau mỗi chunk tiến độ được checkpoint; chạy lại cùng lệnh sẽ tiếp tục từ
+chunk chưa xong mà không chấm lại các dòng đã xong.
+
+Ví dụ:
+    python bulk_score.py reviews.csv --text-column content --output scored.jsonl
+    python bulk_score.py reviews.parquet --output scored.parquet --to-db
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+from database import (
+    get_bulk_job_progress, init_database, insert_sentiment_analysis_many
+)
+
+INPUT_FORMATS = ("csv", "jsonl", "parquet")
+
+# Tên file part do ParquetWriter ghi (part-00012.parquet)
+PART_FILE_PATTERN = re.compile(r"part-(\d{5})\.parquet")
+
+
+def detect_format(path):
+    """Đoán định dạng file theo phần mở rộng"""
+    ext = os.path.splitext(path.rstrip("/"))[1].lower().lstrip(".")
+    if ext in ("json", "ndjson"):
+        ext = "jsonl"
+    if ext not in INPUT_FORMATS:
+        raise ValueError(f"Không nhận ra định dạng của {path}, dùng --input-format")
+    return ext
+
+
+def read_rows(path, fmt, start_row=0, read_size=1000):
+    """
+    Đọc file dạng stream, trả về từng dòng (dict) bắt đầu từ start_row
+
+    Args:
+        path: Đường dẫn file
+        fmt: "csv", "jsonl" hoặc "parquet"
+        start_row: Bỏ qua các dòng trước start_row (resume)
+        read_size: Số dòng mỗi lần đọc (parquet)
+    """
+    if fmt == "csv":
+        csv.field_size_limit(sys.maxsize)
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            for index, row in enumerate(csv.DictReader(f)):
+                if index >= start_row:
+                    yield row
+
+    elif fmt == "jsonl":
+        with open(path, 'r', encoding='utf-8') as f:
+            index = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                if index >= start_row:
+                    yield json.loads(line)
+                index += 1
+
+    else:
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        # Bỏ qua nguyên các row group đã xử lý mà không cần đọc
+        skipped = 0
+        row_groups = []
+        for i in range(parquet_file.num_row_groups):
+            num_rows = parquet_file.metadata.row_group(i).num_rows
+            if skipped + num_rows <= start_row:
+                skipped += num_rows
+            else:
+                row_groups.append(i)
+        index = skipped
+        for batch in parquet_file.iter_batches(batch_size=read_size, row_groups=row_groups):
+            for row in batch.to_pylist():
+                if index >= start_row:
+                    yield row
+                index += 1
+
+
+def iter_chunks(rows, chunk_size):
+    """Gom các dòng thành chunk chunk_size phần tử"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Checkpoint:
+    """Tiến độ job, ghi atomic (file tạm + os.replace) sau mỗi chunk"""
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {"rows_done": 0, "output_bytes": 0, "output_parts": 0}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.state.update(json.load(f))
+
+    def save(self, **updates):
+        self.state.update(updates)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class JsonlWriter:
+    """Ghi kết quả nối tiếp vào file JSONL"""
+
+    def __init__(self, path, checkpoint):
+        self.path = path
+        # Cắt bỏ phần ghi dở sau checkpoint cuối cùng (nếu lần trước bị crash)
+        with open(path, 'a', encoding='utf-8'):
+            pass
+        with open(path, 'r+b') as f:
+            f.truncate(checkpoint.state["output_bytes"])
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"output_bytes": self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+
+def result_schema(with_id=False):
+    """
+    Schema Parquet của kết quả, cố định cho mọi part để thư mục output đọc được
+    thành một dataset (id luôn lưu dạng chuỗi vì kiểu của id có thể khác nhau
+    giữa các chunk, vd. toàn None hoặc lẫn số và chuỗi)
+    """
+    import pyarrow as pa
+    fields = [('row', pa.int64())]
+    if with_id:
+        fields.append(('id', pa.string()))
+    fields += [
+        ('text', pa.string()),
+        ('normalized_text', pa.string()),
+        ('sentiment', pa.string()),
+        ('confidence', pa.float64()),
+        ('all_scores', pa.string()),
+    ]
+    return pa.schema(fields)
+
+
+class ParquetWriter:
+    """Ghi mỗi chunk thành một file part-NNNNN.parquet trong thư mục output (cùng schema)"""
+
+    def __init__(self, path, checkpoint, with_id=False):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.schema = result_schema(with_id)
+        self.path = path
+        self.parts = checkpoint.state["output_parts"]
+        os.makedirs(path, exist_ok=True)
+        # Xóa các part ghi sau checkpoint cuối cùng (bỏ qua file khác trong thư mục)
+        for name in os.listdir(path):
+            match = PART_FILE_PATTERN.fullmatch(name)
+            if match and int(match.group(1)) >= self.parts:
+                os.remove(os.path.join(path, name))
+
+    def write(self, records):
+        for record in records:
+            record["all_scores"] = json.dumps(record["all_scores"], ensure_ascii=False)
+            if record.get("id") is not None:
+                record["id"] = str(record["id"])
+        table = self.pa.Table.from_pylist(records, schema=self.schema)
+        self.pq.write_table(table, os.path.join(self.path, f"part-{self.parts:05d}.parquet"))
+        self.parts += 1
+        return {"output_parts": self.parts}
+
+    def close(self):
+        pass
+
+
+def make_job_id(input_path, text_column):
+    """Mã job ổn định theo file đầu vào, dùng cho tiến độ trong database"""
+    digest = hashlib.sha1(f"{os.path.abspath(input_path)}:{text_column}".encode()).hexdigest()[:12]
+    return f"{os.path.basename(input_path)}-{digest}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chấm điểm sentiment hàng loạt cho file CSV/JSONL/Parquet")
+    parser.add_argument("input", help="File đầu vào (.csv, .jsonl, .parquet)")
+    parser.add_argument("--input-format", choices=INPUT_FORMATS)
+    parser.add_argument("--text-column", default="text")
+    parser.add_argument("--id-column", help="Cột id được chép sang kết quả")
+    parser.add_argument("--output", help="File .jsonl hoặc thư mục .parquet chứa kết quả")
+    parser.add_argument("--to-db", action="store_true", help="Ghi kết quả vào database lịch sử")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Số dòng mỗi chunk/checkpoint")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--backend", default="torch")
+    parser.add_argument("--restart", action="store_true",
+                        help="Bỏ checkpoint cũ, chấm lại từ đầu (bị từ chối với --to-db nếu job đã ghi vào database)")
+    args = parser.parse_args()
+
+    if not args.output and not args.to_db:
+        parser.error("Cần --output và/hoặc --to-db")
+
+    from vietnamese_sentiment import VietnameseSentimentAnalyzer
+
+    fmt = args.input_format or detect_format(args.input)
+    job_id = make_job_id(args.input, args.text_column)
+
+    db_rows_done = 0
+    if args.to_db:
+        init_database()
+        db_rows_done = get_bulk_job_progress(job_id)
+        # Các dòng đã ghi của job không tách được khỏi lịch sử, chấm lại sẽ ghi trùng
+        if args.restart and db_rows_done:
+            parser.error(f"Job {job_id} đã ghi {db_rows_done} dòng vào database; --restart cùng "
+                         "--to-db sẽ ghi trùng các dòng này. Bỏ --restart để chấm tiếp phần còn lại")
+
+    checkpoint_path = (args.output.rstrip("/") if args.output else args.input) + ".checkpoint.json"
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+
+    writer = None
+    if args.output:
+        if args.output.rstrip("/").endswith(".parquet"):
+            writer = ParquetWriter(args.output, checkpoint, with_id=bool(args.id_column))
+        else:
+            writer = JsonlWriter(args.output, checkpoint)
+
+    # Với --to-db tiến độ trong database là chuẩn (ghi cùng transaction với kết quả)
+    start_row = checkpoint.state["rows_done"]
+    if args.to_db:
+        start_row = min(start_row, db_rows_done) if writer else db_rows_done
+    if start_row:
+        print(f"Tiếp tục từ dòng {start_row}", file=sys.stderr)
+
+    analyzer = VietnameseSentimentAnalyzer(backend=args.backend)
+    rows_done = start_row
+    started = time.perf_counter()
+    scored = 0
+
+    try:
+        for chunk in iter_chunks(read_rows(args.input, fmt, start_row), args.chunk_size):
+            texts = [str(row.get(args.text_column) or "") for row in chunk]
+            results = analyzer.analyze_many(texts, batch_size=args.batch_size)
+            first_row = rows_done
+            rows_done += len(chunk)
+
+            if writer and rows_done > checkpoint.state["rows_done"]:
+                records = []
+                for offset, (row, result) in enumerate(zip(chunk, results)):
+                    if first_row + offset < checkpoint.state["rows_done"]:
+                        continue
+                    record = {"row": first_row + offset}
+                    if args.id_column:
+                        record["id"] = row.get(args.id_column)
+                    record.update({
+                        "text": result['original_text'],
+                        "normalized_text": result['text'],
+                        "sentiment": result['sentiment'],
+                        "confidence": result['confidence'],
+                        "all_scores": result['all_scores'],
+                    })
+                    records.append(record)
+                checkpoint.save(rows_done=rows_done, **writer.write(records))
+
+            if args.to_db and rows_done > db_rows_done:
+                db_rows = [
+                    (result['original_text'], result['sentiment'], result['confidence'], None, result['text'],
+                     result['tier'])
+                    for offset, result in enumerate(results)
+                    if first_row + offset >= db_rows_done
+                ]
+                insert_sentiment_analysis_many(db_rows, job_id=job_id, rows_done=rows_done)
+                db_rows_done = rows_done
+
+            scored += len(chunk)
+            elapsed = time.perf_counter() - started
+            print(f"{rows_done} dòng - {scored / elapsed:.1f} dòng/s", file=sys.stderr)
+    finally:
+        if writer:
+            writer.close()
+
+    print(f"Xong: {rows_done} dòng", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
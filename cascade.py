@@ -0,0 +1,226 @@
+"""
+Cascade phân loại: model từ vựng nhẹ chạy trước, PhoBERT chỉ khi chưa chắc chắn
+
+Model nhẹ (hashed n-gram + logistic regression, scikit-learn) chạy trên text đã
+chuẩn hóa. Text có confidence của model nhẹ >= threshold lấy luôn kết quả đó,
+các text còn lại mới qua PhoBERT. Model nhẹ được train từ các label PhoBERT đã
+lưu trong sentiment_analysis.db.
+
+    python cascade.py train                               # train, lưu cascade_model.joblib
+    python cascade.py report --thresholds 0.8 0.9 0.95   # độ chính xác / throughput theo threshold
+
+Dùng: VietnameseSentimentAnalyzer(cascade_model=CASCADE_MODEL_PATH, cascade_threshold=0.9)
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+
+import joblib
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline, make_union
+
+import database
+from vietnamese_sentiment import BASE_DIR, TIER_MODEL, VietnameseSentimentAnalyzer, VietnameseTextStandardizer
+
+CASCADE_MODEL_PATH = os.path.join(BASE_DIR, "cascade_model.joblib")
+DEFAULT_THRESHOLDS = (0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+
+
+def build_model(n_features=2 ** 18, C=4.0):
+    """Hashed n-gram từ (1-2) và n-gram ký tự (2-4) + logistic regression"""
+    return make_pipeline(
+        make_union(
+            HashingVectorizer(analyzer="word", ngram_range=(1, 2), n_features=n_features,
+                              alternate_sign=False, norm="l2", token_pattern=r"\S+"),
+            HashingVectorizer(analyzer="char_wb", ngram_range=(2, 4), n_features=n_features,
+                              alternate_sign=False, norm="l2"),
+        ),
+        LogisticRegression(C=C, max_iter=1000),
+    )
+
+
+class CascadeClassifier:
+    """Model nhẹ của cascade, trả về score theo cùng format với PhoBERT"""
+
+    def __init__(self, model_path=CASCADE_MODEL_PATH):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Không tìm thấy {model_path}. Chạy: python cascade.py train")
+        self.model_path = model_path
+        self.model = joblib.load(model_path)
+        self.labels = [str(label) for label in self.model.classes_]
+
+    def version(self):
+        """Định danh của file model (đổi khi train lại)"""
+        stat = os.stat(self.model_path)
+        return f"{os.path.abspath(self.model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+    def predict_scores(self, texts):
+        """
+        Returns:
+            list: Mỗi phần tử là danh sách {'label', 'score'} của một text
+        """
+        if not texts:
+            return []
+        probs = self.model.predict_proba(texts)
+        return [[{'label': label, 'score': float(score)} for label, score in zip(self.labels, row)]
+                for row in probs.tolist()]
+
+
+def load_training_data(min_confidence=0.0, limit=None):
+    """
+    Đọc text đã chuẩn hóa và label PhoBERT từ database lịch sử
+
+    Chỉ lấy các dòng do PhoBERT phân loại: dòng lấy kết quả từ model nhẹ của
+    cascade (tier "cheap") bị bỏ qua để model không tự học lại label của chính
+    nó; dòng cũ chưa có cột tier (tier NULL) được coi là của PhoBERT.
+    Dòng chưa có normalized_text (lưu trước khi có cột này) được chuẩn hóa lại
+    (không restore dấu nên có thể khác chút so với lúc phân tích).
+
+    Args:
+        min_confidence: Chỉ lấy các dòng PhoBERT có confidence >= min_confidence
+        limit: Số dòng mới nhất tối đa (None: tất cả)
+
+    Returns:
+        tuple: (texts, labels)
+    """
+    database._flush_pending_writes()
+    with database.connection() as conn:
+        rows = conn.execute(
+            f'''SELECT text, normalized_text, sentiment FROM sentiment_analysis
+                WHERE confidence >= ? AND (tier IS NULL OR tier = ?)
+                ORDER BY id DESC{' LIMIT ?' if limit else ''}''',
+            (min_confidence, TIER_MODEL, limit) if limit else (min_confidence, TIER_MODEL)).fetchall()
+
+    standardizer = None
+    texts, labels = [], []
+    for text, normalized_text, sentiment in rows:
+        if normalized_text is None:
+            standardizer = standardizer or VietnameseTextStandardizer()
+            normalized_text = standardizer.standardize(text)
+        texts.append(normalized_text)
+        labels.append(sentiment)
+    return texts, labels
+
+
+def split_holdout(texts, labels, holdout=0.2, seed=0):
+    """Chia ngẫu nhiên thành (train_texts, train_labels, test_texts, test_labels)"""
+    indices = list(range(len(texts)))
+    random.Random(seed).shuffle(indices)
+    cut = int(len(indices) * (1 - holdout))
+    train_idx, test_idx = indices[:cut], indices[cut:]
+    return ([texts[i] for i in train_idx], [labels[i] for i in train_idx],
+            [texts[i] for i in test_idx], [labels[i] for i in test_idx])
+
+
+def train(texts, labels, output_path=CASCADE_MODEL_PATH, **kwargs):
+    """Train model nhẹ và lưu ra output_path"""
+    if len(set(labels)) < 2:
+        raise ValueError("Cần ít nhất hai label khác nhau để train")
+    model = build_model(**kwargs)
+    model.fit(texts, labels)
+    joblib.dump(model, output_path)
+    return model
+
+
+def threshold_report(texts, labels, thresholds=DEFAULT_THRESHOLDS, holdout=0.2,
+                     model_ms_per_text=None, analyzer=None, sample_size=200):
+    """
+    Độ chính xác và throughput của cascade theo từng threshold
+
+    Model nhẹ được train trên phần train và đánh giá trên phần holdout; label
+    PhoBERT trong database là đáp án, nên text được chuyển lên PhoBERT coi như đúng.
+
+    Args:
+        model_ms_per_text: Thời gian PhoBERT (ms/text) để ước lượng throughput
+            (None: đo bằng analyzer._classify trên sample_size text holdout)
+        analyzer: VietnameseSentimentAnalyzer dùng để đo (None: cấu hình mặc định)
+
+    Returns:
+        dict: Kích thước tập, thời gian mỗi tier và kết quả từng threshold
+
+    Raises:
+        ValueError: Phần holdout rỗng hoặc phần train có ít hơn hai label
+    """
+    train_texts, train_labels, test_texts, test_labels = split_holdout(texts, labels, holdout)
+    if not test_texts or len(set(train_labels)) < 2:
+        raise ValueError(f"Không đủ dữ liệu để đánh giá ({len(texts)} dòng, holdout {holdout:.0%}): "
+                         "cần phần holdout không rỗng và ít nhất hai label trong phần train")
+    model = build_model()
+    model.fit(train_texts, train_labels)
+    classes = [str(label) for label in model.classes_]
+
+    start = time.perf_counter()
+    probs = model.predict_proba(test_texts)
+    cheap_ms = (time.perf_counter() - start) * 1000 / len(test_texts)
+
+    if model_ms_per_text is None:
+        analyzer = analyzer or VietnameseSentimentAnalyzer()
+        sample = test_texts[:sample_size]
+        analyzer._classify(sample[:8])  # load model, không tính vào phép đo
+        start = time.perf_counter()
+        analyzer._classify(sample)
+        model_ms_per_text = (time.perf_counter() - start) * 1000 / len(sample)
+
+    predictions = [(classes[row.argmax()], row.max()) for row in probs]
+    rows = []
+    for threshold in thresholds:
+        accepted = [(label, truth) for (label, confidence), truth in zip(predictions, test_labels)
+                    if confidence >= threshold]
+        cheap_correct = sum(label == truth for label, truth in accepted)
+        escalated = len(test_texts) - len(accepted)
+        ms_per_text = cheap_ms + escalated / len(test_texts) * model_ms_per_text
+        rows.append({
+            "threshold": threshold,
+            "cheap_fraction": len(accepted) / len(test_texts),
+            "cheap_accuracy": cheap_correct / len(accepted) if accepted else None,
+            "accuracy": (cheap_correct + escalated) / len(test_texts),
+            "ms_per_text": ms_per_text,
+            "texts_per_sec": 1000 / ms_per_text,
+        })
+
+    return {
+        "train_size": len(train_texts),
+        "holdout_size": len(test_texts),
+        "cheap_ms_per_text": cheap_ms,
+        "model_ms_per_text": model_ms_per_text,
+        "model_only_texts_per_sec": 1000 / model_ms_per_text,
+        "thresholds": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model nhẹ cho cascade phân loại sentiment")
+    parser.add_argument("--min-confidence", type=float, default=0.0,
+                        help="Chỉ dùng các dòng PhoBERT có confidence >= giá trị này")
+    parser.add_argument("--limit", type=int, help="Số dòng mới nhất tối đa")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="Train model nhẹ từ database lịch sử")
+    train_parser.add_argument("--output", default=CASCADE_MODEL_PATH)
+
+    report_parser = subparsers.add_parser("report", help="Độ chính xác/throughput theo threshold")
+    report_parser.add_argument("--thresholds", type=float, nargs="+", default=list(DEFAULT_THRESHOLDS))
+    report_parser.add_argument("--model-ms", type=float,
+                               help="Thời gian PhoBERT (ms/text); mặc định đo trực tiếp")
+    args = parser.parse_args()
+
+    database.init_database()
+    texts, labels = load_training_data(args.min_confidence, args.limit)
+    if args.command == "train":
+        train(texts, labels, args.output)
+        print(f"Đã train trên {len(texts)} dòng, lưu vào {args.output}")
+    else:
+        report = threshold_report(texts, labels, args.thresholds, model_ms_per_text=args.model_ms)
+        for row in report["thresholds"]:
+            cheap_accuracy = "-" if row["cheap_accuracy"] is None else f"{row['cheap_accuracy']:.1%}"
+            print(f"threshold {row['threshold']:.2f}: model nhẹ xử lý {row['cheap_fraction']:6.1%} "
+                  f"(đúng {cheap_accuracy}), tổng {row['accuracy']:6.1%}, {row['texts_per_sec']:8.1f} text/s")
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
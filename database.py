@@ -1,27 +1,56 @@
+import atexit
+import contextlib
+import queue
 import sqlite3
 import os
+import re
+import sys
+import threading
+import time
 from datetime import datetime
 
+from instrumentation import METRICS
+
 # Đường dẫn database
 DB_PATH = 'sentiment_analysis.db'
 
+# Pragma áp dụng cho mọi connection:
+# - WAL: đọc không chặn ghi, nhiều session đọc/ghi đồng thời không bị "database is locked"
+# - synchronous=NORMAL: với WAL chỉ fsync khi checkpoint thay vì mỗi commit
+# - busy_timeout: chờ khóa ghi thay vì báo lỗi ngay
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# Số connection tối đa mỗi pool
+POOL_SIZE = 4
+
 def get_connection():
     """
-    Tạo và trả về connection đến database
-    
+    Tạo và trả về connection mới đến database (đã áp dụng PRAGMAS)
+
+    Connection do hàm này tạo phải được đóng bởi nơi gọi; các hàm trong
+    module dùng connection() để mượn connection từ pool.
+
     Returns:
         sqlite3.Connection: Connection object
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=5.0, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 def get_cursor(conn=None):
     """
     Lấy cursor từ connection
-    
+
     Args:
         conn: Connection object (nếu None sẽ tạo connection mới)
-    
+
     Returns:
         sqlite3.Cursor: Cursor object
     """
@@ -29,71 +58,698 @@ def get_cursor(conn=None):
         conn = get_connection()
     return conn.cursor()
 
+class ConnectionPool:
+    """Pool connection dùng chung giữa các thread (mỗi connection chỉ một thread dùng tại một thời điểm)"""
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Mượn một connection, trả lại pool khi ra khỏi khối with"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            # Không trả connection đang dở transaction về pool
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return get_connection()
+        return self._idle.get()
+
+    def close(self):
+        """Đóng các connection đang rảnh"""
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def connection():
+    """
+    Mượn connection từ pool của DB_PATH hiện tại
+
+    Ví dụ:
+        with connection() as conn:
+            conn.execute(...)
+    """
+    pool = _pools.get(DB_PATH)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(DB_PATH, ConnectionPool())
+    return pool.connection()
+
+def close_connections():
+    """Ghi hết hàng đợi ghi trễ rồi đóng mọi connection trong pool"""
+    if _write_behind is not None:
+        _write_behind.flush(timeout=SHUTDOWN_FLUSH_TIMEOUT)
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+def fold_d(text):
+    """Đổi đ/Đ thành d/D (giữ nguyên độ dài) để tìm không dấu khớp cả chữ đ"""
+    return text.replace('đ', 'd').replace('Đ', 'D')
+
+def _fold_sql(expr):
+    """Biểu thức SQL tương đương fold_d(expr)"""
+    return f"replace(replace({expr}, 'đ', 'd'), 'Đ', 'D')"
+
 def init_database():
     """
     Khởi tạo database và tạo bảng nếu chưa tồn tại
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # Tạo bảng sentiment_analysis
+    with connection() as conn:
+        cur = conn.cursor()
+
+        # Tạo bảng sentiment_analysis
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sentiment_analysis (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT,
+                sentiment TEXT,
+                confidence REAL,
+                timestamp TEXT,
+                normalized_text TEXT,
+                tier TEXT
+            )
+        ''')
+        # Database cũ chưa có cột văn bản đã chuẩn hóa / cột tier
+        columns = [row[1] for row in cur.execute('''PRAGMA table_info(sentiment_analysis)''')]
+        if 'normalized_text' not in columns:
+            cur.execute('''ALTER TABLE sentiment_analysis ADD COLUMN normalized_text TEXT''')
+        if 'tier' not in columns:
+            cur.execute('''ALTER TABLE sentiment_analysis ADD COLUMN tier TEXT''')
+
+        # Index cho lọc theo thời gian và phân trang theo label (keyset trên id)
+        cur.execute('''CREATE INDEX IF NOT EXISTS idx_sentiment_analysis_timestamp
+                       ON sentiment_analysis (timestamp)''')
+        cur.execute('''CREATE INDEX IF NOT EXISTS idx_sentiment_analysis_sentiment_id
+                       ON sentiment_analysis (sentiment, id)''')
+
+        # Tiến độ các job chấm điểm hàng loạt (bulk_score.py)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS bulk_jobs (
+                job_id TEXT PRIMARY KEY,
+                rows_done INTEGER,
+                updated_at TEXT
+            )
+        ''')
+
+        # Bảng tổng hợp được cập nhật dần bằng trigger mỗi khi insert,
+        # dashboard chỉ đọc vài dòng thay vì quét toàn bộ sentiment_analysis
+        summary_exists = cur.execute(
+            '''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sentiment_summary' ''').fetchone()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sentiment_summary (
+                sentiment TEXT PRIMARY KEY,
+                count INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL
+            )
+        ''')
+        # bucket: 'YYYY-MM-DD HH' (theo giờ, gộp theo ngày bằng substr)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sentiment_summary_hourly (
+                bucket TEXT NOT NULL,
+                sentiment TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL,
+                PRIMARY KEY (bucket, sentiment)
+            )
+        ''')
+        cur.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_sentiment_summary_insert
+            AFTER INSERT ON sentiment_analysis
+            BEGIN
+                INSERT INTO sentiment_summary (sentiment, count, confidence_sum)
+                VALUES (NEW.sentiment, 1, COALESCE(NEW.confidence, 0))
+                ON CONFLICT (sentiment) DO UPDATE SET
+                    count = count + 1,
+                    confidence_sum = confidence_sum + excluded.confidence_sum;
+                INSERT INTO sentiment_summary_hourly (bucket, sentiment, count, confidence_sum)
+                VALUES (substr(NEW.timestamp, 1, 13), NEW.sentiment, 1, COALESCE(NEW.confidence, 0))
+                ON CONFLICT (bucket, sentiment) DO UPDATE SET
+                    count = count + 1,
+                    confidence_sum = confidence_sum + excluded.confidence_sum;
+            END
+        ''')
+        # Số dòng đã chuyển ra Parquet (history_archive.py) theo label và theo giờ:
+        # bảng tổng hợp vẫn tính các dòng này, danh sách/tìm kiếm chỉ thấy dòng còn
+        # trong SQLite; _rebuild_summary cộng lại phần theo giờ nên không mất khi tính lại
+        archive_exists = cur.execute(
+            '''SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sentiment_archive_summary' ''').fetchone()
+        archive_hourly_exists = cur.execute(
+            '''SELECT 1 FROM sqlite_master WHERE type = 'table'
+               AND name = 'sentiment_archive_summary_hourly' ''').fetchone()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sentiment_archive_summary (
+                sentiment TEXT PRIMARY KEY,
+                count INTEGER NOT NULL
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS sentiment_archive_summary_hourly (
+                bucket TEXT NOT NULL,
+                sentiment TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL,
+                PRIMARY KEY (bucket, sentiment)
+            )
+        ''')
+
+        # Database cũ: tính bảng tổng hợp một lần từ dữ liệu đã có
+        if not summary_exists:
+            _rebuild_summary(cur)
+        # Database đã lưu trữ trước khi có bảng này: phần chênh lệch là số dòng đã lưu trữ
+        elif not archive_exists:
+            cur.execute('''
+                INSERT INTO sentiment_archive_summary (sentiment, count)
+                SELECT s.sentiment, s.count - COALESCE(live.count, 0)
+                FROM sentiment_summary s
+                LEFT JOIN (SELECT sentiment, COUNT(*) AS count FROM sentiment_analysis GROUP BY sentiment) live
+                    ON live.sentiment = s.sentiment
+                WHERE s.count > COALESCE(live.count, 0)
+            ''')
+        if summary_exists and not archive_hourly_exists:
+            cur.execute('''
+                INSERT INTO sentiment_archive_summary_hourly (bucket, sentiment, count, confidence_sum)
+                SELECT h.bucket, h.sentiment, h.count - COALESCE(live.count, 0),
+                       h.confidence_sum - COALESCE(live.confidence_sum, 0)
+                FROM sentiment_summary_hourly h
+                LEFT JOIN (SELECT substr(timestamp, 1, 13) AS bucket, sentiment, COUNT(*) AS count,
+                                  COALESCE(SUM(confidence), 0) AS confidence_sum
+                           FROM sentiment_analysis GROUP BY substr(timestamp, 1, 13), sentiment) live
+                    ON live.bucket = h.bucket AND live.sentiment = h.sentiment
+                WHERE h.count > COALESCE(live.count, 0)
+            ''')
+
+        # Index full-text (FTS5) trên văn bản gốc và văn bản đã chuẩn hóa, nội dung
+        # lấy từ view sentiment_analysis_folded (external content) nên không lưu text hai lần.
+        # remove_diacritics 2: tìm "san pham" cũng khớp "sản phẩm"; unicode61 không
+        # coi "đ" là "d" có dấu nên view đổi đ/Đ -> d/D trước khi đánh index
+        fts_sql = cur.execute(
+            '''SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'sentiment_analysis_fts' ''').fetchone()
+        fts_exists = fts_sql is not None and 'sentiment_analysis_folded' in fts_sql[0]
+        if fts_sql is not None and not fts_exists:
+            # Index cũ (đánh trực tiếp trên sentiment_analysis): tạo lại trên view
+            for trigger in ('trg_sentiment_fts_insert', 'trg_sentiment_fts_delete', 'trg_sentiment_fts_update'):
+                cur.execute(f'''DROP TRIGGER IF EXISTS {trigger}''')
+            cur.execute('''DROP TABLE sentiment_analysis_fts''')
+        cur.execute(f'''
+            CREATE VIEW IF NOT EXISTS sentiment_analysis_folded AS
+            SELECT id, {_fold_sql('text')} AS text, {_fold_sql('normalized_text')} AS normalized_text
+            FROM sentiment_analysis
+        ''')
+        cur.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS sentiment_analysis_fts USING fts5(
+                text, normalized_text,
+                content = 'sentiment_analysis_folded', content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        ''')
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_sentiment_fts_insert
+            AFTER INSERT ON sentiment_analysis
+            BEGIN
+                INSERT INTO sentiment_analysis_fts (rowid, text, normalized_text)
+                VALUES (NEW.id, {_fold_sql('NEW.text')}, {_fold_sql('NEW.normalized_text')});
+            END
+        ''')
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_sentiment_fts_delete
+            AFTER DELETE ON sentiment_analysis
+            BEGIN
+                INSERT INTO sentiment_analysis_fts (sentiment_analysis_fts, rowid, text, normalized_text)
+                VALUES ('delete', OLD.id, {_fold_sql('OLD.text')}, {_fold_sql('OLD.normalized_text')});
+            END
+        ''')
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_sentiment_fts_update
+            AFTER UPDATE OF text, normalized_text ON sentiment_analysis
+            BEGIN
+                INSERT INTO sentiment_analysis_fts (sentiment_analysis_fts, rowid, text, normalized_text)
+                VALUES ('delete', OLD.id, {_fold_sql('OLD.text')}, {_fold_sql('OLD.normalized_text')});
+                INSERT INTO sentiment_analysis_fts (rowid, text, normalized_text)
+                VALUES (NEW.id, {_fold_sql('NEW.text')}, {_fold_sql('NEW.normalized_text')});
+            END
+        ''')
+        # Database cũ: đánh index các dòng đã có
+        if not fts_exists:
+            cur.execute('''INSERT INTO sentiment_analysis_fts (sentiment_analysis_fts) VALUES ('rebuild')''')
+
+        conn.commit()
+
+def _rebuild_summary(cur):
+    """
+    Tính lại các bảng tổng hợp từ sentiment_analysis bằng GROUP BY, cộng thêm
+    phần của các dòng đã lưu trữ (sentiment_archive_summary_hourly, giữ nguyên)
+    """
+    cur.execute('''DELETE FROM sentiment_summary''')
+    cur.execute('''DELETE FROM sentiment_summary_hourly''')
+    cur.execute('''
+        INSERT INTO sentiment_summary_hourly (bucket, sentiment, count, confidence_sum)
+        SELECT bucket, sentiment, SUM(count), SUM(confidence_sum) FROM (
+            SELECT substr(timestamp, 1, 13) AS bucket, sentiment, COUNT(*) AS count,
+                   COALESCE(SUM(confidence), 0) AS confidence_sum
+            FROM sentiment_analysis GROUP BY substr(timestamp, 1, 13), sentiment
+            UNION ALL
+            SELECT bucket, sentiment, count, confidence_sum FROM sentiment_archive_summary_hourly
+        ) GROUP BY bucket, sentiment
+    ''')
     cur.execute('''
-        CREATE TABLE IF NOT EXISTS sentiment_analysis (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            text TEXT,
-            sentiment TEXT,
-            confidence REAL,
-            timestamp TEXT
-        )
+        INSERT INTO sentiment_summary (sentiment, count, confidence_sum)
+        SELECT sentiment, SUM(count), SUM(confidence_sum)
+        FROM sentiment_summary_hourly GROUP BY sentiment
     ''')
-    
-    conn.commit()
-    conn.close()
+
+def rebuild_summary():
+    """
+    Tính lại các bảng tổng hợp từ toàn bộ bảng sentiment_analysis
+    (chỉ cần khi dữ liệu bị sửa trực tiếp ngoài các hàm insert; các dòng
+    đã lưu trữ ra Parquet vẫn được tính qua sentiment_archive_summary_hourly)
+    """
+    with connection() as conn, conn:
+        _rebuild_summary(conn.cursor())
 
 def get_timestamp():
     """
     Lấy timestamp hiện tại dưới dạng YYYY-MM-DD HH:MM:SS
-    
+
     Returns:
         str: Timestamp string theo định dạng YYYY-MM-DD HH:MM:SS
     """
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-def insert_sentiment_analysis(text, sentiment, confidence, timestamp=None):
+def insert_sentiment_analysis(text, sentiment, confidence, timestamp=None, normalized_text=None, tier=None):
     """
     Lưu văn bản và kết quả phân tích vào database
-    
+
     Args:
         text: Văn bản gốc
         sentiment: Label sentiment (NEG/POS/NEU)
         confidence: Độ tin cậy (0-1)
         timestamp: Timestamp (optional, tự động tạo nếu None)
+        normalized_text: Văn bản đã chuẩn hóa (optional, được đánh index tìm kiếm)
+        tier: Model tạo ra kết quả - "model" (PhoBERT) hoặc "cheap" (model nhẹ
+              của cascade); None với dòng cũ, coi như PhoBERT
     """
+    start = time.perf_counter() if METRICS.enabled else None
     if timestamp is None:
         timestamp = get_timestamp()
-    
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''INSERT INTO sentiment_analysis (text, sentiment, confidence, timestamp) 
-                   VALUES (?, ?, ?, ?)''', 
-                (text, sentiment, confidence, timestamp))
-    conn.commit()
-    conn.close()
 
-def get_sentiment_analysis():
+    with connection() as conn:
+        conn.execute('''INSERT INTO sentiment_analysis (text, sentiment, confidence, timestamp, normalized_text, tier)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                     (text, sentiment, confidence, timestamp, normalized_text, tier))
+        conn.commit()
+    if start is not None:
+        METRICS.observe('db_insert', time.perf_counter() - start, batch_size=1)
+
+def insert_sentiment_analysis_many(rows, job_id=None, rows_done=None):
     """
-    Lấy tất cả kết quả phân tích từ database (sắp xếp theo thời gian mới nhất)
+    Lưu nhiều kết quả phân tích trong một transaction (một connection, executemany)
+
+    Args:
+        rows: Danh sách tuple (text, sentiment, confidence, timestamp), có thể
+              thêm normalized_text và tier (xem insert_sentiment_analysis);
+              timestamp None sẽ được tự động tạo
+        job_id: Mã job chấm điểm hàng loạt (optional)
+        rows_done: Số dòng đầu vào job_id đã xử lý xong, được ghi cùng
+                   transaction với kết quả để khi resume không bị ghi trùng
+    """
+    start = time.perf_counter() if METRICS.enabled else None
+    timestamp = get_timestamp()
+    rows = [(row[0], row[1], row[2], row[3] or timestamp,
+             row[4] if len(row) > 4 else None, row[5] if len(row) > 5 else None) for row in rows]
+
+    with connection() as conn, conn:
+        conn.executemany('''INSERT INTO sentiment_analysis (text, sentiment, confidence, timestamp, normalized_text, tier)
+                            VALUES (?, ?, ?, ?, ?, ?)''', rows)
+        if job_id is not None:
+            conn.execute('''INSERT OR REPLACE INTO bulk_jobs (job_id, rows_done, updated_at)
+                            VALUES (?, ?, ?)''', (job_id, rows_done, timestamp))
+    if start is not None:
+        METRICS.observe('db_insert', time.perf_counter() - start, batch_size=len(rows))
+
+# Thời gian tối đa chờ ghi hàng đợi ghi trễ khi đóng/thoát process (giây)
+SHUTDOWN_FLUSH_TIMEOUT = 10.0
+
+class WriteBehindWriter:
+    """
+    Hàng đợi ghi trễ: enqueue() trả về ngay, một thread nền gom các dòng
+    và ghi bằng insert_sentiment_analysis_many khi đủ max_batch_size dòng
+    hoặc dòng cũ nhất đã chờ max_delay giây.
+
+    Khi ghi lỗi, các dòng được thử lại tối đa max_retries lần, thời gian chờ
+    tăng gấp đôi mỗi lần (tối đa max_backoff giây); sau đó bị bỏ và được đếm
+    trong dropped_rows, để database hỏng lâu (chỉ đọc, đầy đĩa) không làm
+    hàng đợi kẹt mãi.
+    """
+
+    def __init__(self, max_batch_size=256, max_delay=0.5, max_retries=5, max_backoff=30.0):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.last_error = None
+        self.dropped_rows = 0
+        self._failures = 0
+        self._retry_at = 0.0
+        self._pending = []
+        self._oldest = None
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sentiment-db-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, text, sentiment, confidence, timestamp=None, normalized_text=None, tier=None):
+        """Đưa một kết quả vào hàng đợi (timestamp lấy tại thời điểm gọi nếu None)"""
+        row = (text, sentiment, confidence, timestamp or get_timestamp(), normalized_text, tier)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("WriteBehindWriter đã đóng")
+            self._pending.append(row)
+            # Dòng đầu tiên: thread nền bắt đầu đếm max_delay; đủ batch: ghi ngay
+            if len(self._pending) == 1:
+                self._oldest = time.monotonic()
+                self._cond.notify_all()
+            elif len(self._pending) >= self.max_batch_size:
+                self._cond.notify_all()
+
+    def pending_count(self):
+        """Số dòng chưa được ghi xuống database"""
+        with self._cond:
+            return len(self._pending) + self._in_flight
+
+    def flush(self, timeout=None):
+        """
+        Chờ tới khi mọi dòng đã enqueue được ghi xong
+
+        Returns:
+            bool: False nếu hết timeout mà vẫn còn dòng chưa ghi
+        """
+        with self._cond:
+            if self._pending:
+                self._oldest = float("-inf")
+                self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._in_flight, timeout)
+
+    def close(self, timeout=None):
+        """Ghi hết các dòng còn lại rồi dừng thread nền"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    timeout = None
+                    if self._pending:
+                        # Khi đóng thì ghi ngay; đủ batch thì chỉ chờ hết thời gian backoff
+                        if self._closed:
+                            ready_at = 0.0
+                        elif len(self._pending) >= self.max_batch_size:
+                            ready_at = self._retry_at
+                        else:
+                            ready_at = max(self._oldest + self.max_delay, self._retry_at)
+                        timeout = ready_at - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    elif self._closed:
+                        return
+                    self._cond.wait(timeout)
+                rows, self._pending = self._pending, []
+                self._in_flight = len(rows)
+
+            try:
+                insert_sentiment_analysis_many(rows)
+                self.last_error = None
+                self._failures = 0
+                self._retry_at = 0.0
+            except Exception as e:
+                self.last_error = e
+                self._failures += 1
+                if self._closed or self._failures > self.max_retries:
+                    print(f"Lỗi ghi database ({self._failures} lần), bỏ {len(rows)} dòng: {e}", file=sys.stderr)
+                    self.dropped_rows += len(rows)
+                    self._failures = 0
+                    self._retry_at = 0.0
+                else:
+                    # Giữ lại các dòng, thử ghi lại sau thời gian chờ tăng dần
+                    backoff = min(self.max_delay * 2 ** (self._failures - 1), self.max_backoff)
+                    print(f"Lỗi ghi database, thử lại sau {backoff:.1f}s: {e}", file=sys.stderr)
+                    with self._cond:
+                        self._pending[:0] = rows
+                        self._retry_at = time.monotonic() + backoff
+
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+def get_write_behind():
+    """WriteBehindWriter dùng chung trong process (tạo ở lần gọi đầu, tự flush khi thoát)"""
+    global _write_behind
+    if _write_behind is None:
+        with _write_behind_lock:
+            if _write_behind is None:
+                _write_behind = WriteBehindWriter()
+                atexit.register(_write_behind.close, SHUTDOWN_FLUSH_TIMEOUT)
+    return _write_behind
+
+def enqueue_sentiment_analysis(text, sentiment, confidence, timestamp=None, normalized_text=None, tier=None):
+    """
+    Như insert_sentiment_analysis nhưng không chờ ghi đĩa (qua WriteBehindWriter)
+
+    Các hàm đọc lịch sử tự flush hàng đợi trước nên vẫn thấy kết quả vừa lưu.
+    """
+    get_write_behind().enqueue(text, sentiment, confidence, timestamp, normalized_text, tier)
+
+def _flush_pending_writes():
+    """Ghi các dòng đang chờ trước khi đọc (read-your-writes)"""
+    if _write_behind is not None and _write_behind.pending_count():
+        _write_behind.flush(timeout=5.0)
+
+def get_bulk_job_progress(job_id):
+    """
+    Lấy số dòng đầu vào đã ghi vào database của một job chấm điểm hàng loạt
 
     Returns:
-        list: Danh sách các kết quả phân tích dạng tuple (id, text, sentiment, confidence, timestamp)
+        int: Số dòng đã xử lý (0 nếu job chưa chạy)
+    """
+    with connection() as conn:
+        row = conn.execute('''SELECT rows_done FROM bulk_jobs WHERE job_id = ?''', (job_id,)).fetchone()
+    return row[0] if row else 0
+
+def get_history(before_id=None, limit=20, sentiment=None, since=None):
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('''SELECT * FROM sentiment_analysis ORDER BY timestamp DESC''')
-    results = cur.fetchall()
-    conn.close()
+    Lấy một trang lịch sử, mới nhất trước (phân trang keyset theo id)
+
+    Thời gian truy vấn không phụ thuộc số dòng trong bảng vì chỉ đọc
+    limit dòng ngay sau con trỏ before_id trên index, không dùng OFFSET.
+
+    Args:
+        before_id: Chỉ lấy các dòng có id < before_id (None: trang đầu tiên);
+                   trang tiếp theo dùng id của dòng cuối trang hiện tại
+        limit: Số dòng tối đa của trang
+        sentiment: Chỉ lấy label này (None: mọi label)
+        since: Chỉ lấy các dòng có timestamp >= since (YYYY-MM-DD HH:MM:SS)
+
+    Returns:
+        list: Các tuple (id, text, sentiment, confidence, timestamp)
+    """
+    start = time.perf_counter() if METRICS.enabled else None
+    conditions = []
+    params = []
+    if before_id is not None:
+        conditions.append("id < ?")
+        params.append(before_id)
+    if sentiment is not None:
+        conditions.append("sentiment = ?")
+        params.append(sentiment)
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    _flush_pending_writes()
+    with connection() as conn:
+        results = conn.execute(
+            f'''SELECT id, text, sentiment, confidence, timestamp FROM sentiment_analysis
+                {where} ORDER BY id DESC LIMIT ?''', (*params, limit)).fetchall()
+    if start is not None:
+        METRICS.observe('db_fetch', time.perf_counter() - start, batch_size=len(results))
     return results
 
+def fts_query(query):
+    """
+    Chuyển chuỗi người dùng nhập thành biểu thức MATCH của FTS5
 
+    Mỗi từ được đặt trong dấu nháy (không bị hiểu là cú pháp FTS5 như
+    AND/OR/NEAR/*), các từ nối với nhau bằng AND, từ cuối khớp theo tiền tố
+    để gõ dở vẫn tìm được. Trả về None nếu không có từ nào.
+    """
+    terms = [term.replace('"', '""') for term in re.findall(r"\w+", fold_d(query))]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"' for term in terms) + "*"
 
+def search_history(query, limit=20, offset=0, sentiment=None, since=None, until=None):
+    """
+    Tìm kiếm lịch sử bằng index full-text, xếp theo độ liên quan (bm25)
 
+    Args:
+        query: Từ khóa (có dấu hoặc không dấu)
+        limit: Số kết quả mỗi trang
+        offset: Bỏ qua offset kết quả đầu (trang thứ n: offset = n * limit)
+        sentiment: Chỉ lấy label này (None: mọi label)
+        since, until: Khoảng thời gian [since, until) dạng YYYY-MM-DD[ HH:MM:SS]
+
+    Returns:
+        list: Các tuple (id, text, sentiment, confidence, timestamp, snippet);
+              snippet là đoạn văn bản khớp, từ khớp được bọc trong ** **
+    """
+    match = fts_query(query)
+    if match is None:
+        return []
+    conditions = ["sentiment_analysis_fts MATCH ?"]
+    params = [match]
+    if sentiment is not None:
+        conditions.append("s.sentiment = ?")
+        params.append(sentiment)
+    if since is not None:
+        conditions.append("s.timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("s.timestamp < ?")
+        params.append(until)
+
+    _flush_pending_writes()
+    with connection() as conn:
+        rows = conn.execute(
+            f'''SELECT s.id, s.text, s.sentiment, s.confidence, s.timestamp,
+                       snippet(sentiment_analysis_fts, -1, '**', '**', '…', 16), s.normalized_text
+                FROM sentiment_analysis_fts
+                JOIN sentiment_analysis s ON s.id = sentiment_analysis_fts.rowid
+                WHERE {' AND '.join(conditions)}
+                ORDER BY sentiment_analysis_fts.rank LIMIT ? OFFSET ?''',
+            (*params, limit, offset)).fetchall()
+    return [(*row[:5], _unfold_snippet(row[5], (row[1], row[6]))) for row in rows]
+
+def _unfold_snippet(snippet, originals):
+    """
+    Đưa snippet (cắt từ văn bản đã fold_d) về đúng ký tự của văn bản gốc
+
+    fold_d giữ nguyên độ dài nên chỉ cần tìm vị trí đoạn trích trong văn bản
+    gốc đã fold rồi lấy lại các ký tự gốc tại đó.
+    """
+    if not snippet:
+        return snippet
+    prefix = '…' if snippet.startswith('…') else ''
+    suffix = '…' if snippet.endswith('…') and len(snippet) > len(prefix) else ''
+    parts = snippet[len(prefix):len(snippet) - len(suffix)].split('**')
+    plain = "".join(parts)
+    for original in originals:
+        index = fold_d(original).find(plain) if original else -1
+        if index < 0:
+            continue
+        restored = []
+        for part in parts:
+            restored.append(original[index:index + len(part)])
+            index += len(part)
+        return prefix + "**".join(restored) + suffix
+    return snippet
+
+def get_summary():
+    """
+    Thống kê tổng quan từ bảng tổng hợp (không quét bảng lịch sử)
+
+    Returns:
+        dict: {
+            'total': tổng số lần phân tích (kể cả các dòng đã lưu trữ ra Parquet),
+            'counts': {label: số lần},
+            'mean_confidence': {label: confidence trung bình},
+            'overall_mean_confidence': confidence trung bình của mọi label (None nếu chưa có dữ liệu),
+            'archived': số dòng đã lưu trữ ra Parquet (không còn trong sentiment_analysis),
+            'archived_counts': {label: số dòng đã lưu trữ}
+        }
+    """
+    _flush_pending_writes()
+    with connection() as conn:
+        rows = conn.execute('''SELECT sentiment, count, confidence_sum FROM sentiment_summary''').fetchall()
+        archived_rows = conn.execute('''SELECT sentiment, count FROM sentiment_archive_summary''').fetchall()
+    total = sum(count for _, count, _ in rows)
+    return {
+        'total': total,
+        'archived': sum(count for _, count in archived_rows),
+        'archived_counts': dict(archived_rows),
+        'counts': {label: count for label, count, _ in rows},
+        'mean_confidence': {label: conf_sum / count for label, count, conf_sum in rows if count},
+        'overall_mean_confidence': sum(conf_sum for _, _, conf_sum in rows) / total if total else None,
+    }
+
+def get_summary_timeseries(granularity="day", since=None):
+    """
+    Số lần phân tích và confidence trung bình theo thời gian, từng label
+
+    Args:
+        granularity: "day" hoặc "hour"
+        since: Chỉ lấy các bucket từ thời điểm này (YYYY-MM-DD hoặc YYYY-MM-DD HH)
+
+    Returns:
+        list: Các tuple (bucket, sentiment, count, mean_confidence) theo thứ tự thời gian;
+              bucket là 'YYYY-MM-DD' (day) hoặc 'YYYY-MM-DD HH' (hour)
+    """
+    if granularity not in ("day", "hour"):
+        raise ValueError("granularity phải là 'day' hoặc 'hour'")
+    bucket = "substr(bucket, 1, 10)" if granularity == "day" else "bucket"
+    where = "WHERE bucket >= ?" if since is not None else ""
+    params = (since,) if since is not None else ()
+
+    _flush_pending_writes()
+    with connection() as conn:
+        return conn.execute(
+            f'''SELECT {bucket} AS b, sentiment, SUM(count), SUM(confidence_sum) / SUM(count)
+                FROM sentiment_summary_hourly {where}
+                GROUP BY b, sentiment ORDER BY b''', params).fetchall()
+
+def get_sentiment_analysis():
+    """
+    Lấy tất cả kết quả phân tích từ database (sắp xếp theo thời gian mới nhất)
+
+    Returns:
+        list: Danh sách các kết quả phân tích dạng tuple (id, text, sentiment, confidence, timestamp)
+    """
+    start = time.perf_counter() if METRICS.enabled else None
+    _flush_pending_writes()
+    with connection() as conn:
+        results = conn.execute('''SELECT id, text, sentiment, confidence, timestamp
+                                   FROM sentiment_analysis ORDER BY timestamp DESC''').fetchall()
+    if start is not None:
+        METRICS.observe('db_fetch', time.perf_counter() - start, batch_size=len(results))
+    return results
@@ -0,0 +1,290 @@
+"""
+Lưu trữ lịch sử cũ ra Parquet và đọc chung SQLite + Parquet
+
+- archive_older_than(): chuyển các dòng cũ hơn N ngày từ sentiment_analysis
+  sang file Parquet phân vùng theo ngày và label
+  (history_archive/date=YYYY-MM-DD/sentiment=POS/part-....parquet), theo
+  từng chunk nên không cần load toàn bộ bảng vào bộ nhớ.
+- iter_history_batches() / read_history(): đọc dữ liệu còn trong SQLite và
+  dữ liệu đã lưu trữ cùng lúc; điều kiện lọc được đẩy xuống SQL (WHERE) và
+  Parquet (bỏ qua phân vùng/row group không khớp).
+
+Bảng tổng hợp (get_summary, get_summary_timeseries) không bị ảnh hưởng khi
+lưu trữ nên thống kê vẫn tính cả các dòng đã chuyển ra Parquet; số dòng đã
+chuyển được đếm riêng (get_summary()['archived']) để tách khỏi số dòng còn
+trong SQLite (danh sách/tìm kiếm ở tab Lịch sử).
+
+Chạy:
+    python history_archive.py archive --days 90 --vacuum
+    python history_archive.py export history.parquet --since 2025-01-01 --sentiment NEG
+"""
+
+import argparse
+import os
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import database
+
+ARCHIVE_DIR = os.path.join(os.path.dirname(database.DB_PATH), 'history_archive')
+HISTORY_COLUMNS = ('id', 'text', 'sentiment', 'confidence', 'timestamp', 'normalized_text', 'tier')
+
+
+def _pyarrow():
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.parquet
+    return pyarrow
+
+
+def history_schema():
+    pa = _pyarrow()
+    return pa.schema([
+        ('id', pa.int64()),
+        ('text', pa.string()),
+        ('sentiment', pa.string()),
+        ('confidence', pa.float64()),
+        ('timestamp', pa.string()),
+        ('normalized_text', pa.string()),
+        ('tier', pa.string()),
+    ])
+
+
+def partitioning():
+    """Phân vùng kiểu hive theo ngày và label"""
+    pa = _pyarrow()
+    return pa.dataset.partitioning(
+        pa.schema([('date', pa.string()), ('sentiment', pa.string())]), flavor="hive")
+
+
+def archive_older_than(days, archive_dir=ARCHIVE_DIR, chunk_size=50000, vacuum=False):
+    """
+    Chuyển các dòng có timestamp cũ hơn days ngày sang Parquet rồi xóa khỏi SQLite
+
+    Mỗi chunk được ghi ra file trước, sau đó mới xóa khỏi database trong một
+    transaction. Tên file theo id đầu/cuối của chunk nên nếu bị dừng giữa hai
+    bước, chạy lại (cùng chunk_size) sẽ ghi đè đúng các file đó thay vì tạo bản trùng.
+
+    Args:
+        days: Giữ lại trong SQLite các dòng trong days ngày gần nhất
+        archive_dir: Thư mục gốc chứa các phân vùng Parquet
+        chunk_size: Số dòng đọc/ghi mỗi lần
+        vacuum: Chạy VACUUM sau khi xóa để thu nhỏ file database
+
+    Returns:
+        int: Số dòng đã chuyển
+    """
+    pa = _pyarrow()
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    file_schema = history_schema().remove(2)  # cột sentiment nằm trong đường dẫn phân vùng
+
+    archived = 0
+    last_id = 0
+    while True:
+        with database.connection() as conn:
+            rows = conn.execute(
+                '''SELECT id, text, sentiment, confidence, timestamp, normalized_text, tier FROM sentiment_analysis
+                   WHERE timestamp < ? AND id > ? ORDER BY id LIMIT ?''',
+                (cutoff, last_id, chunk_size)).fetchall()
+        if not rows:
+            break
+        first_id, last_chunk_id = rows[0][0], rows[-1][0]
+
+        groups = defaultdict(list)
+        for row in rows:
+            groups[(row[4][:10], row[2])].append(row)
+        for (date, sentiment), group in groups.items():
+            partition_dir = os.path.join(archive_dir, f"date={date}", f"sentiment={sentiment}")
+            os.makedirs(partition_dir, exist_ok=True)
+            table = pa.Table.from_pydict({
+                'id': [row[0] for row in group],
+                'text': [row[1] for row in group],
+                'confidence': [row[3] for row in group],
+                'timestamp': [row[4] for row in group],
+                'normalized_text': [row[5] for row in group],
+                'tier': [row[6] for row in group],
+            }, schema=file_schema)
+            name = f"part-{first_id:012d}-{last_chunk_id:012d}.parquet"
+            path = os.path.join(partition_dir, name)
+            # File tạm bắt đầu bằng "." bị pyarrow.dataset bỏ qua khi đọc
+            tmp_path = os.path.join(partition_dir, f".{name}.tmp")
+            pa.parquet.write_table(table, tmp_path)
+            os.replace(tmp_path, path)
+
+        # Các dòng của chunk là mọi dòng timestamp < cutoff có id trong (last_id, last_chunk_id];
+        # số dòng đã lưu trữ (theo label và theo giờ) được cộng trong cùng transaction với lệnh xóa
+        hourly = defaultdict(lambda: [0, 0.0])
+        for row in rows:
+            totals = hourly[(row[4][:13], row[2])]
+            totals[0] += 1
+            totals[1] += row[3] or 0
+        with database.connection() as conn, conn:
+            conn.execute(
+                '''DELETE FROM sentiment_analysis WHERE timestamp < ? AND id > ? AND id <= ?''',
+                (cutoff, last_id, last_chunk_id))
+            conn.executemany(
+                '''INSERT INTO sentiment_archive_summary (sentiment, count) VALUES (?, ?)
+                   ON CONFLICT (sentiment) DO UPDATE SET count = count + excluded.count''',
+                list(Counter(row[2] for row in rows).items()))
+            conn.executemany(
+                '''INSERT INTO sentiment_archive_summary_hourly (bucket, sentiment, count, confidence_sum)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT (bucket, sentiment) DO UPDATE SET
+                       count = count + excluded.count,
+                       confidence_sum = confidence_sum + excluded.confidence_sum''',
+                [(bucket, sentiment, count, confidence_sum)
+                 for (bucket, sentiment), (count, confidence_sum) in hourly.items()])
+        archived += len(rows)
+        last_id = last_chunk_id
+
+    if vacuum and archived:
+        with database.connection() as conn:
+            conn.execute('''VACUUM''')
+    return archived
+
+
+def _sql_filters(since, until, sentiment, min_confidence):
+    conditions = []
+    params = []
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    if sentiment is not None:
+        conditions.append("sentiment = ?")
+        params.append(sentiment)
+    if min_confidence is not None:
+        conditions.append("confidence >= ?")
+        params.append(min_confidence)
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+
+def _parquet_filter(since, until, sentiment, min_confidence):
+    """Biểu thức lọc pyarrow; điều kiện trên date/sentiment giúp bỏ qua nguyên phân vùng"""
+    pa = _pyarrow()
+    field = pa.dataset.field
+    expression = None
+
+    def add(condition):
+        nonlocal expression
+        expression = condition if expression is None else expression & condition
+
+    if since is not None:
+        add(field('date') >= since[:10])
+        add(field('timestamp') >= since)
+    if until is not None:
+        add(field('date') <= until[:10])
+        add(field('timestamp') < until)
+    if sentiment is not None:
+        add(field('sentiment') == sentiment)
+    if min_confidence is not None:
+        add(field('confidence') >= min_confidence)
+    return expression
+
+
+def iter_history_batches(columns=HISTORY_COLUMNS, since=None, until=None, sentiment=None,
+                         min_confidence=None, archive_dir=ARCHIVE_DIR, batch_size=65536):
+    """
+    Đọc lịch sử từ Parquet đã lưu trữ rồi tới SQLite, trả về từng pyarrow.RecordBatch
+
+    Args:
+        columns: Các cột cần đọc (tập con của HISTORY_COLUMNS)
+        since, until: Khoảng thời gian [since, until) dạng YYYY-MM-DD[ HH:MM:SS]
+        sentiment: Chỉ đọc label này
+        min_confidence: Chỉ đọc các dòng có confidence >= min_confidence
+        archive_dir: Thư mục Parquet (bỏ qua nếu không tồn tại)
+        batch_size: Số dòng tối đa mỗi batch
+
+    Yields:
+        pyarrow.RecordBatch: Cùng schema (các cột columns) cho cả hai nguồn;
+        thứ tự giữa các batch không được đảm bảo
+    """
+    pa = _pyarrow()
+    columns = list(columns)
+    unknown = set(columns) - set(HISTORY_COLUMNS)
+    if unknown:
+        raise ValueError(f"Cột không hợp lệ: {sorted(unknown)}")
+    schema = pa.schema([history_schema().field(name) for name in columns])
+
+    if os.path.isdir(archive_dir):
+        # Schema tường minh: file lưu trữ trước khi có cột normalized_text/tier đọc ra null
+        dataset = pa.dataset.dataset(archive_dir, format="parquet", partitioning=partitioning(),
+                                     schema=history_schema().remove(2).append(pa.field('date', pa.string()))
+                                     .append(pa.field('sentiment', pa.string())))
+        scanner = dataset.scanner(
+            columns=columns, batch_size=batch_size,
+            filter=_parquet_filter(since, until, sentiment, min_confidence))
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield batch
+
+    where, params = _sql_filters(since, until, sentiment, min_confidence)
+    with database.connection() as conn:
+        cursor = conn.execute(f'''SELECT {", ".join(columns)} FROM sentiment_analysis {where}''', params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield pa.RecordBatch.from_arrays(
+                [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)],
+                schema=schema)
+
+
+def read_history(**kwargs):
+    """Như iter_history_batches nhưng gộp thành một pyarrow.Table"""
+    pa = _pyarrow()
+    columns = kwargs.get('columns', HISTORY_COLUMNS)
+    schema = pa.schema([history_schema().field(name) for name in columns])
+    return pa.Table.from_batches(list(iter_history_batches(**kwargs)), schema=schema)
+
+
+def export_history(output_path, **kwargs):
+    """
+    Ghi lịch sử (SQLite + Parquet, có lọc) ra một file Parquet theo từng batch
+
+    Returns:
+        int: Số dòng đã ghi
+    """
+    pa = _pyarrow()
+    columns = kwargs.get('columns', HISTORY_COLUMNS)
+    schema = pa.schema([history_schema().field(name) for name in columns])
+    rows = 0
+    with pa.parquet.ParquetWriter(output_path, schema) as writer:
+        for batch in iter_history_batches(**kwargs):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lưu trữ và xuất lịch sử phân tích dạng Parquet")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = subparsers.add_parser("archive", help="Chuyển các dòng cũ sang Parquet")
+    archive_parser.add_argument("--days", type=int, required=True, help="Giữ lại N ngày gần nhất trong SQLite")
+    archive_parser.add_argument("--chunk-size", type=int, default=50000)
+    archive_parser.add_argument("--vacuum", action="store_true", help="VACUUM database sau khi xóa")
+
+    export_parser = subparsers.add_parser("export", help="Xuất lịch sử (SQLite + Parquet) ra một file Parquet")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--since")
+    export_parser.add_argument("--until")
+    export_parser.add_argument("--sentiment")
+    export_parser.add_argument("--min-confidence", type=float)
+    args = parser.parse_args()
+
+    database.init_database()
+    if args.command == "archive":
+        count = archive_older_than(args.days, args.archive_dir, args.chunk_size, args.vacuum)
+        print(f"Đã chuyển {count} dòng vào {args.archive_dir}")
+    else:
+        count = export_history(args.output, since=args.since, until=args.until, sentiment=args.sentiment,
+                               min_confidence=args.min_confidence, archive_dir=args.archive_dir)
+        print(f"Đã ghi {count} dòng vào {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+"""
+Backend suy luận trên CPU cho model sentiment (PhoBERT) và model restore dấu (XLM-R)
+- torch: PyTorch fp32 (mặc định)
+- torch-int8: PyTorch với dynamic int8 quantization cho các lớp Linear
+- onnx / onnx-int8: ONNX Runtime, load model đã export trong thư mục local
+
+InferenceEngine chạy forward trực tiếp (không qua transformers.pipeline) dưới
+torch.inference_mode, có thể dùng graph TorchScript/torch.compile theo bucket độ dài.
+
+Export và kiểm tra độ khớp:
+    python inference_backends.py export --output onnx_models --quantize
+    python inference_backends.py parity --backend onnx-int8 --onnx-dir onnx_models
+"""
+
+import argparse
+import bisect
+import json
+import os
+import time
+import warnings
+
+from vietnamese_sentiment import (
+    BASE_DIR, LENGTH_BUCKETS, RESTORER_MODEL_PATH, SENTIMENT_MODEL_NAME,
+    VietnameseSentimentAnalyzer, torch, transformers
+)
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+GRAPH_MODES = (None, "trace", "compile")
+DTYPES = ("bfloat16", "float16")
+
+# Thư mục mặc định chứa model ONNX (mỗi model một thư mục con)
+ONNX_DIR = os.path.join(BASE_DIR, "onnx_models")
+SENTIMENT_SUBDIR = "sentiment"
+RESTORER_SUBDIR = "restorer"
+
+TASK_MODEL_CLASSES = {
+    "sequence-classification": "AutoModelForSequenceClassification",
+    "token-classification": "AutoModelForTokenClassification",
+}
+
+ONNX_FILES = {
+    "onnx": "model.onnx",
+    "onnx-int8": "model.int8.onnx",
+}
+
+
+class OnnxModel:
+    """
+    Bọc onnxruntime.InferenceSession với giao diện giống model HuggingFace
+    (gọi model(**inputs), kết quả có .logits / ["logits"])
+    """
+
+    def __init__(self, onnx_path, config, task, num_threads=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("Backend ONNX cần onnxruntime. Chạy: pip install onnxruntime")
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.onnx_path = onnx_path
+        self.session = onnxruntime.InferenceSession(
+            onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.config = config
+        self.task = task
+        self.device = torch.device("cpu")
+
+    def __call__(self, **inputs):
+        feed = {name: inputs[name].cpu().numpy() for name in self.input_names if name in inputs}
+        logits = torch.from_numpy(self.session.run(["logits"], feed)[0])
+        if self.task == "token-classification":
+            return transformers.modeling_outputs.TokenClassifierOutput(logits=logits)
+        return transformers.modeling_outputs.SequenceClassifierOutput(logits=logits)
+
+    def to(self, device):
+        # ONNX Runtime luôn chạy trên CPU
+        return self
+
+    def eval(self):
+        return self
+
+
+def configure_threads(intra_op_threads=None, inter_op_threads=None):
+    """
+    Đặt số thread PyTorch cho cả process (None: giữ mặc định)
+
+    Số thread inter-op chỉ đặt được trước khi PyTorch chạy phép tính song song
+    đầu tiên; gọi muộn hơn thì giữ nguyên giá trị cũ và cảnh báo.
+    """
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads and torch.get_num_interop_threads() != inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            warnings.warn(f"Không đặt được số thread inter-op: {e}")
+
+
+class InferenceEngine:
+    """
+    Chạy forward trực tiếp model dưới torch.inference_mode, trả về logits
+
+    Với graph="trace" (TorchScript) hoặc "compile" (torch.compile), input được
+    pad tới bucket độ dài gần nhất trong length_buckets để mỗi bucket chỉ cần
+    một graph; các graph được tạo và chạy thử ngay khi khởi tạo nên request đầu
+    tiên không phải chờ. Graph dùng chung tham số với model (không copy trọng số).
+    token_type_ids toàn 0 (tokenizer PhoBERT/RoBERTa luôn trả về) được bỏ trước
+    khi chạy graph vì model mặc định dùng đúng giá trị đó. Input dài hơn bucket
+    lớn nhất, hoặc có tensor khác input_ids/attention_mask, chạy eager;
+    graph_calls/eager_calls đếm số lần chạy mỗi đường.
+    """
+
+    GRAPH_INPUTS = ("input_ids", "attention_mask")
+
+    def __init__(self, model, graph=None, length_buckets=LENGTH_BUCKETS, device=None):
+        """
+        Args:
+            model: Model HuggingFace (hoặc OnnxModel, chỉ chạy eager)
+            graph: None (eager), "trace" hoặc "compile"
+            length_buckets: Các độ dài (token) được tạo graph riêng
+            device: Device của input (mặc định CPU)
+        """
+        if graph not in GRAPH_MODES:
+            raise ValueError(f"graph phải là một trong {GRAPH_MODES}")
+        if graph is not None and isinstance(model, OnnxModel):
+            raise ValueError("graph chỉ dùng được với backend torch")
+
+        self.model = model
+        self.graph = graph
+        self.device = device or torch.device("cpu")
+        pad_token_id = model.config.pad_token_id
+        self.pad_token_id = 0 if pad_token_id is None else pad_token_id
+
+        max_length = getattr(model.config, "max_position_embeddings", None)
+        self.length_buckets = sorted(
+            b for b in length_buckets if max_length is None or b <= max_length) if graph else []
+        self._graphs = {}
+        self._compiled = None
+        self.graph_calls = 0
+        self.eager_calls = 0
+        self.warmup_seconds = self._build_graphs() if graph else {}
+
+    def __call__(self, **inputs):
+        """
+        Chạy model
+
+        Returns:
+            torch.Tensor: logits float32 trên CPU, cùng độ dài token với input
+        """
+        with torch.inference_mode():
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            length = inputs["input_ids"].shape[1]
+            graph_inputs = self._graph_inputs(inputs)
+            bucket = self._bucket(length) if graph_inputs is not None else None
+            if bucket is None:
+                self.eager_calls += 1
+                logits = self.model(**inputs)["logits"]
+            else:
+                self.graph_calls += 1
+                logits = self._run_graph(bucket, self._pad(graph_inputs, bucket))
+                if logits.dim() == 3:
+                    logits = logits[:, :length]
+            return logits.float().cpu()
+
+    def _graph_inputs(self, inputs):
+        """Input cho graph, bỏ token_type_ids toàn 0 (None: phải chạy eager)"""
+        token_type_ids = inputs.get("token_type_ids")
+        if token_type_ids is not None and not token_type_ids.any():
+            inputs = {k: v for k, v in inputs.items() if k != "token_type_ids"}
+        if set(inputs) != set(self.GRAPH_INPUTS):
+            return None
+        return inputs
+
+    def _bucket(self, length):
+        """Bucket nhỏ nhất chứa được input (None: chạy eager)"""
+        if not self.length_buckets or length > self.length_buckets[-1]:
+            return None
+        return self.length_buckets[bisect.bisect_left(self.length_buckets, length)]
+
+    def _pad(self, inputs, bucket):
+        extra = bucket - inputs["input_ids"].shape[1]
+        if extra == 0:
+            return inputs
+        pad = torch.nn.functional.pad
+        return {
+            "input_ids": pad(inputs["input_ids"], (0, extra), value=self.pad_token_id),
+            "attention_mask": pad(inputs["attention_mask"], (0, extra), value=0),
+        }
+
+    def _run_graph(self, bucket, inputs):
+        if self.graph == "trace":
+            return self._graphs[bucket](inputs["input_ids"], inputs["attention_mask"])["logits"]
+
+        # Chiều độ dài cố định theo bucket, chiều batch dùng chung một graph (batch 1 có graph riêng)
+        for tensor in inputs.values():
+            torch._dynamo.mark_static(tensor, 1)
+            if tensor.shape[0] > 1:
+                torch._dynamo.mark_dynamic(tensor, 0)
+        return self._compiled(**inputs)["logits"]
+
+    def _build_graphs(self):
+        """
+        Tạo graph cho từng bucket và chạy thử
+
+        Returns:
+            dict: Thời gian (giây) tạo + chạy thử của từng bucket
+        """
+        if self.graph == "compile":
+            config = torch._dynamo.config
+            limit = "recompile_limit" if hasattr(config, "recompile_limit") else "cache_size_limit"
+            setattr(config, limit, max(getattr(config, limit), 2 * len(self.length_buckets)))
+            self._compiled = torch.compile(self.model)
+
+        timings = {}
+        for bucket in self.length_buckets:
+            start = time.perf_counter()
+            for batch_size in (1, 2):
+                inputs = {
+                    "input_ids": torch.zeros((batch_size, bucket), dtype=torch.long, device=self.device),
+                    "attention_mask": torch.ones((batch_size, bucket), dtype=torch.long, device=self.device),
+                }
+                # Trace với batch 1, chạy thử thêm batch 2 để chắc graph không cố định chiều batch
+                if self.graph == "trace" and batch_size == 1:
+                    with torch.no_grad():
+                        self._graphs[bucket] = torch.jit.trace(
+                            self.model, (inputs["input_ids"], inputs["attention_mask"]),
+                            strict=False, check_trace=False)
+                with torch.inference_mode():
+                    self._run_graph(bucket, inputs)
+            timings[bucket] = time.perf_counter() - start
+        return timings
+
+
+def load_model(model_path, task, backend="torch", onnx_dir=None, mmap_weights=False, num_threads=None,
+               dtype=None):
+    """
+    Load model theo backend
+
+    Args:
+        model_path: Tên model HuggingFace hoặc thư mục local
+        task: "sequence-classification" hoặc "token-classification"
+        backend: Một trong BACKENDS
+        onnx_dir: Thư mục chứa model.onnx/model.int8.onnx (backend onnx)
+        mmap_weights: Memory-map trọng số từ file safetensors thay vì copy vào
+            bộ nhớ của process (chỉ backend "torch", xem shared_weights.py)
+        num_threads: Số thread intra-op của ONNX Runtime (None: mặc định)
+        dtype: None (float32) hoặc một trong DTYPES, trọng số nửa độ chính xác
+            (chỉ backend "torch", không dùng cùng mmap_weights)
+
+    Returns:
+        Model có thể gọi model(**inputs)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend phải là một trong {BACKENDS}")
+
+    if dtype is not None:
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype phải là một trong {DTYPES}")
+        if backend != "torch" or mmap_weights:
+            raise ValueError("dtype chỉ dùng được với backend 'torch' và không dùng mmap_weights")
+
+    if mmap_weights:
+        if backend != "torch":
+            raise ValueError("mmap_weights chỉ dùng được với backend 'torch'")
+        from shared_weights import load_mmap_model
+        return load_mmap_model(model_path, task)
+
+    if backend in ("torch", "torch-int8"):
+        model_class = getattr(transformers, TASK_MODEL_CLASSES[task])
+        if dtype is not None:
+            model = model_class.from_pretrained(model_path, dtype=getattr(torch, dtype))
+        else:
+            model = model_class.from_pretrained(model_path)
+        model.eval()
+        if backend == "torch-int8":
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    onnx_dir = onnx_dir or model_path
+    onnx_path = os.path.join(onnx_dir, ONNX_FILES[backend])
+    if not os.path.exists(onnx_path):
+        raise FileNotFoundError(
+            f"Không tìm thấy {onnx_path}. Chạy: python inference_backends.py export "
+            f"--output <thư mục>{' --quantize' if backend == 'onnx-int8' else ''}")
+    config = transformers.AutoConfig.from_pretrained(onnx_dir)
+    return OnnxModel(onnx_path, config, task, num_threads)
+
+
+def export_onnx(model_path, task, output_dir, quantize=False, opset=17):
+    """
+    Export model HuggingFace sang ONNX (kèm tokenizer và config) vào output_dir
+
+    Args:
+        model_path: Tên model HuggingFace hoặc thư mục local
+        task: "sequence-classification" hoặc "token-classification"
+        output_dir: Thư mục lưu model.onnx
+        quantize: Tạo thêm model.int8.onnx (dynamic int8 quantization)
+        opset: ONNX opset
+
+    Returns:
+        list: Các file .onnx đã tạo
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model = load_model(model_path, task, backend="torch")
+    tokenizer = transformers.AutoTokenizer.from_pretrained(model_path)
+
+    dummy = tokenizer(["xin chào", "sản phẩm rất tốt"], padding=True, return_tensors="pt")
+    onnx_path = os.path.join(output_dir, ONNX_FILES["onnx"])
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            onnx_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"} if task == "sequence-classification" else {0: "batch", 1: "sequence"},
+            },
+            opset_version=opset,
+            dynamo=False,
+        )
+    tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+    created = [onnx_path]
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        int8_path = os.path.join(output_dir, ONNX_FILES["onnx-int8"])
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+        created.append(int8_path)
+
+    return created
+
+
+def current_rss_mb():
+    """RSS hiện tại của process (MB)"""
+    import psutil
+    return psutil.Process().memory_info().rss / 1024 / 1024
+
+
+def run_backend(backend, onnx_dir, texts, batch_size):
+    """Load analyzer theo backend, đo bộ nhớ, thời gian và trả về kết quả"""
+    rss_before = current_rss_mb()
+    analyzer = VietnameseSentimentAnalyzer(backend=backend, onnx_dir=onnx_dir)
+    analyzer.warmup()
+    rss_after = current_rss_mb()
+
+    start = time.perf_counter()
+    single = [analyzer.analyze_sentiment(text) for text in texts]
+    single_seconds = time.perf_counter() - start
+
+    # Xóa cache theo câu để lần đo batch không dùng lại kết quả của lần đo trên
+    for component in (analyzer.restored, analyzer.standardizer):
+        if component.sentence_cache is not None:
+            component.sentence_cache.clear()
+
+    start = time.perf_counter()
+    analyzer.analyze_many(texts, batch_size=batch_size)
+    batch_seconds = time.perf_counter() - start
+
+    return single, {
+        "model_memory_mb": rss_after - rss_before,
+        "latency_ms": single_seconds / len(texts) * 1000,
+        "batch_throughput": len(texts) / batch_seconds,
+    }
+
+
+def parity_report(backend, onnx_dir, texts, batch_size=32):
+    """
+    So sánh backend với PyTorch fp32 trên cùng corpus
+
+    Returns:
+        dict: Tỉ lệ trùng label, sai lệch score, latency/bộ nhớ của hai backend
+    """
+    reference, reference_stats = run_backend("torch", onnx_dir, texts, batch_size)
+    candidate, candidate_stats = run_backend(backend, onnx_dir, texts, batch_size)
+
+    deltas = [
+        abs(ref['all_scores'][label] - cand['all_scores'].get(label, 0.0))
+        for ref, cand in zip(reference, candidate)
+        for label in ref['all_scores']
+    ]
+    return {
+        "backend": backend,
+        "num_texts": len(texts),
+        "label_agreement": sum(
+            ref['sentiment'] == cand['sentiment'] for ref, cand in zip(reference, candidate)
+        ) / len(texts),
+        "restored_text_agreement": sum(
+            ref['text'] == cand['text'] for ref, cand in zip(reference, candidate)
+        ) / len(texts),
+        "mean_score_delta": sum(deltas) / len(deltas),
+        "max_score_delta": max(deltas),
+        "torch": reference_stats,
+        backend: candidate_stats,
+    }
+
+
+DEFAULT_PARITY_TEXTS = [
+    "san pham tot",
+    "te qua",
+    "hom nay toi rat vui va hanh phuc",
+    "toi cam thay rat buon va that vong",
+    "Sản phẩm này không tốt, tôi thất vọng.",
+    "Hôm nay trời mưa. Tôi đi làm như bình thường.",
+    "giao hang nhanh, dong goi can than, shop tu van nhiet tinh :)",
+    "chat luong qua te, dung duoc hai ngay la hong 😡",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export ONNX và kiểm tra độ khớp các backend")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export cả hai model sang ONNX")
+    export_parser.add_argument("--output", default=ONNX_DIR)
+    export_parser.add_argument("--model-name", default=SENTIMENT_MODEL_NAME)
+    export_parser.add_argument("--restorer-path", default=RESTORER_MODEL_PATH)
+    export_parser.add_argument("--quantize", action="store_true", help="Tạo thêm bản int8")
+
+    parity_parser = subparsers.add_parser("parity", help="So sánh backend với PyTorch fp32")
+    parity_parser.add_argument("--backend", choices=BACKENDS[1:], default="onnx-int8")
+    parity_parser.add_argument("--onnx-dir", default=ONNX_DIR)
+    parity_parser.add_argument("--corpus", help="File text, mỗi dòng một văn bản")
+    parity_parser.add_argument("--batch-size", type=int, default=32)
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for model_path, task, subdir in (
+            (args.model_name, "sequence-classification", SENTIMENT_SUBDIR),
+            (args.restorer_path, "token-classification", RESTORER_SUBDIR),
+        ):
+            for path in export_onnx(model_path, task, os.path.join(args.output, subdir), args.quantize):
+                print(f"Đã tạo {path} ({os.path.getsize(path) / 1024 / 1024:.0f} MB)")
+    else:
+        texts = DEFAULT_PARITY_TEXTS
+        if args.corpus:
+            with open(args.corpus, 'r', encoding='utf-8') as f:
+                texts = [line.strip() for line in f if line.strip()]
+        print(json.dumps(parity_report(args.backend, args.onnx_dir, texts, args.batch_size),
+                         ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Đo thời gian từng bước của pipeline và xuất metrics dạng Prometheus text
+- METRICS: bộ đếm/histogram dùng chung trong process, tắt mặc định
+  (bật bằng enable() hoặc biến môi trường SENTIMENT_METRICS=1)
+- SamplingProfiler: lấy mẫu stack của các thread theo chu kỳ, bật/tắt lúc runtime
+"""
+
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+# Bucket mặc định (giây) cho thời gian mỗi bước
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+WORD_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384)
+
+
+class Histogram:
+    """Histogram tích lũy theo kiểu Prometheus (bucket le, sum, count)"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class StageMetrics:
+    """Thời gian, số từ đầu vào và kích thước batch của từng bước (restore, standardize, ...)"""
+
+    def __init__(self):
+        self.enabled = os.environ.get("SENTIMENT_METRICS", "0") == "1"
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._batch_size = {}
+        self._words = {}
+
+    def observe(self, stage, seconds, batch_size=None, words=None):
+        """Ghi nhận một lần chạy bước stage (words: số từ tách theo khoảng trắng, không phải sub-token)"""
+        with self._lock:
+            if stage not in self._latency:
+                self._latency[stage] = Histogram(LATENCY_BUCKETS)
+                self._batch_size[stage] = Histogram(BATCH_SIZE_BUCKETS)
+                self._words[stage] = Histogram(WORD_BUCKETS)
+            self._latency[stage].observe(seconds)
+            if batch_size is not None:
+                self._batch_size[stage].observe(batch_size)
+            if words is not None:
+                self._words[stage].observe(words)
+
+    def observe_timings(self, timings):
+        """Ghi nhận dict timings của một kết quả/batch (xem VietnameseSentimentAnalyzer)"""
+        batch_size = timings.get('batch_size')
+        for stage, seconds in timings['seconds'].items():
+            self.observe(stage, seconds, batch_size, timings.get('words', {}).get(stage))
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._batch_size.clear()
+            self._words.clear()
+
+    def render_prometheus(self):
+        """Xuất toàn bộ metrics theo Prometheus text exposition format"""
+        families = (
+            ("sentiment_stage_seconds", "Thời gian chạy mỗi bước (giây)", self._latency),
+            ("sentiment_stage_batch_size", "Số text mỗi lần chạy bước", self._batch_size),
+            ("sentiment_stage_words", "Số từ đầu vào mỗi lần chạy bước", self._words),
+        )
+        lines = []
+        with self._lock:
+            for name, help_text, histograms in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for stage, histogram in sorted(histograms.items()):
+                    if histogram.count:
+                        lines.extend(histogram.render(name, f'stage="{stage}"'))
+        return "\n".join(lines) + "\n"
+
+
+METRICS = StageMetrics()
+
+
+def enable():
+    """Bật đo thời gian (có hiệu lực ngay, không cần khởi động lại)"""
+    METRICS.enabled = True
+
+
+def disable():
+    METRICS.enabled = False
+
+
+class SamplingProfiler:
+    """
+    Profiler lấy mẫu: mỗi interval giây chụp stack của mọi thread (trừ chính nó)
+    và đếm số lần xuất hiện của từng stack. Kết quả ở dạng "collapsed stack"
+    (frame;frame;frame count) dùng được với flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        self.samples.clear()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = traceback.extract_stack(frame, limit=self.max_depth)
+                key = ";".join(f"{os.path.basename(f.filename)}:{f.name}" for f in stack)
+                self.samples[key] += 1
+
+    def collapsed(self, top=None):
+        """Các stack được lấy mẫu nhiều nhất, mỗi dòng "stack count" """
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common(top))
+
+
+PROFILER = SamplingProfiler()
+
+
+class StageTimer:
+    """Đo thời gian các bước trong một lần phân tích, tạo dict timings cho kết quả"""
+
+    def __init__(self, batch_size=1):
+        self.timings = {'seconds': {}, 'words': {}, 'batch_size': batch_size}
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def mark(self, stage, words=None):
+        """Kết thúc bước stage (tính từ lần mark trước), words: số từ đầu vào của bước"""
+        now = time.perf_counter()
+        self.timings['seconds'][stage] = self.timings['seconds'].get(stage, 0.0) + now - self._last
+        if words is not None:
+            self.timings['words'][stage] = words
+        self._last = now
+
+    def restart(self):
+        """Bỏ qua khoảng thời gian chờ (vd. chờ trong hàng đợi) trước bước tiếp theo"""
+        self._last = time.perf_counter()
+
+    def finish(self):
+        """Tổng thời gian, ghi vào METRICS và trả về dict timings"""
+        self.timings['seconds']['total'] = time.perf_counter() - self._start
+        METRICS.observe_timings(self.timings)
+        return self.timings
@@ -0,0 +1,276 @@
+"""
+Registry model dùng chung cho cả process: nhiều model sentiment, một restorer, giới hạn RAM
+
+- Mỗi model sentiment (PhoBERT sentiment, phobert-base, ViBERT, ...) được
+  load khi có request đầu tiên chọn nó (get(model_name)).
+- Tất cả dùng chung một VietnameseDiacriticRestorer và một standardizer.
+- Khi tổng bộ nhớ trọng số vượt memory_budget_mb, model ít dùng gần đây nhất
+  bị gỡ (LRU); model không được dùng quá idle_seconds cũng bị gỡ.
+- dtype="bfloat16"/"float16" lưu trọng số nửa độ chính xác (giảm một nửa bộ nhớ).
+- Mỗi lần load/gỡ được ghi thành event (get_stats(), on_event).
+
+Ví dụ:
+    registry = ModelRegistry(["wonrax/phobert-base-vietnamese-sentiment", "my-org/vibert-sentiment"],
+                             memory_budget_mb=1500, dtype="bfloat16")
+    registry.analyze_many(["san pham tot"], model_name="my-org/vibert-sentiment")
+"""
+
+import gc
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+
+from vietnamese_sentiment import SENTIMENT_MODEL_NAME, VietnameseSentimentAnalyzer
+
+MB = 1024 * 1024
+
+
+def model_memory_mb(model):
+    """
+    Bộ nhớ trọng số của model (MB), mỗi vùng nhớ chỉ tính một lần (weight tying)
+
+    Model ONNX được tính theo kích thước file.
+    """
+    onnx_path = getattr(model, "onnx_path", None)
+    if onnx_path is not None:
+        return os.path.getsize(onnx_path) / MB
+
+    seen = set()
+    total = 0
+
+    def add(value):
+        nonlocal total
+        if isinstance(value, (tuple, list)):
+            for item in value:
+                add(item)
+        elif hasattr(value, "untyped_storage"):
+            storage = value.untyped_storage()
+            if storage.data_ptr() not in seen:
+                seen.add(storage.data_ptr())
+                total += storage.nbytes()
+
+    # state_dict có cả packed params của model int8
+    for value in model.state_dict().values():
+        add(value)
+    return total / MB
+
+
+class ModelRegistry:
+    """Quản lý các VietnameseSentimentAnalyzer theo model, có giới hạn bộ nhớ"""
+
+    def __init__(self, model_names=(SENTIMENT_MODEL_NAME,), memory_budget_mb=None, idle_seconds=None,
+                 dtype=None, cache_factory=None, on_event=None, max_events=200, **analyzer_kwargs):
+        """
+        Args:
+            model_names: Các model sentiment được phép chọn (phần tử đầu là mặc định)
+            memory_budget_mb: Giới hạn tổng bộ nhớ trọng số (restorer + các model
+                sentiment đang load); None: không giới hạn
+            idle_seconds: Gỡ model không được dùng quá số giây này (None: không gỡ)
+            dtype: None (float32), "bfloat16" hoặc "float16" cho cả restorer và model sentiment
+            cache_factory: Hàm tạo SentimentResultCache cho mỗi model (None: không cache)
+            on_event: Hàm được gọi với dict event mỗi lần load/gỡ model
+            max_events: Số event gần nhất được giữ lại
+            **analyzer_kwargs: Tham số còn lại của VietnameseSentimentAnalyzer
+                (backend, graph, restorer_path, cascade_model, ...)
+        """
+        if not model_names:
+            raise ValueError("Cần ít nhất một model")
+        self.model_names = list(model_names)
+        self.default_model = self.model_names[0]
+        self.memory_budget_mb = memory_budget_mb
+        self.idle_seconds = idle_seconds
+        self.dtype = dtype
+        self.cache_factory = cache_factory
+        self.on_event = on_event
+        self.analyzer_kwargs = analyzer_kwargs
+
+        self._lock = threading.RLock()
+        # model_name -> {'analyzer', 'memory_mb', 'loaded_at', 'last_used', 'requests'}, cũ nhất trước
+        self._models = OrderedDict()
+        self._known_sizes = {}
+        self._restorer = None
+        self._standardizer = None
+        self.restorer_memory_mb = 0.0
+        self.events = deque(maxlen=max_events)
+        self.counters = Counter()
+        self._evicted_cascade = Counter()
+        self._collect_pending = False
+
+    def get(self, model_name=None):
+        """
+        Analyzer của model (load nếu chưa có, có thể gỡ model khác để vừa giới hạn bộ nhớ)
+
+        Raises:
+            KeyError: model_name không nằm trong model_names
+        """
+        model_name = model_name or self.default_model
+        if model_name not in self.model_names:
+            raise KeyError(f"Model không được hỗ trợ: {model_name}")
+
+        with self._lock:
+            self._evict_idle(keep=model_name)
+            entry = self._models.get(model_name)
+            if entry is None:
+                entry = self._load(model_name)
+            self._models.move_to_end(model_name)
+            entry['last_used'] = time.time()
+            entry['requests'] += 1
+        self._collect()
+        return entry['analyzer']
+
+    def analyze_sentiment(self, text, model_name=None):
+        return self.get(model_name).analyze_sentiment(text)
+
+    def analyze_many(self, texts, batch_size=32, model_name=None):
+        return self.get(model_name).analyze_many(texts, batch_size=batch_size)
+
+    def warmup(self, model_name=None):
+        """Load restorer, standardizer và model (mặc định) rồi chạy thử"""
+        return self.get(model_name).warmup()
+
+    def evict(self, model_name, reason="manual"):
+        """Gỡ model khỏi registry (bộ nhớ được giải phóng khi không còn request nào dùng)"""
+        with self._lock:
+            evicted = self._evict(model_name, reason)
+        self._collect()
+        return evicted
+
+    def evict_idle(self, keep=None):
+        """Gỡ các model (trừ keep) không được dùng quá idle_seconds"""
+        with self._lock:
+            self._evict_idle(keep)
+        self._collect()
+
+    def _evict(self, model_name, reason):
+        """Bỏ model khỏi registry (đã giữ self._lock; gc chạy sau khi nhả lock, xem _collect)"""
+        entry = self._models.pop(model_name, None)
+        if entry is None:
+            return False
+        self._evicted_cascade.update(entry['analyzer'].get_cascade_stats())
+        self._emit("evict", model_name, memory_mb=entry['memory_mb'], reason=reason,
+                   idle_seconds=time.time() - entry['last_used'])
+        self._collect_pending = True
+        return True
+
+    def _evict_idle(self, keep=None):
+        """Như evict_idle (đã giữ self._lock)"""
+        if self.idle_seconds is None:
+            return
+        now = time.time()
+        for name, entry in list(self._models.items()):
+            if name != keep and now - entry['last_used'] > self.idle_seconds:
+                self._evict(name, reason="idle")
+
+    def _collect(self):
+        """
+        Chạy gc.collect() nếu vừa gỡ model; gọi sau khi đã nhả self._lock để các
+        get() đồng thời không phải chờ hết một lần thu gom
+        """
+        if self._collect_pending:
+            self._collect_pending = False
+            gc.collect()
+
+    def loaded_models(self):
+        """Tên các model đang load, dùng gần đây nhất trước"""
+        with self._lock:
+            return list(reversed(self._models))
+
+    def total_memory_mb(self):
+        with self._lock:
+            return self.restorer_memory_mb + sum(e['memory_mb'] for e in self._models.values())
+
+    def get_cascade_stats(self):
+        """Số text mỗi tier của cascade, cộng dồn qua mọi model (kể cả đã gỡ)"""
+        with self._lock:
+            stats = Counter(self._evicted_cascade)
+            for entry in self._models.values():
+                stats.update(entry['analyzer'].get_cascade_stats())
+        return dict(stats)
+
+    def get_stats(self):
+        """Model đang load, bộ nhớ, số lần load/gỡ và các event gần nhất"""
+        from inference_backends import current_rss_mb
+
+        with self._lock:
+            return {
+                "models": [
+                    {
+                        "model_name": name,
+                        "memory_mb": entry['memory_mb'],
+                        "loaded_at": entry['loaded_at'],
+                        "idle_seconds": time.time() - entry['last_used'],
+                        "requests": entry['requests'],
+                    }
+                    for name, entry in reversed(self._models.items())
+                ],
+                "available_models": list(self.model_names),
+                "restorer_memory_mb": self.restorer_memory_mb,
+                "total_memory_mb": self.total_memory_mb(),
+                "memory_budget_mb": self.memory_budget_mb,
+                "process_rss_mb": current_rss_mb(),
+                "dtype": self.dtype,
+                "counters": dict(self.counters),
+                "events": list(self.events),
+            }
+
+    def _load(self, model_name):
+        """Load model mới (đã giữ self._lock)"""
+        # Gỡ trước nếu đã biết kích thước model, để đỉnh bộ nhớ không vượt giới hạn
+        self._enforce_budget(extra_mb=self._known_sizes.get(model_name, 0.0))
+
+        start = time.perf_counter()
+        analyzer = VietnameseSentimentAnalyzer(
+            model_name=model_name,
+            restorer=self._restorer,
+            standardizer=self._standardizer,
+            dtype=self.dtype,
+            cache=self.cache_factory() if self.cache_factory else None,
+            **self.analyzer_kwargs
+        )
+        analyzer.model  # load tokenizer + model sentiment
+        if self._restorer is None:
+            self._restorer = analyzer.restored
+            self._standardizer = analyzer.standardizer
+            self.restorer_memory_mb = model_memory_mb(self._restorer.model)
+
+        memory_mb = model_memory_mb(analyzer.model)
+        self._known_sizes[model_name] = memory_mb
+        entry = {
+            'analyzer': analyzer,
+            'memory_mb': memory_mb,
+            'loaded_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'last_used': time.time(),
+            'requests': 0,
+        }
+        self._models[model_name] = entry
+        self._emit("load", model_name, memory_mb=memory_mb, seconds=time.perf_counter() - start)
+        self._enforce_budget(keep=model_name)
+        return entry
+
+    def _enforce_budget(self, extra_mb=0.0, keep=None):
+        """Gỡ model ít dùng gần đây nhất cho tới khi vừa giới hạn (không gỡ keep)"""
+        if self.memory_budget_mb is None:
+            return
+        while self.total_memory_mb() + extra_mb > self.memory_budget_mb:
+            victims = [name for name in self._models if name != keep]
+            if not victims:
+                if keep is not None:
+                    # Riêng restorer + model này đã vượt giới hạn: vẫn giữ để phục vụ request
+                    self._emit("over_budget", keep, memory_mb=self.total_memory_mb())
+                return
+            self._evict(victims[0], reason="lru")
+
+    def _emit(self, event, model_name, **details):
+        record = {
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "event": event,
+            "model_name": model_name,
+            **details,
+            "total_memory_mb": self.total_memory_mb(),
+        }
+        self.counters[event] += 1
+        self.events.append(record)
+        if self.on_event is not None:
+            self.on_event(record)
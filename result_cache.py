@@ -0,0 +1,233 @@
+"""
+Cache kết quả phân tích sentiment hai tầng
+- Tầng 1: LRU trong bộ nhớ của process
+- Tầng 2: SQLite lưu cạnh sentiment_analysis.db, dùng chung giữa các session/process
+"""
+
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from database import DB_PATH
+
+# File cache nằm cùng thư mục với database lịch sử
+CACHE_DB_PATH = os.path.join(os.path.dirname(DB_PATH), 'sentiment_cache.db')
+
+
+def normalize_cache_text(text):
+    """Chuẩn hóa text trước khi băm (unicode NFC, gộp khoảng trắng)"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class SentimentResultCache:
+    """Cache kết quả analyze_sentiment theo nội dung text và phiên bản model"""
+
+    def __init__(self, db_path=CACHE_DB_PATH, max_memory_entries=10000,
+                 max_disk_entries=1000000, ttl_seconds=30 * 24 * 3600):
+        """
+        Args:
+            db_path: Đường dẫn file SQLite của tầng persistent (None: chỉ dùng bộ nhớ)
+            max_memory_entries: Số kết quả tối đa trong LRU bộ nhớ
+            max_disk_entries: Số kết quả tối đa trong SQLite
+            ttl_seconds: Thời gian sống của một kết quả (None: không hết hạn)
+        """
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._inserts_since_trim = 0
+        # accessed_at của các lần đọc từ đĩa, ghi gộp thay vì UPDATE + commit mỗi lần đọc
+        self._pending_access = {}
+        self.max_pending_access = 1000
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+            "invalidated": 0,
+        }
+
+        self._conn = None
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT,
+                    result TEXT,
+                    created_at REAL,
+                    accessed_at REAL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_result_cache_accessed
+                ON result_cache (accessed_at)
+            ''')
+            self._conn.commit()
+
+    def set_fingerprint(self, fingerprint, invalidate_others=False):
+        """
+        Đặt phiên bản model hiện tại (tên model, revision, cấu hình)
+
+        Kết quả của fingerprint khác vẫn được giữ (file cache có thể dùng chung
+        giữa nhiều process/cấu hình), chúng bị loại dần theo TTL và max_disk_entries.
+
+        Args:
+            fingerprint: Chuỗi định danh model, là một phần của key cache
+            invalidate_others: Xóa ngay các kết quả của fingerprint khác
+        """
+        with self._lock:
+            if fingerprint == self._fingerprint:
+                return
+            self._fingerprint = fingerprint
+            self._memory.clear()
+            if self._conn is not None and invalidate_others:
+                cur = self._conn.execute(
+                    'DELETE FROM result_cache WHERE fingerprint != ?', (fingerprint,))
+                self.stats["invalidated"] += cur.rowcount
+                self._conn.commit()
+
+    def make_key(self, text, fingerprint=None):
+        """Key = sha256(fingerprint + text đã chuẩn hóa)"""
+        fingerprint = self._fingerprint if fingerprint is None else fingerprint
+        payload = f"{fingerprint}\0{normalize_cache_text(text)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, text):
+        """
+        Lấy kết quả đã cache
+
+        Returns:
+            dict hoặc None: Bản sao kết quả (không có 'original_text') nếu có trong cache
+        """
+        key = self.make_key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, result = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return copy.deepcopy(result)
+                del self._memory[key]
+                self.stats["expired"] += 1
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    'SELECT result, created_at FROM result_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    result_json, created_at = row
+                    if not self._expired(created_at, now):
+                        self._pending_access[key] = now
+                        if len(self._pending_access) >= self.max_pending_access:
+                            self._flush_access()
+                        result = json.loads(result_json)
+                        self._remember(key, created_at, result)
+                        self.stats["disk_hits"] += 1
+                        return copy.deepcopy(result)
+                    self._conn.execute('DELETE FROM result_cache WHERE key = ?', (key,))
+                    self._conn.commit()
+                    self.stats["expired"] += 1
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, text, result):
+        """Lưu kết quả vào cả hai tầng cache"""
+        key = self.make_key(text)
+        result = copy.deepcopy({k: v for k, v in result.items() if k not in ('original_text', 'timings')})
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, result)
+            if self._conn is not None:
+                self._conn.execute(
+                    '''INSERT OR REPLACE INTO result_cache
+                       (key, fingerprint, result, created_at, accessed_at)
+                       VALUES (?, ?, ?, ?, ?)''',
+                    (key, self._fingerprint, json.dumps(result, ensure_ascii=False), now, now))
+                self._conn.commit()
+                self._inserts_since_trim += 1
+                if self._inserts_since_trim >= 1000:
+                    self._trim_disk(now)
+
+    def get_stats(self):
+        """Thống kê hit/miss/eviction của cache"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            if self._conn is not None:
+                stats["disk_entries"] = self._conn.execute(
+                    'SELECT COUNT(*) FROM result_cache').fetchone()[0]
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM result_cache')
+                self._conn.commit()
+
+    def close(self):
+        """Đóng connection SQLite"""
+        with self._lock:
+            if self._conn is not None:
+                self._flush_access()
+                self._conn.close()
+                self._conn = None
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _remember(self, key, created_at, result):
+        """Thêm vào LRU bộ nhớ, loại bỏ phần tử ít dùng nhất khi đầy"""
+        self._memory[key] = (created_at, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
+
+    def _flush_access(self):
+        """Ghi accessed_at của các lần đọc từ đĩa đang chờ (đã giữ self._lock)"""
+        if not self._pending_access:
+            return
+        self._conn.executemany('UPDATE result_cache SET accessed_at = ? WHERE key = ?',
+                               [(accessed_at, key) for key, accessed_at in self._pending_access.items()])
+        self._conn.commit()
+        self._pending_access.clear()
+
+    def _trim_disk(self, now):
+        """Xóa kết quả hết hạn và kết quả ít dùng nhất khi vượt max_disk_entries"""
+        self._inserts_since_trim = 0
+        self._flush_access()
+        if self.ttl_seconds is not None:
+            cur = self._conn.execute(
+                'DELETE FROM result_cache WHERE created_at < ?', (now - self.ttl_seconds,))
+            self.stats["expired"] += cur.rowcount
+
+        count = self._conn.execute('SELECT COUNT(*) FROM result_cache').fetchone()[0]
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            cur = self._conn.execute('''
+                DELETE FROM result_cache WHERE key IN (
+                    SELECT key FROM result_cache ORDER BY accessed_at LIMIT ?
+                )
+            ''', (overflow,))
+            self.stats["disk_evictions"] += cur.rowcount
+        self._conn.commit()
@@ -0,0 +1,420 @@
+"""
+HTTP service phân tích sentiment chạy local, gom request thành micro-batch
+
+Endpoints:
+    POST /analyze        {"text": "...", "model": "..."}   -> kết quả như analyze_sentiment
+    POST /analyze_batch  {"texts": ["...", "..."], "model": "..."}  -> {"results": [...]}
+                         ("model" không bắt buộc, chọn một trong các model của --models)
+    GET  /models         model đang load, bộ nhớ, các event load/gỡ model
+    GET  /metrics        latency p50/p95/p99, kích thước batch, độ dài hàng đợi
+    GET  /metrics/prometheus  như /metrics và thời gian từng bước, Prometheus text format
+    GET  /health
+    POST /debug/instrumentation  {"enabled": true}   bật/tắt đo thời gian từng bước
+    GET  /debug/profiler         stack lấy mẫu dạng collapsed (flamegraph)
+    POST /debug/profiler         {"action": "start" | "stop" | "reset"}
+
+Các request đồng thời được đưa vào một hàng đợi asyncio; worker lấy tối đa
+max_batch_size text hoặc chờ tối đa max_wait_ms rồi chạy analyze_many trên
+một thread riêng (mỗi model một lần gọi). Khi hàng đợi đầy, service trả về
+503 (backpressure); request có nhiều text hơn cả hàng đợi (--max-queue-size)
+bị từ chối ngay với 413 vì thử lại cũng không bao giờ thành công.
+
+Các model được quản lý bởi ModelRegistry (model_registry.py): dùng chung
+restorer, gỡ model ít dùng khi vượt --memory-budget-mb.
+
+Chạy (mặc định offline, chỉ dùng model đã có trong cache HuggingFace):
+    python service.py --port 8000 --max-batch-size 32 --max-wait-ms 10
+    python service.py --models vinai/phobert-base FPTAI/vibert-base-cased --memory-budget-mb 2000 --dtype bfloat16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.ioloop
+import tornado.web
+
+import instrumentation
+
+
+class QueueFullError(Exception):
+    """Hàng đợi micro-batch đã đầy"""
+
+
+class BatchTooLargeError(Exception):
+    """Request có nhiều text hơn sức chứa của hàng đợi"""
+
+
+class LatencyRecorder:
+    """Lưu latency của các request gần nhất để tính percentile"""
+
+    def __init__(self, window=10000):
+        self.samples = deque(maxlen=window)
+        self.total = 0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.total += 1
+
+    def percentiles(self, points=(50, 95, 99)):
+        """Percentile (ms) theo phương pháp nearest-rank"""
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {f"p{p}": None for p in points}
+        return {
+            f"p{p}": ordered[min(len(ordered) - 1, max(0, -(-p * len(ordered) // 100) - 1))] * 1000
+            for p in points
+        }
+
+
+class MicroBatcher:
+    """Gom các text từ nhiều request thành batch cho các model trong ModelRegistry"""
+
+    def __init__(self, registry, max_batch_size=32, max_wait_ms=10, max_queue_size=1024):
+        self.registry = registry
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        # Một thread duy nhất chạy model, event loop không bao giờ bị block
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sentiment-worker")
+        self.latency = LatencyRecorder()
+        self.batch_sizes = LatencyRecorder()
+        self.rejected = 0
+        self._worker = None
+
+    def start(self):
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, texts, model_name=None):
+        """
+        Đưa text vào hàng đợi và chờ kết quả của model model_name (None: model mặc định)
+
+        Raises:
+            BatchTooLargeError: Số text vượt sức chứa của hàng đợi (kể cả khi rỗng)
+            QueueFullError: Không đủ chỗ trong hàng đợi cho tất cả text
+        """
+        if self.queue.maxsize > 0:
+            if len(texts) > self.queue.maxsize:
+                self.rejected += 1
+                raise BatchTooLargeError()
+            if self.queue.maxsize - self.queue.qsize() < len(texts):
+                self.rejected += 1
+                raise QueueFullError()
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self.queue.put_nowait((text, model_name, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batch_sizes.record(len(batch))
+            groups = {}
+            for text, model_name, future in batch:
+                groups.setdefault(model_name, []).append((text, future))
+            for model_name, group in groups.items():
+                await self._run_group(loop, model_name, group)
+
+    async def _run_group(self, loop, model_name, group):
+        """Chạy analyze_many cho các text cùng model, trả kết quả cho từng future"""
+        texts = [text for text, _ in group]
+        try:
+            results = await loop.run_in_executor(
+                self.executor, self.registry.analyze_many, texts, self.max_batch_size, model_name)
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(group, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def evict_idle(self):
+        """Gỡ model không dùng lâu (trên thread worker, không chạy song song với suy luận)"""
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.registry.evict_idle)
+
+    def get_metrics(self):
+        batch_samples = self.batch_sizes.samples
+        return {
+            "requests": self.latency.total,
+            "rejected": self.rejected,
+            "queue_size": self.queue.qsize(),
+            "latency_ms": self.latency.percentiles(),
+            "batches": self.batch_sizes.total,
+            "mean_batch_size": sum(batch_samples) / len(batch_samples) if batch_samples else None,
+            "cascade": (self.registry.get_cascade_stats()
+                        if self.registry.analyzer_kwargs.get("cascade_model") else None),
+            "models": {
+                "loaded": self.registry.loaded_models(),
+                "total_memory_mb": self.registry.total_memory_mb(),
+                "memory_budget_mb": self.registry.memory_budget_mb,
+                "loads": self.registry.counters["load"],
+                "evictions": self.registry.counters["evict"],
+            },
+        }
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self, batcher):
+        self.batcher = batcher
+
+    def write_json(self, data, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps(data, ensure_ascii=False))
+
+    def read_json(self):
+        try:
+            return json.loads(self.request.body or b"{}")
+        except ValueError:
+            return None
+
+    async def analyze(self, texts, model_name=None):
+        if model_name is not None and model_name not in self.batcher.registry.model_names:
+            self.write_json({"error": f"Model không được hỗ trợ: {model_name}",
+                             "available_models": self.batcher.registry.model_names}, status=400)
+            return None
+        start = time.perf_counter()
+        try:
+            results = await self.batcher.submit(texts, model_name)
+        except BatchTooLargeError:
+            max_texts = self.batcher.queue.maxsize
+            self.write_json({"error": f"Tối đa {max_texts} text mỗi request, hãy chia nhỏ batch",
+                             "max_texts": max_texts}, status=413)
+            return None
+        except QueueFullError:
+            self.set_header("Retry-After", "1")
+            self.write_json({"error": "Service đang quá tải, thử lại sau"}, status=503)
+            return None
+        self.batcher.latency.record(time.perf_counter() - start)
+        return results
+
+
+class AnalyzeHandler(BaseHandler):
+    async def post(self):
+        body = self.read_json()
+        text = body.get("text") if isinstance(body, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            self.write_json({"error": "Cần trường 'text' là chuỗi không rỗng"}, status=400)
+            return
+        results = await self.analyze([text], body.get("model"))
+        if results is not None:
+            self.write_json(results[0])
+
+
+class AnalyzeBatchHandler(BaseHandler):
+    async def post(self):
+        body = self.read_json()
+        texts = body.get("texts") if isinstance(body, dict) else None
+        if not isinstance(texts, list) or not texts or not all(isinstance(t, str) for t in texts):
+            self.write_json({"error": "Cần trường 'texts' là danh sách chuỗi không rỗng"}, status=400)
+            return
+        results = await self.analyze(texts, body.get("model"))
+        if results is not None:
+            self.write_json({"results": results})
+
+
+class MetricsHandler(BaseHandler):
+    def get(self):
+        self.write_json(self.batcher.get_metrics())
+
+
+class ModelsHandler(BaseHandler):
+    def get(self):
+        self.write_json(self.batcher.registry.get_stats())
+
+
+class PrometheusMetricsHandler(BaseHandler):
+    def get(self):
+        metrics = self.batcher.get_metrics()
+        lines = [
+            "# TYPE sentiment_service_requests_total counter",
+            f"sentiment_service_requests_total {metrics['requests']}",
+            "# TYPE sentiment_service_rejected_total counter",
+            f"sentiment_service_rejected_total {metrics['rejected']}",
+            "# TYPE sentiment_service_batches_total counter",
+            f"sentiment_service_batches_total {metrics['batches']}",
+            "# TYPE sentiment_service_queue_size gauge",
+            f"sentiment_service_queue_size {metrics['queue_size']}",
+        ]
+        models = metrics['models']
+        lines.extend([
+            "# TYPE sentiment_models_loaded gauge",
+            f"sentiment_models_loaded {len(models['loaded'])}",
+            "# TYPE sentiment_models_memory_mb gauge",
+            f"sentiment_models_memory_mb {models['total_memory_mb']:.1f}",
+            "# TYPE sentiment_model_loads_total counter",
+            f"sentiment_model_loads_total {models['loads']}",
+            "# TYPE sentiment_model_evictions_total counter",
+            f"sentiment_model_evictions_total {models['evictions']}",
+        ])
+        if metrics['cascade'] is not None:
+            lines.append("# TYPE sentiment_cascade_texts_total counter")
+            lines.append(f'sentiment_cascade_texts_total{{tier="cheap"}} {metrics["cascade"]["cheap_texts"]}')
+            lines.append(f'sentiment_cascade_texts_total{{tier="model"}} {metrics["cascade"]["model_texts"]}')
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish("\n".join(lines) + "\n" + instrumentation.METRICS.render_prometheus())
+
+
+class InstrumentationHandler(BaseHandler):
+    def post(self):
+        body = self.read_json()
+        if not isinstance(body, dict) or not isinstance(body.get("enabled"), bool):
+            self.write_json({"error": "Cần trường 'enabled' là true/false"}, status=400)
+            return
+        instrumentation.METRICS.enabled = body["enabled"]
+        self.write_json({"enabled": instrumentation.METRICS.enabled})
+
+
+class ProfilerHandler(BaseHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
+        self.finish(instrumentation.PROFILER.collapsed())
+
+    def post(self):
+        body = self.read_json()
+        action = body.get("action") if isinstance(body, dict) else None
+        if action not in ("start", "stop", "reset"):
+            self.write_json({"error": "action phải là 'start', 'stop' hoặc 'reset'"}, status=400)
+            return
+        getattr(instrumentation.PROFILER, action)()
+        self.write_json({"running": instrumentation.PROFILER.running,
+                         "samples": sum(instrumentation.PROFILER.samples.values())})
+
+
+class HealthHandler(BaseHandler):
+    def get(self):
+        self.write_json({"status": "ok"})
+
+
+def make_app(batcher):
+    """Tạo tornado Application với các endpoint của service"""
+    handler_args = {"batcher": batcher}
+    return tornado.web.Application([
+        (r"/analyze", AnalyzeHandler, handler_args),
+        (r"/analyze_batch", AnalyzeBatchHandler, handler_args),
+        (r"/models", ModelsHandler, handler_args),
+        (r"/metrics", MetricsHandler, handler_args),
+        (r"/metrics/prometheus", PrometheusMetricsHandler, handler_args),
+        (r"/debug/instrumentation", InstrumentationHandler, handler_args),
+        (r"/debug/profiler", ProfilerHandler, handler_args),
+        (r"/health", HealthHandler, handler_args),
+    ])
+
+
+def print_model_event(event):
+    details = ", ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}"
+                        for k, v in event.items() if k not in ("time", "event", "model_name"))
+    print(f"[{event['time']}] {event['event']} {event['model_name']}: {details}")
+
+
+async def serve(args):
+    from model_registry import ModelRegistry
+
+    cache_factory = None
+    if args.cache:
+        from result_cache import SentimentResultCache
+        cache_factory = SentimentResultCache
+
+    registry = ModelRegistry(
+        [args.model_name] + [m for m in args.models if m != args.model_name],
+        memory_budget_mb=args.memory_budget_mb, idle_seconds=args.idle_seconds, dtype=args.dtype,
+        cache_factory=cache_factory, on_event=print_model_event,
+        backend=args.backend, graph=args.graph,
+        num_threads=args.num_threads, interop_threads=args.interop_threads,
+        cascade_model=args.cascade_model, cascade_threshold=args.cascade_threshold)
+    print("Đang load models...")
+    for step, seconds in registry.warmup().items():
+        print(f"  {step}: {seconds:.2f}s")
+
+    batcher = MicroBatcher(registry, args.max_batch_size, args.max_wait_ms, args.max_queue_size)
+    batcher.start()
+    app = make_app(batcher)
+    server = app.listen(args.port, address=args.host)
+    idle_checker = None
+    if args.idle_seconds:
+        idle_checker = tornado.ioloop.PeriodicCallback(
+            batcher.evict_idle, min(args.idle_seconds, 60) * 1000)
+        idle_checker.start()
+    print(f"Service đang chạy tại http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if idle_checker is not None:
+            idle_checker.stop()
+        server.stop()
+        await batcher.stop()
+
+
+def main():
+    from vietnamese_sentiment import SENTIMENT_MODEL_NAME
+    from inference_backends import BACKENDS, DTYPES
+
+    parser = argparse.ArgumentParser(description="HTTP service phân tích sentiment tiếng Việt")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model-name", default=SENTIMENT_MODEL_NAME, help="Model mặc định")
+    parser.add_argument("--models", nargs="*", default=[],
+                        help="Các model khác có thể chọn theo request (trường 'model')")
+    parser.add_argument("--memory-budget-mb", type=float,
+                        help="Giới hạn bộ nhớ trọng số; gỡ model ít dùng gần đây nhất khi vượt")
+    parser.add_argument("--idle-seconds", type=float, help="Gỡ model không được dùng quá số giây này")
+    parser.add_argument("--dtype", choices=DTYPES, help="Trọng số nửa độ chính xác (backend torch)")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    parser.add_argument("--graph", choices=("trace", "compile"),
+                        help="Dựng graph TorchScript/torch.compile theo bucket độ dài khi khởi động")
+    parser.add_argument("--num-threads", type=int, help="Số thread intra-op của PyTorch/ONNX Runtime")
+    parser.add_argument("--interop-threads", type=int, help="Số thread inter-op của PyTorch")
+    parser.add_argument("--cascade-model", help="Model nhẹ chạy trước PhoBERT (xem cascade.py)")
+    parser.add_argument("--cascade-threshold", type=float, default=0.9)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--max-queue-size", type=int, default=1024)
+    parser.add_argument("--cache", action="store_true", help="Dùng cache kết quả (bộ nhớ + SQLite)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Bật đo thời gian từng bước ngay khi khởi động")
+    parser.add_argument("--allow-download", action="store_true",
+                        help="Cho phép tải model từ HuggingFace (mặc định chỉ dùng cache local)")
+    args = parser.parse_args()
+
+    if not args.allow_download:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    if args.metrics:
+        instrumentation.enable()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Dùng chung trọng số model giữa nhiều process
+
+Hai cách:
+- mmap: tensor trọng số trỏ thẳng vào file safetensors được memory-map
+  (VietnameseSentimentAnalyzer(mmap_weights=True)). Các trang của file nằm
+  trong page cache của hệ điều hành nên mọi process load cùng file chỉ tốn
+  một bản trong RAM, kể cả process không có quan hệ cha con (Streamlit, worker).
+- fork: load model một lần ở process cha rồi fork worker; trọng số được chia
+  sẻ copy-on-write (prepare_for_fork() đóng băng GC để không chạm vào các trang).
+
+Đo RSS/PSS mỗi worker với từng cách:
+    python shared_weights.py measure --mode copy --workers 4
+    python shared_weights.py measure --mode mmap --workers 4
+    python shared_weights.py measure --mode fork --workers 4
+"""
+
+import argparse
+import gc
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import warnings
+
+from vietnamese_sentiment import BASE_DIR, torch, transformers
+
+# Bản safetensors chuyển đổi cho model không có sẵn file safetensors
+SHARED_WEIGHTS_DIR = os.path.join(BASE_DIR, "shared_weights")
+SAFETENSORS_FILE = "model.safetensors"
+
+SAFETENSORS_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+
+def mmap_safetensors(path):
+    """
+    Đọc file safetensors thành dict tensor dùng chung vùng nhớ với file (không copy)
+
+    Returns:
+        dict: Tên tensor -> torch.Tensor (chỉ đọc)
+    """
+    with open(path, 'rb') as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+        start, end = info["data_offsets"]
+        if end == start:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        # torch cảnh báo buffer chỉ đọc; model chỉ dùng để suy luận nên không ghi vào tensor
+        # (chỉ tắt cảnh báo trong lời gọi này, không đổi bộ lọc warning của cả process)
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="The given buffer is not writable")
+            flat = torch.frombuffer(buffer, dtype=dtype, count=(end - start) // dtype.itemsize,
+                                    offset=data_start + start)
+        tensors[name] = flat.view(info["shape"])
+    return tensors
+
+
+def convert_to_safetensors(model_path, task, output_dir=None):
+    """
+    Lưu model (đọc bằng from_pretrained) thành một file safetensors duy nhất
+
+    Returns:
+        str: Đường dẫn file safetensors
+    """
+    from inference_backends import TASK_MODEL_CLASSES
+
+    output_dir = output_dir or os.path.join(SHARED_WEIGHTS_DIR, re.sub(r"[^\w.-]+", "--", model_path))
+    path = os.path.join(output_dir, SAFETENSORS_FILE)
+    if not os.path.exists(path):
+        model = getattr(transformers, TASK_MODEL_CLASSES[task]).from_pretrained(model_path)
+        model.save_pretrained(output_dir, safe_serialization=True, max_shard_size="100GB")
+    return path
+
+
+def resolve_safetensors(model_path, task):
+    """File safetensors của model (thư mục local, cache HuggingFace, hoặc bản chuyển đổi)"""
+    local_path = os.path.join(model_path, SAFETENSORS_FILE)
+    if os.path.exists(local_path):
+        return local_path
+    path = transformers.utils.cached_file(
+        model_path, SAFETENSORS_FILE, _raise_exceptions_for_missing_entries=False)
+    return path or convert_to_safetensors(model_path, task)
+
+
+def load_mmap_model(model_path, task):
+    """
+    Tạo model với trọng số memory-map từ file safetensors
+
+    Model được khởi tạo trên device "meta" (không cấp phát trọng số) rồi các
+    tham số được gán thẳng bằng tensor trỏ vào file. Model chỉ dùng để suy luận:
+    tensor là chỉ đọc, không quantize/ghi đè được.
+    """
+    from accelerate import init_empty_weights
+    from inference_backends import TASK_MODEL_CLASSES
+
+    model_class = getattr(transformers, TASK_MODEL_CLASSES[task])
+    config = transformers.AutoConfig.from_pretrained(model_path)
+    path = resolve_safetensors(model_path, task)
+
+    for attempt in range(2):
+        with init_empty_weights(include_buffers=False):
+            model = model_class.from_config(config)
+        model.load_state_dict(mmap_safetensors(path), strict=False, assign=True)
+        model.tie_weights()
+        missing = [name for name, param in model.named_parameters() if param.is_meta]
+        if not missing:
+            break
+        # Tên tensor trong file gốc khác tên chuẩn (checkpoint cũ): dùng bản chuyển đổi
+        if attempt == 0:
+            path = convert_to_safetensors(model_path, task)
+    else:
+        raise RuntimeError(f"Không load được các tham số {missing[:5]} từ {path}")
+
+    model.eval()
+    return model
+
+
+def prepare_for_fork():
+    """
+    Gọi ngay trước khi fork worker: dọn rác rồi đóng băng các object hiện có
+    để GC của worker không ghi vào các trang nhớ dùng chung (tránh copy-on-write)
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def memory_usage(pid=None):
+    """
+    Bộ nhớ của process (MB) đọc từ /proc/<pid>/smaps_rollup (Linux)
+
+    Returns:
+        dict: rss (tổng trang đang nằm trong RAM), pss (RSS chia đều phần dùng chung
+              cho các process cùng dùng), shared, private
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared",
+              "Private_Clean": "private", "Private_Dirty": "private"}
+    usage = {"rss": 0.0, "pss": 0.0, "shared": 0.0, "private": 0.0}
+    with open(f"/proc/{pid or 'self'}/smaps_rollup", 'r') as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in fields:
+                usage[fields[key]] += int(value.split()[0]) / 1024
+    return usage
+
+
+MEASURE_TEXTS = [
+    "san pham tot", "giao hang cham qua", "Sản phẩm này không tốt, tôi thất vọng.",
+    "shop tu van nhiet tinh, se ung ho tiep",
+]
+
+_fork_analyzer = None
+
+
+def _measure_worker(mode, barrier, results):
+    """Worker của lệnh measure: load (hoặc dùng analyzer của process cha), chạy thử, đo bộ nhớ"""
+    from vietnamese_sentiment import VietnameseSentimentAnalyzer
+
+    analyzer = _fork_analyzer
+    if analyzer is None:
+        analyzer = VietnameseSentimentAnalyzer(mmap_weights=(mode == "mmap"))
+    analyzer.analyze_many(MEASURE_TEXTS)
+    # Đo khi mọi worker đều đang chạy để PSS chia phần dùng chung đúng số process
+    barrier.wait()
+    results.put(memory_usage())
+    barrier.wait()
+
+
+def measure(mode, workers):
+    """
+    Chạy workers process theo mode ("copy", "mmap", "fork"), trả về bộ nhớ mỗi worker
+
+    - copy: mỗi worker tự load model bằng from_pretrained (spawn)
+    - mmap: mỗi worker load với mmap_weights=True (spawn)
+    - fork: process cha load một lần, worker được fork
+    """
+    global _fork_analyzer
+
+    context = multiprocessing.get_context("fork" if mode == "fork" else "spawn")
+    if mode == "fork":
+        from vietnamese_sentiment import VietnameseSentimentAnalyzer
+        _fork_analyzer = VietnameseSentimentAnalyzer()
+        # Chỉ load, không chạy suy luận ở process cha: thread pool OpenMP đã khởi
+        # động trước khi fork có thể làm worker bị treo
+        _fork_analyzer.restored
+        _fork_analyzer._load_classifier()
+        _fork_analyzer.standardizer
+        prepare_for_fork()
+
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=_measure_worker, args=(mode, barrier, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    usages = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    return {
+        "mode": mode,
+        "workers": usages,
+        "total_pss_mb": sum(u["pss"] for u in usages),
+        "parent": memory_usage() if mode == "fork" else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dùng chung trọng số model giữa các process")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    measure_parser = subparsers.add_parser("measure", help="Đo RSS/PSS mỗi worker")
+    measure_parser.add_argument("--mode", choices=("copy", "mmap", "fork"), default="mmap")
+    measure_parser.add_argument("--workers", type=int, default=4)
+
+    convert_parser = subparsers.add_parser("convert", help="Tạo bản safetensors cho model chưa có")
+    convert_parser.add_argument("model_path")
+    convert_parser.add_argument("--task", default="sequence-classification",
+                                choices=("sequence-classification", "token-classification"))
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        print(convert_to_safetensors(args.model_path, args.task))
+        return
+
+    report = measure(args.mode, args.workers)
+    for i, usage in enumerate(report["workers"]):
+        print(f"worker {i}: RSS {usage['rss']:8.1f} MB  PSS {usage['pss']:8.1f} MB  "
+              f"shared {usage['shared']:8.1f} MB  private {usage['private']:8.1f} MB")
+    print(f"Tổng PSS các worker ({report['mode']}): {report['total_pss_mb']:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
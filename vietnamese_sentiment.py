@@ -3,38 +3,333 @@ Module xử lý sentiment analysis cho tiếng Việt
 Chứa các class: VietnameseDiacriticRestorer, VietnameseTextStandardizer, VietnameseSentimentAnalyzer
 """
 
+import concurrent.futures
+import functools
+import importlib
+import json
 import os
+import queue
 import re
-import torch
-import numpy as np
-from transformers import (
-    AutoTokenizer,
-    AutoModelForSequenceClassification,
-    pipeline,
-    AutoModelForTokenClassification
-)
-from underthesea import text_normalize, word_tokenize
+import threading
+import time
+import warnings
+from collections import OrderedDict
+
+from instrumentation import METRICS, StageTimer
+
+
+class _LazyModule:
+    """Module chỉ được import khi truy cập thuộc tính lần đầu"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# torch/transformers/underthesea mất nhiều giây để import, nên chỉ import khi cần
+torch = _LazyModule("torch")
+np = _LazyModule("numpy")
+transformers = _LazyModule("transformers")
+underthesea = _LazyModule("underthesea")
 
 # Đường dẫn file tags (tự động tìm trong cùng thư mục)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TAGS_FILE = os.path.join(BASE_DIR, "selected_tags_names.txt")
 
+# Model mặc định
+SENTIMENT_MODEL_NAME = "wonrax/phobert-base-vietnamese-sentiment"
+RESTORER_MODEL_PATH = "peterhung/vietnamese-accent-marker-xlm-roberta"
+
+# Tier tạo ra kết quả (result['tier']): PhoBERT hoặc model nhẹ của cascade
+TIER_MODEL = "model"
+TIER_CHEAP = "cheap"
+
+# Các độ dài (token) được tạo graph riêng khi dùng graph="trace"/"compile"
+LENGTH_BUCKETS = (16, 32, 64, 128, 256, 512)
+
+
+def split_windows(length, window, overlap):
+    """
+    Chia dãy length phần tử thành các cửa sổ chồng lấn nhau
+
+    Mỗi phần tử thuộc về đúng một cửa sổ (vùng "own"): phần chồng lấn giữa
+    hai cửa sổ liên tiếp được chia đôi, nên kết quả ghép lại luôn dùng
+    dự đoán có ngữ cảnh hai bên.
+
+    Args:
+        length: Số phần tử (từ)
+        window: Số phần tử tối đa mỗi cửa sổ (None: không chia)
+        overlap: Số phần tử chồng lấn giữa hai cửa sổ liên tiếp
+
+    Returns:
+        list: Danh sách (start, end, own_start, own_end)
+    """
+    if not window or length <= window:
+        return [(0, length, 0, length)]
+    if not 0 <= overlap < window:
+        raise ValueError("overlap phải nằm trong [0, window)")
+
+    bounds = []
+    start = 0
+    while True:
+        end = min(start + window, length)
+        bounds.append((start, end))
+        if end >= length:
+            break
+        start += window - overlap
+
+    # Điểm chia vùng own là giữa phần chồng lấn
+    cuts = [0] + [(bounds[k][0] + bounds[k - 1][1]) // 2 for k in range(1, len(bounds))] + [length]
+    return [(start, end, cuts[k], cuts[k + 1]) for k, (start, end) in enumerate(bounds)]
+
+
+def max_content_tokens(tokenizer, default=512):
+    """Số sub-token nội dung tối đa model nhận được (không tính token đặc biệt)"""
+    max_length = tokenizer.model_max_length
+    if not max_length or max_length > 100000:  # tokenizer không khai báo giới hạn
+        max_length = default
+    return max_length - tokenizer.num_special_tokens_to_add(pair=False)
+
+
+def fit_windows(words, window, overlap, max_tokens, count_tokens):
+    """
+    Như split_windows nhưng mỗi cửa sổ không vượt quá max_tokens sub-token
+
+    Cửa sổ tính theo số từ có thể vượt giới hạn của model khi có từ dài hoặc
+    emoji bị tách thành nhiều sub-token (phần cuối sẽ bị cắt mất). Khi đó số
+    từ mỗi cửa sổ (và overlap theo cùng tỉ lệ) được giảm tới khi mọi cửa sổ vừa.
+
+    Args:
+        words: Danh sách từ
+        window: Số từ tối đa mỗi cửa sổ (None: chỉ chia khi vượt max_tokens)
+        overlap: Số từ chồng lấn giữa hai cửa sổ liên tiếp
+        max_tokens: Số sub-token tối đa mỗi cửa sổ
+        count_tokens: Hàm trả về số sub-token của từng từ
+
+    Returns:
+        list: Danh sách (start, end, own_start, own_end) như split_windows
+    """
+    # Mỗi sub-token chứa ít nhất một byte (cộng một cho ký tự đầu từ), nên
+    # text ngắn chắc chắn vừa mà không cần tokenize
+    if sum(len(word.encode("utf-8")) + 1 for word in words) <= max_tokens:
+        return split_windows(len(words), window, overlap)
+
+    counts = count_tokens(words)
+    if not window:
+        window, overlap = len(words), 0
+    while True:
+        bounds = split_windows(len(words), window, overlap)
+        largest = max(sum(counts[start:end]) for start, end, _, _ in bounds)
+        if largest <= max_tokens or window == 1:
+            return bounds
+        new_window = max(1, min(window - 1, window * max_tokens // largest))
+        overlap = overlap * new_window // window
+        window = new_window
+
+
+# Ranh giới câu: sau dấu kết thúc câu hoặc xuống dòng
+SENTENCE_BOUNDARY_PATTERN = re.compile(r'(?<=[.!?…])\s+|\s*\n\s*')
+
+
+def split_sentences(text):
+    """Tách text thành các câu (giữ dấu câu ở cuối mỗi câu, bỏ câu rỗng)"""
+    return [sentence for sentence in SENTENCE_BOUNDARY_PATTERN.split(text.strip()) if sentence.strip()]
+
+
+class LRUCache:
+    """Cache LRU có giới hạn số phần tử, an toàn khi dùng từ nhiều thread"""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_stats(self):
+        """Thống kê hit/miss/eviction"""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Các ký tự có dấu của tiếng Việt (dùng để nhận biết text đã có dấu)
+VIETNAMESE_ACCENTED_CHARS = frozenset(
+    "àáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ"
+)
+
+
+class VietnameseAccentDetector:
+    """Class phát hiện text đã có dấu để bỏ qua model restore dấu"""
+
+    def __init__(self, min_accented_ratio=0.5, restore_spans=True,
+                 min_span_ratio=0.2, min_span_words=2):
+        """
+        Args:
+            min_accented_ratio: Khi restore_spans=False: tỉ lệ âm tiết có dấu tối thiểu
+                để coi text đã có dấu (bỏ qua hoàn toàn model). None để luôn chạy model.
+            restore_spans: Chỉ restore các đoạn không dấu (quyết định theo từng đoạn,
+                không theo tỉ lệ của cả text); text không có đoạn nào thì bỏ qua model
+            min_span_ratio: Text có tỉ lệ âm tiết có dấu thấp hơn được restore toàn bộ
+            min_span_words: Số từ không dấu liên tiếp tối thiểu để đưa đoạn đó qua model
+                (từ không dấu đứng lẻ như "anh", "con" được giữ nguyên)
+        """
+        self.min_accented_ratio = min_accented_ratio
+        self.restore_spans = restore_spans
+        self.min_span_ratio = min_span_ratio
+        self.min_span_words = min_span_words
+
+    def is_syllable(self, word):
+        """Từ có chứa chữ cái (bỏ qua số, emoji, dấu câu)"""
+        return any(ch.isalpha() for ch in word)
+
+    def is_accented(self, word):
+        """Từ có chứa ít nhất một ký tự có dấu"""
+        return any(ch in VIETNAMESE_ACCENTED_CHARS for ch in word.lower())
+
+    def accented_ratio(self, words):
+        """Tỉ lệ âm tiết có dấu trong danh sách từ"""
+        syllables = [word for word in words if self.is_syllable(word)]
+        if not syllables:
+            return 1.0
+        return sum(self.is_accented(word) for word in syllables) / len(syllables)
+
+    def find_spans(self, words):
+        """
+        Tìm các đoạn từ cần đưa qua model restore dấu
+
+        Args:
+            words: Danh sách từ (đã tách theo khoảng trắng)
+
+        Returns:
+            list: Danh sách (start, end) các đoạn cần restore.
+                  [] nghĩa là bỏ qua model, [(0, len(words))] là restore toàn bộ.
+        """
+        if not words:
+            return []
+        if self.min_accented_ratio is None:
+            return [(0, len(words))]
+
+        ratio = self.accented_ratio(words)
+        if not self.restore_spans:
+            return [] if ratio >= self.min_accented_ratio else [(0, len(words))]
+        if ratio < self.min_span_ratio:
+            return [(0, len(words))]
+
+        # Gom các từ không dấu liên tiếp thành đoạn, dù phần lớn text đã có dấu
+        spans = []
+        start = None
+        for i, word in enumerate(words + ["đ"]):
+            needs_restore = i < len(words) and self.is_syllable(word) and not self.is_accented(word)
+            if needs_restore and start is None:
+                start = i
+            elif not needs_restore and start is not None:
+                if i - start >= self.min_span_words:
+                    spans.append((start, i))
+                start = None
+        return spans
+
 
 class VietnameseDiacriticRestorer:
     """Class để restore dấu tiếng Việt cho text không dấu"""
     
-    def __init__(self, model_path='peterhung/vietnamese-accent-marker-xlm-roberta'):
-        self.model = AutoModelForTokenClassification.from_pretrained(model_path)
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path, add_prefix_space=True)
+    def __init__(self, model_path=RESTORER_MODEL_PATH,
+                 accent_detector=None, window_words=200, window_overlap=32, batch_size=32,
+                 sentence_cache_size=4096, backend="torch", onnx_dir=None, mmap_weights=False,
+                 graph=None, length_buckets=LENGTH_BUCKETS, num_threads=None, dtype=None):
+        """
+        Args:
+            model_path: Tên/đường dẫn model restore dấu
+            accent_detector: VietnameseAccentDetector (None: cấu hình mặc định)
+            window_words: Số từ tối đa mỗi cửa sổ khi text dài (None: không chia)
+            window_overlap: Số từ chồng lấn giữa hai cửa sổ
+            batch_size: Số cửa sổ tối đa trong một forward pass
+            sentence_cache_size: Số câu đã restore được nhớ lại (0: tắt cache theo câu,
+                vẫn restore từng câu nên kết quả không đổi)
+            backend: Backend suy luận ("torch", "torch-int8", "onnx", "onnx-int8")
+            onnx_dir: Thư mục chứa model ONNX đã export (backend onnx)
+            mmap_weights: Memory-map trọng số từ file safetensors (dùng chung giữa các process)
+            graph: None (eager), "trace" hoặc "compile" (xem inference_backends.InferenceEngine)
+            length_buckets: Các độ dài token được tạo graph riêng
+            num_threads: Số thread intra-op của PyTorch/ONNX Runtime (None: mặc định)
+            dtype: None (float32), "bfloat16" hoặc "float16" (backend torch)
+        """
+        from inference_backends import InferenceEngine, configure_threads, load_model
+
+        configure_threads(num_threads)
+        self.model_path = model_path
+        self.backend = backend
+        self.model = load_model(model_path, "token-classification", backend, onnx_dir, mmap_weights,
+                                num_threads, dtype)
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(
+            onnx_dir or model_path, add_prefix_space=True)
         self.TOKENIZER_WORD_PREFIX = "▁"
+        self.max_tokens = max_content_tokens(self.tokenizer)
 
-        # Device
-        self.device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+        # Device (model int8/ONNX chỉ chạy trên CPU)
+        use_cuda = backend == "torch" and torch.cuda.is_available()
+        self.device = torch.device("cuda") if use_cuda else torch.device("cpu")
         self.model.to(self.device)
         self.model.eval()
+        self.engine = InferenceEngine(self.model, graph, length_buckets, self.device)
 
         # Load labels list
         self.label_list = self._load_tags_set(TAGS_FILE)
+        self.tag_raws, self.tag_vowels, self.tag_changes = self._parse_tags(self.label_list)
+        self._accent_word_cached = functools.lru_cache(maxsize=65536)(self._accent_word)
+
+        # Text dài được chia cửa sổ (theo từ, và theo sub-token khi vượt max_tokens)
+        # thay vì bị cắt mất phần cuối
+        self.window_words = window_words
+        self.window_overlap = window_overlap
+        self.batch_size = batch_size
+
+        # Cache theo câu: chỉ những câu chưa gặp mới phải qua model
+        self.sentence_cache = LRUCache(sentence_cache_size) if sentence_cache_size else None
+
+        # Fast path: bỏ qua model cho text đã có dấu
+        self.accent_detector = accent_detector or VietnameseAccentDetector()
+        self.fast_path_stats = {
+            "model_texts": 0,      # text đưa toàn bộ qua model
+            "partial_texts": 0,    # text lẫn, chỉ restore các đoạn không dấu
+            "skipped_texts": 0,    # text đã có dấu, không gọi model
+            "model_words": 0,      # số từ đưa qua model
+            "skipped_words": 0,    # số từ không cần đưa qua model
+        }
 
     def insert_accents(self, text):
         """Insert accents vào text"""
@@ -53,12 +348,7 @@ class VietnameseDiacriticRestorer:
         tokens = self.tokenizer.convert_ids_to_tokens(input_ids[0])
         tokens = tokens[1:-1]
 
-        with torch.no_grad():
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            outputs = self.model(**inputs)
-
-        predictions = outputs["logits"].cpu().numpy()
-        predictions = np.argmax(predictions, axis=2)
+        predictions = np.argmax(self.engine(**inputs).numpy(), axis=2)
 
         # Exclude output at index 0 and the last index, which correspond to '<s>' and '</s>'
         predictions = predictions[0][1:-1]
@@ -105,13 +395,17 @@ class VietnameseDiacriticRestorer:
 
     def get_accented_words(self, merged_tokens_preds, label_list):
         """Get accented words từ merged tokens và predictions"""
+        if label_list is self.label_list:
+            tag_pairs = list(zip(self.tag_raws, self.tag_vowels))
+        else:
+            tag_pairs = [tag.split("-") for tag in label_list]
+
         accented_words = []
         for word_raw, label_indexes in merged_tokens_preds:
             # Use the first label that changes word_raw
             word_accented = word_raw
             for label_index in label_indexes:
-                tag_name = label_list[int(label_index)]
-                raw, vowel = tag_name.split("-")
+                raw, vowel = tag_pairs[int(label_index)]
                 if raw and raw in word_raw:
                     word_accented = word_raw.replace(raw, vowel)
                     break
@@ -120,18 +414,306 @@ class VietnameseDiacriticRestorer:
 
         return " ".join(accented_words)
 
+    def _parse_tags(self, label_list):
+        """Tách sẵn các tag dạng 'raw-vowel' thành mảng tra cứu theo index"""
+        pairs = [tag.split("-") for tag in label_list]
+        tag_raws = [raw for raw, _ in pairs]
+        tag_vowels = [vowel for _, vowel in pairs]
+        # Tag không làm đổi từ (raw rỗng hoặc raw == vowel) được lọc bằng numpy
+        tag_changes = np.array([bool(raw) and raw != vowel for raw, vowel in pairs])
+        return tag_raws, tag_vowels, tag_changes
+
+    def _accent_word(self, word_raw, label_indexes):
+        """Áp dụng tag đầu tiên (theo index) có phần raw xuất hiện trong từ"""
+        for label_index in label_indexes:
+            raw = self.tag_raws[label_index]
+            if raw and raw in word_raw:
+                return word_raw.replace(raw, self.tag_vowels[label_index])
+        return word_raw
+
     def restore(self, text):
         """Restore dấu cho text"""
-        tokens, predictions = self.insert_accents(text)
-        merged_tokens_preds = self.merge_tokens_and_preds(tokens, predictions)
-        accented_words = self.get_accented_words(merged_tokens_preds, self.label_list)
-        return accented_words
+        return self.restore_batch([text])[0]
+
+    def restore_batch(self, texts):
+        """
+        Restore dấu cho nhiều text trong một forward pass
+
+        Dấu được restore theo từng câu (model không thấy ngữ cảnh của câu
+        khác): text được tách thành câu, các câu khác nhau được đưa qua model
+        trong cùng batch rồi ghép lại. sentence_cache chỉ nhớ kết quả của câu
+        đã gặp, nên bật hay tắt cache không làm đổi kết quả.
+
+        Args:
+            texts: Danh sách text cần restore dấu
+
+        Returns:
+            list: Danh sách text đã restore dấu, cùng thứ tự với texts
+        """
+        text_sentences = [split_sentences(text) for text in texts]
+
+        restored = {}
+        missing = []
+        for sentences in text_sentences:
+            for sentence in sentences:
+                if sentence in restored:
+                    continue
+                if self.sentence_cache is not None:
+                    restored[sentence] = self.sentence_cache.get(sentence)
+                if restored.get(sentence) is None:
+                    missing.append(sentence)
+
+        for sentence, restored_sentence in zip(missing, self._restore_texts(missing)):
+            restored[sentence] = restored_sentence
+            if self.sentence_cache is not None:
+                self.sentence_cache.put(sentence, restored_sentence)
+
+        return [" ".join(restored[sentence] for sentence in sentences) for sentences in text_sentences]
+
+    def _restore_texts(self, texts):
+        """
+        Restore dấu cho nhiều câu, không dùng cache theo câu
+
+        Text đã có dấu được trả về ngay không qua model; với text lẫn chỉ
+        các đoạn không dấu được restore (xem VietnameseAccentDetector).
+        """
+        batch_words = [text.strip().split() for text in texts]
+
+        # Gom tất cả các đoạn cần restore của mọi text vào một batch
+        segments = []
+        plans = []
+        for words in batch_words:
+            spans = self.accent_detector.find_spans(words)
+            plans.append(spans)
+            segments.extend(words[start:end] for start, end in spans)
+
+            restored_count = sum(end - start for start, end in spans)
+            self.fast_path_stats["model_words"] += restored_count
+            self.fast_path_stats["skipped_words"] += len(words) - restored_count
+            if not spans:
+                self.fast_path_stats["skipped_texts"] += 1
+            elif spans == [(0, len(words))]:
+                self.fast_path_stats["model_texts"] += 1
+            else:
+                self.fast_path_stats["partial_texts"] += 1
+
+        restored_segments = iter(self._restore_words_batch(segments))
+
+        restored_texts = []
+        for words, spans in zip(batch_words, plans):
+            words = list(words)
+            for start, end in spans:
+                words[start:end] = next(restored_segments)
+            restored_texts.append(" ".join(words))
+
+        return restored_texts
+
+    def get_fast_path_stats(self):
+        """Thống kê số text/từ đã bỏ qua model restore dấu"""
+        return dict(self.fast_path_stats)
+
+    def _restore_words_batch(self, batch_words):
+        """
+        Restore dấu cho nhiều câu (đã tách từ)
+
+        Câu dài được chia thành các cửa sổ chồng lấn; cửa sổ của mọi câu được
+        sắp theo độ dài và chạy chung trong các batch tối đa batch_size cửa sổ,
+        sau đó ghép lại theo vùng own của từng cửa sổ. Chi phí tuyến tính theo
+        độ dài text và bộ nhớ đỉnh bị chặn bởi batch_size * window_words.
+
+        Args:
+            batch_words: Danh sách câu, mỗi câu là danh sách từ
+
+        Returns:
+            list: Danh sách câu đã restore dấu, mỗi câu là danh sách từ
+        """
+        windows = []
+        for i, words in enumerate(batch_words):
+            for start, end, own_start, own_end in fit_windows(
+                    words, self.window_words, self.window_overlap, self.max_tokens, self._count_tokens):
+                windows.append((i, start, end, own_start, own_end))
+        windows.sort(key=lambda w: w[2] - w[1])
+
+        restored = [list(words) for words in batch_words]
+        for k in range(0, len(windows), self.batch_size):
+            chunk = windows[k:k + self.batch_size]
+            outputs = self._forward_words([batch_words[i][start:end] for i, start, end, _, _ in chunk])
+            for (i, start, _, own_start, own_end), words in zip(chunk, outputs):
+                restored[i][own_start:own_end] = words[own_start - start:own_end - start]
+
+        return restored
+
+    def _count_tokens(self, words):
+        """Số sub-token của từng từ"""
+        return [len(ids) for ids in self.tokenizer(words, add_special_tokens=False)['input_ids']]
+
+    def _forward_words(self, batch_words):
+        """
+        Chạy model restore dấu cho nhiều câu (đã tách từ) trong một forward pass
+
+        Các câu được pad tới câu dài nhất trong batch. Sub-token được gom về
+        từ gốc bằng word_ids() của fast tokenizer, việc gom nhãn theo từ làm
+        trên mảng numpy; chỉ những từ có nhãn làm thay đổi từ mới cần thay
+        chuỗi (có cache theo (từ, nhãn)).
+
+        Args:
+            batch_words: Danh sách câu, mỗi câu là danh sách từ (không rỗng)
+
+        Returns:
+            list: Danh sách câu đã restore dấu, mỗi câu là danh sách từ
+        """
+        if not batch_words:
+            return []
+
+        inputs = self.tokenizer(
+            batch_words,
+            is_split_into_words=True,
+            truncation=True,
+            padding=True,
+            return_tensors="pt"
+        )
+
+        predictions = np.argmax(self.engine(**inputs).numpy(), axis=2)
+        num_tags = len(self.label_list)
+
+        restored = []
+        for row, words in enumerate(batch_words):
+            words = list(words)
+
+            # word_id của từng sub-token ('<s>', '</s>', padding -> -1)
+            word_ids = np.array([-1 if w is None else w for w in inputs.word_ids(row)])
+            valid = word_ids >= 0
+
+            # Các cặp (từ, nhãn) duy nhất, sắp theo từ rồi theo nhãn
+            keys = np.unique(word_ids[valid] * num_tags + predictions[row][valid])
+            word_index = keys // num_tags
+            label_index = keys % num_tags
+
+            # Bỏ các từ mà mọi nhãn đều không làm đổi từ
+            keep = np.isin(word_index, word_index[self.tag_changes[label_index]])
+            word_index = word_index[keep]
+            label_index = label_index[keep]
+
+            if len(word_index) > 0:
+                boundaries = np.flatnonzero(np.diff(word_index)) + 1
+                starts = np.concatenate(([0], boundaries))
+                for w, labels in zip(word_index[starts].tolist(), np.split(label_index, boundaries)):
+                    words[w] = self._accent_word_cached(words[w], tuple(labels.tolist()))
+
+            restored.append(words)
+
+        return restored
+
+
+class MultiPatternReplacer:
+    """
+    Thay thế nhiều pattern cố định trong một lượt quét trái sang phải
+
+    Các pattern được dựng thành một trie rồi biên dịch thành một regex duy
+    nhất, nên chi phí gần như không phụ thuộc số lượng pattern. Tại mỗi vị
+    trí luôn chọn pattern dài nhất khớp (ví dụ ":-)" thắng ":-"), và phần
+    text đã thay thế không bị quét lại.
+    """
+
+    def __init__(self, mapping):
+        self.mapping = {k: v for k, v in mapping.items() if k}
+        self.pattern = self._compile(self.mapping) if self.mapping else None
+
+    @staticmethod
+    def _compile(patterns):
+        """Biên dịch danh sách pattern thành regex dạng trie"""
+        trie = {}
+        for pattern in patterns:
+            node = trie
+            for ch in pattern:
+                node = node.setdefault(ch, {})
+            node[None] = True
+
+        def build(node):
+            is_end = None in node
+            branches = [re.escape(ch) + build(child) for ch, child in sorted(
+                (item for item in node.items() if item[0] is not None), key=lambda item: item[0])]
+            if not branches:
+                return ""
+            body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+            if is_end:
+                # Nhánh dài hơn được thử trước (greedy) -> longest match
+                return "(?:" + body + ")?"
+            return body
+
+        return re.compile(build(trie))
+
+    def replace(self, text):
+        """Thay thế tất cả pattern trong text"""
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(lambda m: self.mapping[m.group(0)], text)
+
+
+def load_dictionary_file(fpath):
+    """
+    Load từ điển thay thế từ file
+
+    Hỗ trợ:
+        - .json: object {pattern: replacement}
+        - file text: mỗi dòng "pattern<TAB>replacement", bỏ qua dòng trống
+          và dòng bắt đầu bằng '#'
+
+    Returns:
+        dict: {pattern: replacement}
+    """
+    with open(fpath, 'r', encoding='utf-8') as f:
+        if fpath.endswith('.json'):
+            return json.load(f)
+
+        mapping = {}
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            pattern, _, replacement = line.partition("\t")
+            mapping[pattern] = replacement
+        return mapping
 
 
 class VietnameseTextStandardizer:
     """Class để chuẩn hóa text tiếng Việt"""
     
-    def __init__(self):
+    def __init__(self, normalization_file=None, joined_words_file=None, emoticon_file=None,
+                 sentence_cache_size=4096, segmenter="crf", words_file=None):
+        """
+        Args:
+            normalization_file: File từ điển từ viết tắt bổ sung
+            joined_words_file: File từ điển từ viết liền bổ sung
+            emoticon_file: File từ điển emoticon bổ sung
+            (định dạng file xem load_dictionary_file)
+            sentence_cache_size: Số câu đã chuẩn hóa được nhớ lại (0: tắt cache theo câu,
+                vẫn chuẩn hóa từng câu nên kết quả không đổi)
+            segmenter: Bộ tách từ
+                - "crf": underthesea.word_tokenize (mặc định, chính xác nhất)
+                - "dictionary": longest match theo danh sách từ, nhanh hơn nhiều
+                  (xem word_segmentation.py)
+            words_file: File danh sách từ cho segmenter="dictionary" (None: file mặc định);
+                nếu không có file thì dùng "crf" và báo warning
+        """
+        # Cache theo câu: chỉ những câu chưa gặp mới phải qua bước tách từ
+        self.sentence_cache = LRUCache(sentence_cache_size) if sentence_cache_size else None
+
+        # Bộ tách từ (segmenter/word_list_version là bộ thực sự dùng, nằm trong key cache kết quả)
+        if segmenter not in ("crf", "dictionary"):
+            raise ValueError("segmenter phải là 'crf' hoặc 'dictionary'")
+        self.word_tokenize = self._crf_word_tokenize
+        self.word_list_version = None
+        if segmenter == "dictionary":
+            from word_segmentation import WORDS_FILE, DictionarySegmenter
+            try:
+                self.word_tokenize = DictionarySegmenter(words_file=words_file or WORDS_FILE)
+                self.word_list_version = self.word_tokenize.version
+            except FileNotFoundError as e:
+                warnings.warn(f"{e}; tách từ bằng underthesea.word_tokenize")
+                segmenter = "crf"
+        self.segmenter = segmenter
+
         # Từ điển chuẩn hóa từ viết tắt/thông dụng
         self.normalization_dict = {
             "sp": "sản phẩm", "dk": "được", "dc": "được", "ko": "không",
@@ -191,27 +773,72 @@ class VietnameseTextStandardizer:
             "]+", flags=re.UNICODE
         )
 
+        # Từ điển bổ sung của người dùng
+        if normalization_file:
+            self.normalization_dict.update(load_dictionary_file(normalization_file))
+        if joined_words_file:
+            self.joined_words_dict.update(load_dictionary_file(joined_words_file))
+        if emoticon_file:
+            self.emoticon_sentiment_dict.update(load_dictionary_file(emoticon_file))
+
+        self.rebuild_replacers()
+
+    @staticmethod
+    def _crf_word_tokenize(text):
+        # underthesea chỉ được import khi chuẩn hóa lần đầu
+        return underthesea.word_tokenize(text)
+
+    def rebuild_replacers(self):
+        """Biên dịch lại bộ thay thế sau khi sửa các từ điển"""
+        self.joined_words_replacer = MultiPatternReplacer(self.joined_words_dict)
+        self.emoticon_replacer = MultiPatternReplacer(self.emoticon_sentiment_dict)
+        if self.sentence_cache is not None:
+            self.sentence_cache.clear()
+
+    def add_joined_words(self, mapping):
+        """Thêm từ viết liền vào từ điển"""
+        self.joined_words_dict.update(mapping)
+        self.rebuild_replacers()
+
+    def add_emoticons(self, mapping):
+        """Thêm emoticon vào từ điển"""
+        self.emoticon_sentiment_dict.update(mapping)
+        self.rebuild_replacers()
+
     def split_joined_words(self, text):
         """Tách từ viết liền bằng từ điển"""
-        for joined_word, separated in self.joined_words_dict.items():
-            text = text.replace(joined_word, separated)
-        return text
+        return self.joined_words_replacer.replace(text)
 
     def handle_emoticons(self, text):
         """Chuyển emoticons thành sentiment words"""
-        for emoticon, sentiment_word in self.emoticon_sentiment_dict.items():
-            text = text.replace(emoticon, sentiment_word)
-        return text
+        return self.emoticon_replacer.replace(text)
 
     def standardize(self, text):
         """
         Chuẩn hóa tiếng Việt toàn diện
+
+        Text được chuẩn hóa theo từng câu; sentence_cache chỉ nhớ kết quả của
+        câu đã gặp nên bật hay tắt cache không làm đổi kết quả.
         """
         if not text or not isinstance(text, str):
             return ""
 
+        cleaned_sentences = []
+        for sentence in split_sentences(text):
+            cleaned = self.sentence_cache.get(sentence) if self.sentence_cache is not None else None
+            if cleaned is None:
+                cleaned = self._standardize_sentence(sentence)
+                if self.sentence_cache is not None:
+                    self.sentence_cache.put(sentence, cleaned)
+            if cleaned:
+                cleaned_sentences.append(cleaned)
+
+        return " ".join(cleaned_sentences)
+
+    def _standardize_sentence(self, text):
+        """Chuẩn hóa một câu"""
         # Bước 1: Chuẩn hóa unicode & lowercase
-        normalized = text_normalize(text)
+        normalized = underthesea.text_normalize(text)
 
         # Bước 2: Chuẩn hóa khoảng trắng
         text = re.sub(r'\s+', ' ', normalized).strip()
@@ -223,7 +850,7 @@ class VietnameseTextStandardizer:
         text = self.split_joined_words(text)
 
         # Bước 5: Tách từ (QUAN TRỌNG)
-        tokens = word_tokenize(text)
+        tokens = self.word_tokenize(text)
 
         # Bước 6: Chuẩn hóa từ vựng
         standardized_tokens = []
@@ -238,10 +865,33 @@ class VietnameseTextStandardizer:
         return clean_text
 
 
+# Standardizer riêng của mỗi process worker (analyze_stream với standardize_processes > 0)
+_worker_standardizer = None
+
+
+def _init_standardizer_worker(segmenter="crf", words_file=None):
+    global _worker_standardizer
+    _worker_standardizer = VietnameseTextStandardizer(segmenter=segmenter, words_file=words_file)
+
+
+def _standardize_in_worker(text):
+    return _worker_standardizer.standardize(text)
+
+
+# Đánh dấu kết thúc stream giữa các stage của analyze_stream
+_STREAM_END = object()
+
+
 class VietnameseSentimentAnalyzer:
     """Class chính để phân tích sentiment tiếng Việt"""
     
-    def __init__(self, model_name="wonrax/phobert-base-vietnamese-sentiment"):
+    def __init__(self, model_name=SENTIMENT_MODEL_NAME,
+                 accent_detector=None, window_words=120, window_overlap=24,
+                 aggregation="mean", cache=None, backend="torch", onnx_dir=None,
+                 restorer_path=RESTORER_MODEL_PATH, sentence_cache_size=4096, mmap_weights=False,
+                 graph=None, length_buckets=LENGTH_BUCKETS, num_threads=None, interop_threads=None,
+                 segmenter="crf", words_file=None, cascade_model=None, cascade_threshold=0.9,
+                 dtype=None, restorer=None, standardizer=None):
         """
         Khởi tạo Vietnamese Sentiment Analyzer
         
@@ -250,18 +900,229 @@ class VietnameseSentimentAnalyzer:
                 - "wonrax/phobert-base-vietnamese-sentiment" (PhoBERT sentiment) - Default
                 - "vinai/phobert-base" (PhoBERT base)
                 - "FPTAI/vibert-base-cased" (ViBERT)
+            accent_detector: VietnameseAccentDetector quyết định khi nào bỏ qua
+                model restore dấu (None: dùng cấu hình mặc định)
+            window_words: Số từ tối đa mỗi cửa sổ khi phân loại text dài
+                (None: không chia, text bị cắt theo độ dài tối đa của model)
+            window_overlap: Số từ chồng lấn giữa hai cửa sổ
+            aggregation: Cách gộp score các cửa sổ của một text
+                - "mean": trung bình có trọng số theo số từ mỗi cửa sổ
+                - "max": lấy cửa sổ có confidence cao nhất
+            cache: SentimentResultCache để dùng lại kết quả của text đã phân tích
+                (None: không cache)
+            backend: Backend suy luận cho cả hai model
+                - "torch": PyTorch fp32 (mặc định)
+                - "torch-int8": PyTorch dynamic int8 quantization
+                - "onnx", "onnx-int8": ONNX Runtime (cần export trước, xem inference_backends.py)
+            onnx_dir: Thư mục chứa hai thư mục con sentiment/ và restorer/ của model ONNX
+            restorer_path: Tên/đường dẫn model restore dấu
+            sentence_cache_size: Số câu nhớ lại ở bước restore dấu và chuẩn hóa
+                (0: tắt cache theo câu)
+            mmap_weights: Memory-map trọng số của cả hai model từ file safetensors
+                thay vì copy vào bộ nhớ process; nhiều process trên cùng máy chỉ
+                tốn một bản trọng số trong RAM (xem shared_weights.py)
+            graph: Graph dựng sẵn cho cả hai model theo bucket độ dài (backend torch)
+                - None: chạy eager (mặc định)
+                - "trace": TorchScript
+                - "compile": torch.compile
+            length_buckets: Các độ dài token được tạo graph riêng (pad lên bucket gần nhất)
+            num_threads: Số thread intra-op của PyTorch/ONNX Runtime (None: mặc định)
+            interop_threads: Số thread inter-op của PyTorch (None: mặc định)
+            segmenter: Bộ tách từ khi chuẩn hóa, "crf" (underthesea.word_tokenize)
+                hoặc "dictionary" (longest match, xem word_segmentation.py)
+            words_file: File danh sách từ cho segmenter="dictionary"
+            cascade_model: File model nhẹ (cascade.py train) chạy trước PhoBERT
+                (None: mọi text đều qua PhoBERT)
+            cascade_threshold: Text có confidence của model nhẹ >= giá trị này
+                dùng luôn kết quả model nhẹ, các text còn lại mới qua PhoBERT
+            dtype: None (float32), "bfloat16" hoặc "float16": trọng số nửa độ chính xác
+                cho cả hai model, giảm một nửa bộ nhớ (backend torch)
+            restorer: VietnameseDiacriticRestorer đã load để dùng chung (None: tự tạo
+                khi cần, xem model_registry.py)
+            standardizer: VietnameseTextStandardizer để dùng chung (None: tự tạo khi cần)
+
+        Các model không được load trong __init__ mà ở lần dùng đầu tiên
+        (gọi warmup() để load ngay).
         """
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
-        self.sentiment_pipeline = pipeline(
-            "sentiment-analysis",
-            model=self.model,
-            tokenizer=self.tokenizer
-        )
+        if aggregation not in ("mean", "max"):
+            raise ValueError("aggregation phải là 'mean' hoặc 'max'")
+        self.model_name = model_name
+        self.accent_detector = accent_detector
+        self.window_words = window_words
+        self.window_overlap = window_overlap
+        self.aggregation = aggregation
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.restorer_path = restorer_path
+        self.sentence_cache_size = sentence_cache_size
+        self.mmap_weights = mmap_weights
+        self.graph = graph
+        self.length_buckets = length_buckets
+        self.num_threads = num_threads
+        self.interop_threads = interop_threads
+        self.segmenter = segmenter
+        self.words_file = words_file
+        self.cascade_model = cascade_model
+        self.cascade_threshold = cascade_threshold
+        self.dtype = dtype
+        self.cascade_stats = {
+            "cheap_texts": 0,   # text lấy kết quả model nhẹ
+            "model_texts": 0,   # text chuyển lên PhoBERT
+        }
+
+        # Các thành phần được tạo khi dùng lần đầu
+        self._load_lock = threading.RLock()
+        self._tokenizer = None
+        self._model = None
+        self._engine = None
+        self._cascade = None
+        self._standardizer = standardizer
+        self._restorer = restorer
+
+        # Cache kết quả, key gồm cả phiên bản model nên tự vô hiệu khi đổi model
+        self.cache = cache
+        self._cache_ready = False
+        # True: xóa kết quả của fingerprint khác khi đổi model/cấu hình
+        # (mặc định giữ lại vì file cache có thể dùng chung giữa nhiều process/model)
+        self.cache_invalidate_others = False
+
+    @property
+    def tokenizer(self):
+        if self._model is None:
+            self._load_classifier()
+        return self._tokenizer
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._load_classifier()
+        return self._model
+
+    @property
+    def engine(self):
+        if self._model is None:
+            self._load_classifier()
+        return self._engine
+
+    @property
+    def cascade(self):
+        """Model nhẹ của cascade (None nếu không bật cascade)"""
+        if self._cascade is None and self.cascade_model is not None:
+            with self._load_lock:
+                if self._cascade is None:
+                    from cascade import CascadeClassifier
+                    self._cascade = CascadeClassifier(self.cascade_model)
+        return self._cascade
 
-        # Chuẩn hóa text
-        self.standardizer = VietnameseTextStandardizer()
-        self.restored = VietnameseDiacriticRestorer()
+    @property
+    def standardizer(self):
+        if self._standardizer is None:
+            with self._load_lock:
+                if self._standardizer is None:
+                    self._standardizer = VietnameseTextStandardizer(
+                        sentence_cache_size=self.sentence_cache_size,
+                        segmenter=self.segmenter,
+                        words_file=self.words_file)
+        return self._standardizer
+
+    @property
+    def restored(self):
+        if self._restorer is None:
+            with self._load_lock:
+                if self._restorer is None:
+                    self._restorer = VietnameseDiacriticRestorer(
+                        model_path=self.restorer_path,
+                        accent_detector=self.accent_detector,
+                        sentence_cache_size=self.sentence_cache_size,
+                        backend=self.backend,
+                        onnx_dir=self._onnx_subdir("restorer"),
+                        mmap_weights=self.mmap_weights,
+                        graph=self.graph,
+                        length_buckets=self.length_buckets,
+                        num_threads=self.num_threads,
+                        dtype=self.dtype
+                    )
+        return self._restorer
+
+    def _onnx_subdir(self, name):
+        """Thư mục model ONNX của từng model (None nếu không dùng backend ONNX)"""
+        if not self.backend.startswith("onnx"):
+            return None
+        from inference_backends import ONNX_DIR
+        return os.path.join(self.onnx_dir or ONNX_DIR, name)
+
+    def _load_classifier(self):
+        """Load tokenizer, model sentiment và engine suy luận"""
+        from inference_backends import InferenceEngine, configure_threads, load_model
+
+        with self._load_lock:
+            if self._model is not None:
+                return
+            configure_threads(self.num_threads, self.interop_threads)
+            onnx_dir = self._onnx_subdir("sentiment")
+            self._tokenizer = transformers.AutoTokenizer.from_pretrained(onnx_dir or self.model_name)
+            model = load_model(self.model_name, "sequence-classification", self.backend, onnx_dir,
+                               self.mmap_weights, self.num_threads, self.dtype)
+            self._engine = InferenceEngine(model, self.graph, self.length_buckets)
+            self._model = model
+
+    def warmup(self):
+        """
+        Load ngay tất cả thành phần và chạy thử một lần
+        (dành cho deployment muốn trả giá khởi động trước khi nhận request)
+
+        Returns:
+            dict: Thời gian (giây) của từng bước
+        """
+        timings = {}
+        for name, load in (
+            ("restorer", lambda: self.restored),
+            ("classifier", self._load_classifier),
+            ("standardizer", lambda: self.standardizer.standardize("xin chào")),
+            ("first_inference", lambda: self._analyze_batch(["san pham tot"])),
+        ):
+            start = time.perf_counter()
+            load()
+            timings[name] = time.perf_counter() - start
+        return timings
+
+    def cache_fingerprint(self):
+        """
+        Định danh model và cấu hình ảnh hưởng tới kết quả (dùng trong key cache)
+
+        Revision được đọc từ config nên không cần load trọng số model.
+        """
+        return json.dumps({
+            'model_name': self.model_name,
+            'model_revision': getattr(transformers.AutoConfig.from_pretrained(self.model_name),
+                                      '_commit_hash', None),
+            'restorer': self.restorer_path,
+            'restorer_revision': getattr(transformers.AutoConfig.from_pretrained(self.restorer_path),
+                                         '_commit_hash', None),
+            'window_words': self.window_words,
+            'window_overlap': self.window_overlap,
+            'aggregation': self.aggregation,
+            'backend': self.backend,
+            'segmenter': self.standardizer.segmenter,
+            'word_list': self.standardizer.word_list_version,
+            'cascade': self.cascade.version() if self.cascade is not None else None,
+            'cascade_threshold': self.cascade_threshold if self.cascade is not None else None,
+            'dtype': self.dtype,
+        }, sort_keys=True)
+
+    def _cache_get(self, text):
+        """Lấy kết quả từ cache (đặt fingerprint ở lần dùng đầu)"""
+        if not self._cache_ready:
+            with self._load_lock:
+                if not self._cache_ready:
+                    self.cache.set_fingerprint(self.cache_fingerprint(),
+                                               invalidate_others=self.cache_invalidate_others)
+                    self._cache_ready = True
+        cached = self.cache.get(text)
+        # Kết quả cache từ trước khi có 'tier' không biết tier nào tạo ra: tính lại
+        if cached is None or 'tier' not in cached:
+            return None
+        return {'original_text': text, **cached}
 
     def analyze_sentiment(self, text):
         """
@@ -276,31 +1137,405 @@ class VietnameseSentimentAnalyzer:
                 'text': text đã được xử lý,
                 'sentiment': label (NEG/POS/NEU),
                 'confidence': confidence score (0-1)
-                'all_scores': scores cho tất cả labels
+                'all_scores': scores cho tất cả labels,
+                'tier': TIER_MODEL (PhoBERT) hoặc TIER_CHEAP (model nhẹ của cascade),
+                'timings': chỉ có khi bật instrumentation (xem instrumentation.py):
+                    {'seconds': thời gian từng bước, 'words': số từ (tách
+                     theo khoảng trắng, không phải sub-token của model) đầu
+                     vào từng bước, 'batch_size': số text cùng batch}
             }
         """
+        timer = StageTimer() if METRICS.enabled else None
+
+        if self.cache is not None:
+            cached = self._cache_get(text)
+            if timer is not None:
+                timer.mark('cache')
+            if cached is not None:
+                if timer is not None:
+                    cached['timings'] = timer.finish()
+                return cached
+
         # 1. Restore dấu
         restored_text = self.restored.restore(text)
+        if timer is not None:
+            timer.mark('restore', words=len(text.split()))
 
         # 2. Chuẩn hóa text
         cleaned_text = self.standardizer.standardize(restored_text)
+        if timer is not None:
+            timer.mark('standardize', words=len(restored_text.split()))
 
         # 3. Phân tích sentiment bằng model đã fine-tuned
         # Lấy tất cả scores để hiển thị đầy đủ
-        result = self.sentiment_pipeline(cleaned_text, return_all_scores=True)
-        
+        outputs, tiers = self._classify_tiers([cleaned_text])
+        if timer is not None:
+            timer.mark('classify', words=len(cleaned_text.split()))
+
+        result = self._build_result(text, cleaned_text, outputs[0], tiers[0])
+        if self.cache is not None:
+            self.cache.put(text, result)
+        if timer is not None:
+            result['timings'] = timer.finish()
+        return result
+
+    def analyze_many(self, texts, batch_size=32):
+        """
+        Phân tích sentiment cho nhiều text cùng lúc
+
+        Các text được sắp xếp theo độ dài rồi chia thành các bucket
+        batch_size phần tử, nên mỗi batch chỉ cần pad tới text dài nhất
+        trong bucket (dynamic padding). Cả model restore dấu và model
+        sentiment đều chạy trên từng batch thay vì từng text.
+
+        Args:
+            texts: Danh sách text cần phân tích
+            batch_size: Số text trong mỗi batch
+
+        Returns:
+            list: Danh sách dict cùng format với analyze_sentiment,
+                  giữ nguyên thứ tự của texts ('timings' khi bật
+                  instrumentation là của cả batch chứa text)
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size phải >= 1")
+
+        texts = list(texts)
+        results = [None] * len(texts)
+
+        pending = range(len(texts))
+        if self.cache is not None:
+            start = time.perf_counter() if METRICS.enabled else None
+            pending = []
+            for i, text in enumerate(texts):
+                results[i] = self._cache_get(text)
+                if results[i] is None:
+                    pending.append(i)
+            if start is not None:
+                METRICS.observe('cache', time.perf_counter() - start, batch_size=len(texts))
+
+        # Sắp theo số từ để các text dài gần nhau nằm chung bucket
+        order = sorted(pending, key=lambda i: len(texts[i].split()))
+
+        for start in range(0, len(order), batch_size):
+            indexes = order[start:start + batch_size]
+            batch = [texts[i] for i in indexes]
+
+            for i, text, result in zip(indexes, batch, self._analyze_batch(batch)):
+                results[i] = result
+                if self.cache is not None:
+                    self.cache.put(text, result)
+
+        return results
+
+    def analyze_stream(self, texts, batch_size=32, prefetch=2, standardize_processes=0):
+        """
+        Phân tích sentiment cho một stream text (có thể không giới hạn)
+
+        Các bước chạy thành pipeline trên các thread riêng, nối với nhau bằng
+        hàng đợi có giới hạn prefetch batch:
+            restore dấu (XLM-R) -> chuẩn hóa (underthesea) -> sentiment (PhoBERT)
+        nên trong khi model xử lý batch N, batch N+1 đã được chuẩn hóa song
+        song. Kết quả trả ra theo đúng thứ tự đầu vào, bộ nhớ giữ ở mức
+        khoảng (prefetch * 2 + 3) * batch_size text bất kể độ dài stream.
+
+        Args:
+            texts: Iterable text (có thể là generator)
+            batch_size: Số text mỗi batch
+            prefetch: Số batch tối đa chờ giữa hai bước liền nhau
+            standardize_processes: Số process chuẩn hóa song song
+                (0: chuẩn hóa trên một thread của process hiện tại)
+
+        Yields:
+            dict: Kết quả cùng format với analyze_sentiment
+        """
+        if batch_size < 1 or prefetch < 1:
+            raise ValueError("batch_size và prefetch phải >= 1")
+
+        stop = threading.Event()
+        restored_queue = queue.Queue(maxsize=prefetch)
+        cleaned_queue = queue.Queue(maxsize=prefetch)
+
+        def put(q, item):
+            # Dừng chờ nếu consumer đã đóng generator
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q):
+            while True:
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    if stop.is_set():
+                        return _STREAM_END
+
+        def restore_stage():
+            try:
+                batch = []
+                for text in texts:
+                    batch.append(text)
+                    if len(batch) == batch_size:
+                        if not put(restored_queue, self._stream_restore(batch)):
+                            return
+                        batch = []
+                if batch:
+                    put(restored_queue, self._stream_restore(batch))
+                put(restored_queue, _STREAM_END)
+            except BaseException as e:
+                put(restored_queue, e)
+
+        def standardize_stage(executor):
+            try:
+                while True:
+                    item = get(restored_queue)
+                    if item is _STREAM_END or isinstance(item, BaseException):
+                        put(cleaned_queue, item)
+                        return
+                    if item['timer'] is not None:
+                        item['timer'].restart()
+                    if item['restored']:
+                        if executor is None:
+                            item['cleaned'] = [self.standardizer.standardize(t) for t in item['restored']]
+                        else:
+                            item['cleaned'] = list(executor.map(_standardize_in_worker, item['restored']))
+                    if item['timer'] is not None:
+                        item['timer'].mark('standardize', words=sum(len(t.split()) for t in item['restored']))
+                    if not put(cleaned_queue, item):
+                        return
+            except BaseException as e:
+                put(cleaned_queue, e)
+
+        # Load model trước khi tạo process/thread để lỗi load được báo ngay
+        # (và không để lại worker process khi load lỗi)
+        self._load_classifier()
+
+        executor = None
+        if standardize_processes:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                standardize_processes, initializer=_init_standardizer_worker,
+                initargs=(self.segmenter, self.words_file))
+
+        workers = [
+            threading.Thread(target=restore_stage, name="sentiment-restore", daemon=True),
+            threading.Thread(target=standardize_stage, args=(executor,), name="sentiment-standardize",
+                             daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            while True:
+                item = get(cleaned_queue)
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+
+                results = item['results']
+                timer = item['timer']
+                if timer is not None:
+                    timer.restart()
+                if item['pending']:
+                    outputs, tiers = self._classify_tiers(item['cleaned'], batch_size=batch_size)
+                    for i, cleaned_text, scores, tier in zip(item['pending'], item['cleaned'], outputs, tiers):
+                        results[i] = self._build_result(item['texts'][i], cleaned_text, scores, tier)
+                        if self.cache is not None:
+                            self.cache.put(item['texts'][i], results[i])
+                if timer is not None:
+                    timer.mark('classify', words=sum(len(t.split()) for t in item['cleaned']))
+                    timings = timer.finish()
+                    for result in results:
+                        result['timings'] = timings
+                yield from results
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+            if executor is not None:
+                executor.shutdown()
+
+    def _stream_restore(self, batch):
+        """Bước restore dấu của analyze_stream (bỏ qua text đã có trong cache kết quả)"""
+        timer = StageTimer(batch_size=len(batch)) if METRICS.enabled else None
+        results = [None] * len(batch)
+        if self.cache is not None:
+            results = [self._cache_get(text) for text in batch]
+            if timer is not None:
+                timer.mark('cache')
+        pending = [i for i, result in enumerate(results) if result is None]
+        restored = self.restored.restore_batch([batch[i] for i in pending]) if pending else []
+        if timer is not None:
+            timer.mark('restore', words=sum(len(batch[i].split()) for i in pending))
+        return {
+            'texts': batch,
+            'results': results,
+            'pending': pending,
+            'restored': restored,
+            'cleaned': [],
+            'timer': timer,
+        }
+
+    def _analyze_batch(self, batch):
+        """Chạy đủ các bước cho một batch text (không dùng cache kết quả)"""
+        timer = StageTimer(batch_size=len(batch)) if METRICS.enabled else None
+
+        # 1. Restore dấu
+        restored_texts = self.restored.restore_batch(batch)
+        if timer is not None:
+            timer.mark('restore', words=sum(len(t.split()) for t in batch))
+
+        # 2. Chuẩn hóa text
+        cleaned_texts = [self.standardizer.standardize(t) for t in restored_texts]
+        if timer is not None:
+            timer.mark('standardize', words=sum(len(t.split()) for t in restored_texts))
+
+        # 3. Phân tích sentiment
+        outputs, tiers = self._classify_tiers(cleaned_texts, batch_size=len(batch))
+        if timer is not None:
+            timer.mark('classify', words=sum(len(t.split()) for t in cleaned_texts))
+
+        results = [
+            self._build_result(text, cleaned_text, scores, tier)
+            for text, cleaned_text, scores, tier in zip(batch, cleaned_texts, outputs, tiers)
+        ]
+        if timer is not None:
+            timings = timer.finish()
+            for result in results:
+                result['timings'] = timings
+        return results
+
+    def get_cascade_stats(self):
+        """Số text mỗi tier của cascade đã xử lý"""
+        return dict(self.cascade_stats)
+
+    def _classify(self, cleaned_texts, batch_size=32):
+        """
+        Chạy model sentiment cho nhiều text đã chuẩn hóa (xem _classify_tiers)
+
+        Returns:
+            list: Mỗi phần tử là danh sách {'label', 'score'} của một text
+        """
+        return self._classify_tiers(cleaned_texts, batch_size)[0]
+
+    def _classify_tiers(self, cleaned_texts, batch_size=32):
+        """
+        Chạy model sentiment cho nhiều text đã chuẩn hóa, kèm tier tạo ra kết quả
+
+        Khi bật cascade, model nhẹ chạy trước; chỉ những text nó chưa đủ chắc
+        chắn (confidence < cascade_threshold) mới qua PhoBERT.
+
+        Text dài hơn window_words từ (hoặc vượt số sub-token tối đa của model)
+        được chia thành các cửa sổ chồng lấn, cửa sổ của mọi text chạy chung
+        batch, rồi score được gộp lại theo self.aggregation.
+
+        Returns:
+            tuple: (scores, tiers) - scores[i] là danh sách {'label', 'score'}
+                   của text i, tiers[i] là TIER_CHEAP hoặc TIER_MODEL
+        """
+        results = [None] * len(cleaned_texts)
+        tiers = [TIER_MODEL] * len(cleaned_texts)
+        pending = list(range(len(cleaned_texts)))
+        if self.cascade is not None:
+            cheap_scores = self.cascade.predict_scores(cleaned_texts)
+            pending = [i for i, scores in enumerate(cheap_scores)
+                       if max(item['score'] for item in scores) < self.cascade_threshold]
+            for i, scores in enumerate(cheap_scores):
+                results[i] = scores
+                tiers[i] = TIER_CHEAP
+            for i in pending:
+                tiers[i] = TIER_MODEL
+            self.cascade_stats["cheap_texts"] += len(cleaned_texts) - len(pending)
+            self.cascade_stats["model_texts"] += len(pending)
+            if not pending:
+                return results, tiers
+
+        windows = []
+        owners = []
+        max_tokens = max_content_tokens(self.tokenizer)
+        for i in pending:
+            words = cleaned_texts[i].split()
+            for start, end, _, _ in fit_windows(words, self.window_words, self.window_overlap,
+                                                max_tokens, self._count_tokens):
+                windows.append(" ".join(words[start:end]))
+                owners.append((i, max(end - start, 1)))
+
+        outputs = self._forward_scores(windows, batch_size)
+
+        per_text = {i: [] for i in pending}
+        for (i, weight), scores in zip(owners, outputs):
+            per_text[i].append((weight, scores))
+
+        for i, window_scores in per_text.items():
+            results[i] = self._aggregate_scores(window_scores)
+        return results, tiers
+
+    def _count_tokens(self, words):
+        """Số sub-token của từng từ"""
+        return [len(ids) for ids in self.tokenizer(words, add_special_tokens=False)['input_ids']]
+
+    def _forward_scores(self, texts, batch_size):
+        """
+        Chạy model sentiment cho nhiều text, trả về score của mọi label
+
+        Text được sắp theo độ dài trước khi chia batch để giảm padding;
+        softmax tính trên tensor của cả batch.
+
+        Returns:
+            list: Mỗi phần tử là danh sách {'label', 'score'} (cùng thứ tự với texts)
+        """
+        id2label = self.model.config.id2label
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        outputs = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [texts[i] for i in indices],
+                padding=True,
+                truncation=True,
+                return_tensors="pt"
+            )
+            logits = self.engine(**inputs)
+            # 1 label dùng sigmoid, nhiều label dùng softmax
+            probs = logits.sigmoid() if logits.shape[-1] == 1 else logits.softmax(dim=-1)
+            for i, row in zip(indices, probs.tolist()):
+                outputs[i] = [{'label': id2label[j], 'score': score} for j, score in enumerate(row)]
+        return outputs
+
+    def _aggregate_scores(self, window_scores):
+        """Gộp score của các cửa sổ thuộc cùng một text"""
+        if len(window_scores) == 1:
+            return window_scores[0][1]
+
+        if self.aggregation == "max":
+            return max(window_scores, key=lambda ws: max(item['score'] for item in ws[1]))[1]
+
+        total_weight = sum(weight for weight, _ in window_scores)
+        sums = {}
+        for weight, scores in window_scores:
+            for item in scores:
+                sums[item['label']] = sums.get(item['label'], 0.0) + weight * item['score']
+        return [{'label': label, 'score': value / total_weight} for label, value in sums.items()]
+
+    def _build_result(self, text, cleaned_text, scores, tier=TIER_MODEL):
+        """Tạo dict kết quả từ danh sách scores của model (tier: model tạo ra scores)"""
         # Tạo dictionary scores cho tất cả labels
         all_scores = {}
-        for item in result[0]:
+        for item in scores:
             all_scores[item['label']] = item['score']
-        
+
         # Lấy label có score cao nhất
-        top_result = max(result[0], key=lambda x: x['score'])
+        top_result = max(scores, key=lambda x: x['score'])
 
         return {
             'original_text': text,
             'text': cleaned_text,
             'sentiment': top_result['label'],
             'confidence': top_result['score'],
-            'all_scores': all_scores 
+            'all_scores': all_scores,
+            'tier': tier
         }
\ No newline at end of file
@@ -0,0 +1,228 @@
+"""
+Tách từ tiếng Việt bằng từ điển (longest match), thay cho underthesea.word_tokenize
+
+word_tokenize dùng CRF nên chiếm phần lớn thời gian CPU ngoài model. Bộ tách
+từ ở đây chỉ tra từ điển: tại mỗi vị trí lấy từ dài nhất (tính theo âm tiết)
+có trong danh sách từ, kết quả của từng cụm âm tiết được nhớ trong LRU cache.
+Nhanh hơn nhiều nhưng không khớp hoàn toàn với CRF, nên đo độ khớp trước khi dùng:
+
+    python word_segmentation.py build --corpus reviews.txt        # tạo danh sách từ
+    python word_segmentation.py parity --corpus reviews.txt       # so với word_tokenize
+
+Dùng: VietnameseSentimentAnalyzer(segmenter="dictionary")
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from collections import Counter
+
+from vietnamese_sentiment import (
+    BASE_DIR, LRUCache, VietnameseSentimentAnalyzer, VietnameseTextStandardizer, underthesea
+)
+
+SEGMENTERS = ("crf", "dictionary")
+
+# Danh sách từ nhiều âm tiết, mỗi dòng một từ (các âm tiết cách nhau bởi dấu cách);
+# file mặc định đi kèm repo, tạo lại theo corpus riêng bằng lệnh build
+WORDS_FILE = os.path.join(BASE_DIR, "vietnamese_words.txt")
+
+# Âm tiết/số (1.000, 3,5) hoặc một ký tự không phải chữ
+TOKEN_PATTERN = re.compile(r"\w+(?:[.,]\w+)*|[^\w\s]")
+
+
+def load_words(fpath=WORDS_FILE):
+    """Đọc danh sách từ, bỏ qua dòng trống và dòng bắt đầu bằng '#'"""
+    if not os.path.exists(fpath):
+        raise FileNotFoundError(
+            f"Không tìm thấy {fpath}. Chạy: python word_segmentation.py build --corpus <file>")
+    with open(fpath, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+class DictionarySegmenter:
+    """Tách từ longest match theo danh sách từ, có cache theo cụm âm tiết"""
+
+    def __init__(self, words=None, words_file=WORDS_FILE, ngram_cache_size=65536):
+        """
+        Args:
+            words: Danh sách từ (None: đọc từ words_file)
+            words_file: File danh sách từ (xem load_words)
+            ngram_cache_size: Số cụm âm tiết đã tách được nhớ lại (0: tắt cache)
+        """
+        if words is None:
+            words = load_words(words_file)
+        self.words = set()
+        self.max_syllables = 1
+        for word in words:
+            syllables = tuple(word.lower().split())
+            if len(syllables) > 1:
+                self.words.add(syllables)
+                self.max_syllables = max(self.max_syllables, len(syllables))
+        self.ngram_cache = LRUCache(ngram_cache_size) if ngram_cache_size else None
+        # Định danh nội dung danh sách từ (đổi khi build lại/đổi file), dùng trong key cache kết quả
+        self.version = hashlib.sha1(
+            "\n".join(sorted(" ".join(word) for word in self.words)).encode("utf-8")).hexdigest()[:16]
+
+    def __call__(self, text):
+        """
+        Tách từ, cùng format với underthesea.word_tokenize(text)
+
+        Returns:
+            list: Các từ, âm tiết trong một từ cách nhau bởi dấu cách
+        """
+        tokens = []
+        run = []
+        for token in TOKEN_PATTERN.findall(text):
+            if token[0].isalpha():
+                run.append(token)
+                continue
+            # Dấu câu/số ngắt cụm âm tiết: không có từ nào đi qua chúng
+            tokens.extend(self._segment_run(run))
+            tokens.append(token)
+            run = []
+        tokens.extend(self._segment_run(run))
+        return tokens
+
+    def _segment_run(self, syllables):
+        """Tách một cụm âm tiết liên tiếp (có cache)"""
+        if len(syllables) < 2:
+            return syllables
+        if self.ngram_cache is None:
+            return self._longest_match(syllables)
+        key = tuple(syllables)
+        words = self.ngram_cache.get(key)
+        if words is None:
+            words = self._longest_match(syllables)
+            self.ngram_cache.put(key, words)
+        return words
+
+    def _longest_match(self, syllables):
+        lowered = [s.lower() for s in syllables]
+        words = []
+        i = 0
+        while i < len(syllables):
+            length = min(self.max_syllables, len(syllables) - i)
+            while length > 1 and tuple(lowered[i:i + length]) not in self.words:
+                length -= 1
+            words.append(" ".join(syllables[i:i + length]))
+            i += length
+        return words
+
+
+def build_word_list(texts, min_count=1):
+    """
+    Tạo danh sách từ nhiều âm tiết từ kết quả word_tokenize trên corpus
+
+    Returns:
+        list: Các từ (chữ thường) xuất hiện ít nhất min_count lần, nhiều nhất trước
+    """
+    counts = Counter()
+    for text in texts:
+        for word in underthesea.word_tokenize(underthesea.text_normalize(text)):
+            syllables = word.lower().split()
+            if len(syllables) > 1 and all(s.isalpha() for s in syllables):
+                counts[" ".join(syllables)] += 1
+    return [word for word, count in counts.most_common() if count >= min_count]
+
+
+def _boundaries(tokens):
+    """Tập (vị trí bắt đầu, số âm tiết) của từng từ, theo chỉ số âm tiết"""
+    spans = set()
+    position = 0
+    for token in tokens:
+        length = len(token.split())
+        spans.add((position, length))
+        position += length
+    return spans
+
+
+def parity_report(texts, words_file=WORDS_FILE, analyzer_kwargs=None):
+    """
+    So sánh tách từ bằng từ điển với underthesea.word_tokenize
+
+    Returns:
+        dict: Độ khớp ở mức từ (precision/recall/F1 theo ranh giới từ, tỉ lệ câu khớp
+              hoàn toàn), tốc độ tách từ, và độ khớp text chuẩn hóa/label sentiment
+              của analyzer dùng mỗi bộ tách từ
+    """
+    segmenter = DictionarySegmenter(words_file=words_file, ngram_cache_size=0)
+    standardizer = VietnameseTextStandardizer(sentence_cache_size=0)
+    prepared = [standardizer.split_joined_words(standardizer.handle_emoticons(
+        re.sub(r'\s+', ' ', underthesea.text_normalize(text)).strip())) for text in texts]
+
+    start = time.perf_counter()
+    reference = [underthesea.word_tokenize(text) for text in prepared]
+    crf_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    candidate = [segmenter(text) for text in prepared]
+    dictionary_seconds = time.perf_counter() - start
+
+    matched = predicted = expected = 0
+    for ref, cand in zip(reference, candidate):
+        ref_spans, cand_spans = _boundaries(ref), _boundaries(cand)
+        matched += len(ref_spans & cand_spans)
+        predicted += len(cand_spans)
+        expected += len(ref_spans)
+    precision = matched / predicted if predicted else 1.0
+    recall = matched / expected if expected else 1.0
+
+    results = {}
+    for name in SEGMENTERS:
+        analyzer = VietnameseSentimentAnalyzer(
+            segmenter=name, words_file=words_file, sentence_cache_size=0, **(analyzer_kwargs or {}))
+        results[name] = analyzer.analyze_many(texts)
+
+    return {
+        "num_texts": len(texts),
+        "num_words": len(segmenter.words),
+        "word_precision": precision,
+        "word_recall": recall,
+        "word_f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "exact_match": sum(ref == cand for ref, cand in zip(reference, candidate)) / len(texts),
+        "crf_texts_per_sec": len(texts) / crf_seconds if crf_seconds else None,
+        "dictionary_texts_per_sec": len(texts) / dictionary_seconds if dictionary_seconds else None,
+        "standardized_text_agreement": sum(
+            a['text'] == b['text'] for a, b in zip(results["crf"], results["dictionary"])) / len(texts),
+        "label_agreement": sum(
+            a['sentiment'] == b['sentiment'] for a, b in zip(results["crf"], results["dictionary"])) / len(texts),
+    }
+
+
+def _read_corpus(path):
+    """Đọc corpus từ file (mỗi dòng một text) hoặc từ lịch sử trong database"""
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    import database
+    return [row[1] for row in database.get_sentiment_analysis()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tách từ tiếng Việt bằng từ điển")
+    parser.add_argument("--words-file", default=WORDS_FILE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Tạo danh sách từ từ kết quả word_tokenize")
+    build_parser.add_argument("--corpus", help="File text, mỗi dòng một văn bản (mặc định: lịch sử trong database)")
+    build_parser.add_argument("--min-count", type=int, default=1)
+
+    parity_parser = subparsers.add_parser("parity", help="So sánh với word_tokenize")
+    parity_parser.add_argument("--corpus", help="File text, mỗi dòng một văn bản (mặc định: lịch sử trong database)")
+    args = parser.parse_args()
+
+    texts = _read_corpus(args.corpus)
+    if args.command == "build":
+        words = build_word_list(texts, args.min_count)
+        with open(args.words_file, 'w', encoding='utf-8') as f:
+            f.write("\n".join(words) + "\n")
+        print(f"Đã ghi {len(words)} từ vào {args.words_file}")
+    else:
+        print(json.dumps(parity_report(texts, args.words_file), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()